@@ -0,0 +1,21 @@
+from app.db import Base
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, Text
+
+
+class PredictionAudit(Base):
+    __tablename__ = "prediction_audit"
+    __table_args__ = (
+        # Finds the predictions of a user in a time range
+        Index("ix_prediction_audit_user_id_created_at", "user_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, nullable=False)
+    # No foreign key, the audit outlives the deleted users
+    user_id = Column(Integer)
+    user_email = Column(String(255))
+    features = Column(Text, nullable=False)
+    prediction = Column(String(50))
+    score = Column(Float)
+    model_version = Column(String(50))
+    latency_ms = Column(Float)
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from app import db
+from app import settings
+from app.auth.schema import TokenData
+from fastapi import HTTPException, status
+
+from .writer import AuditBufferFull, AuditWriter
+
+# Predictions waiting to be written to the audit log by this process
+audit_log = AuditWriter(
+    session_factory=db.SessionLocal,
+    max_size=settings.AUDIT_BUFFER_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+    backpressure_timeout=settings.AUDIT_BACKPRESSURE_TIMEOUT,
+    retry_backoff_cap=settings.AUDIT_RETRY_BACKOFF_CAP,
+)
+
+
+async def record_predictions(current_user: TokenData, rows, results, version, latency):
+    """
+    Adds predictions to the audit log. They are written to the database in
+    the background, so this only waits when the audit log falls behind.
+
+    Args:
+        current_user (TokenData): The user who asked for the predictions.
+        rows (list[dict]): Input features of every prediction.
+        results (list[tuple]): Prediction and score of every row, and any other outputs.
+        version (str): Version of the model that scored them.
+        latency (float): Time (seconds) taken to score them.
+
+    Raises:
+        HTTPException: 503 if the audit log is too far behind to take them.
+    """
+    created_at = datetime.utcnow()
+    latency_ms = latency * 1000
+
+    try:
+        for features, (prediction, score, *_) in zip(rows, results):
+            await audit_log.record({
+                "created_at": created_at,
+                "user_id": current_user.id,
+                "user_email": current_user.email,
+                "features": features,
+                "prediction": str(prediction),
+                "score": score,
+                "model_version": version,
+                "latency_ms": latency_ms,
+            })
+    except AuditBufferFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The prediction audit log is not available, try again later",
+        )
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import time
+
+from app.db import AsyncSession
+from app.metrics.instruments import AUDIT_ROWS
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+
+from .models import PredictionAudit
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBufferFull(Exception):
+    """
+    Raised when a prediction can't be buffered for the audit log in time.
+    """
+
+
+class AuditWriter:
+    """
+    Write-behind log of the predictions.
+
+    The requests only append their rows to a bounded in-memory buffer, and a
+    background task inserts them into the database in batches, with a single
+    multi-row INSERT every `batch_size` rows or `flush_interval` seconds,
+    whichever comes first. Only the failures caused by the data are blamed
+    on the rows (see `_is_row_error`): the batch is split in halves and
+    retried, down to single rows, and the rows that still can't be written
+    are logged and dropped so they don't hold back the ones after them. Any
+    other failure, like a lost connection or a database that is not
+    available, is retried with backoff, keeping the rows.
+
+    When the database falls behind and the buffer is full, the requests wait
+    up to `backpressure_timeout` seconds for room before failing, so the
+    memory used stays bounded and no prediction goes unaudited.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        max_size: int,
+        batch_size: int,
+        flush_interval: float,
+        backpressure_timeout: float,
+        retry_backoff_cap: float,
+    ):
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure_timeout = backpressure_timeout
+        self.retry_backoff_cap = retry_backoff_cap
+
+        # Created on first use, inside the event loop
+        self._queue = None
+        self._batch_ready = None
+        self._task = None
+        # Rows taken from the buffer and not inserted yet
+        self._pending = []
+
+        self.written = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.failures = 0
+
+    def _start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._batch_ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        self._task.add_done_callback(self._restart)
+
+    def _restart(self, task):
+        """
+        Starts the background task again if it stopped with an error, so
+        the buffered rows keep being written.
+        """
+        if task is not self._task or task.cancelled() or task.exception() is None:
+            return
+
+        logger.error("The audit writer stopped, restarting it", exc_info=task.exception())
+        self._task = asyncio.ensure_future(self._run())
+        self._task.add_done_callback(self._restart)
+
+    async def record(self, row: dict):
+        """
+        Appends a prediction to the buffer, waiting for room if it's full.
+
+        Raises:
+            AuditBufferFull: If there's still no room after `backpressure_timeout` seconds.
+        """
+        if self._task is None:
+            self._start()
+
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(row), self.backpressure_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                AUDIT_ROWS.labels("rejected").inc()
+                raise AuditBufferFull() from None
+
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _run(self):
+        while True:
+            self._pending.append(await self._queue.get())
+
+            # Wait for a full batch, or until the oldest row waited enough
+            if self._queue.qsize() + 1 < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_ready.clear()
+
+            while len(self._pending) < self.batch_size and not self._queue.empty():
+                self._pending.append(self._queue.get_nowait())
+
+            await self._write(self._pending)
+            self._pending = []
+
+    async def _write(self, rows):
+        """
+        Inserts the rows with a single statement, retrying while the database
+        or the connection fails. If the rows themselves fail, they are written
+        in halves instead.
+        """
+        backoff = 0.1
+        while True:
+            try:
+                await self._insert(rows)
+                break
+            except Exception as e:
+                self.failures += 1
+                if _is_row_error(e):
+                    await self._write_halves(rows, e)
+                    return
+                logger.warning("Could not write %d audit rows, retrying in %.1f s: %s", len(rows), backoff, e)
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.retry_backoff_cap)
+
+        self.written += len(rows)
+        AUDIT_ROWS.labels("written").inc(len(rows))
+
+    async def _write_halves(self, rows, error):
+        """
+        Writes each half of rows that failed together, down to single rows,
+        dropping the rows that fail on their own.
+        """
+        if len(rows) == 1:
+            self.dropped += 1
+            AUDIT_ROWS.labels("dropped").inc()
+            logger.error(
+                "Dropped the audit row of a prediction of user %s at %s, it can't be written: %r",
+                rows[0].get("user_id"),
+                rows[0].get("created_at"),
+                error,
+            )
+            return
+
+        logger.warning("Could not write %d audit rows, writing them in halves: %r", len(rows), error)
+        half = len(rows) // 2
+        await self._write(rows[:half])
+        await self._write(rows[half:])
+
+    async def _insert(self, rows):
+        database = AsyncSession(self.session_factory())
+        try:
+            await database.run_sync(_insert, rows)
+        finally:
+            await database.close()
+
+    async def close(self, timeout: float):
+        """
+        Writes the buffered rows, waiting up to `timeout` seconds for them.
+        The ones that couldn't be written by then are logged as lost.
+        """
+        if self._task is None:
+            return
+
+        deadline = time.monotonic() + timeout
+        while (self._pending or not self._queue.empty()) and time.monotonic() < deadline:
+            self._batch_ready.set()
+            await asyncio.sleep(0.05)
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("The audit writer stopped with an error")
+
+        lost = len(self._pending) + self._queue.qsize()
+        if lost:
+            AUDIT_ROWS.labels("lost").inc(lost)
+            logger.error("Lost %d audit rows that could not be written before shutting down", lost)
+
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self._queue.qsize() + len(self._pending) if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "written": self.written,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "failures": self.failures,
+        }
+
+
+def _is_row_error(e) -> bool:
+    """
+    Whether an insert failed because of the rows themselves: the database
+    rejected their values, or they couldn't be serialized or bound before
+    reaching it. A failure that invalidated the connection never is, even if
+    the driver reported it as a data error.
+    """
+    if isinstance(e, DBAPIError):
+        return isinstance(e, (IntegrityError, DataError)) and not e.connection_invalidated
+    return isinstance(e, (StatementError, TypeError, ValueError, KeyError))
+
+
+def _insert(session, rows):
+    """
+    Inserts the buffered rows in a single multi-row INSERT.
+    """
+    values = [
+        {
+            "created_at": row["created_at"],
+            "user_id": row["user_id"],
+            "user_email": row["user_email"],
+            "features": json.dumps(row["features"]),
+            "prediction": row["prediction"],
+            "score": row["score"],
+            "model_version": row["model_version"],
+            "latency_ms": row["latency_ms"],
+        }
+        for row in rows
+    ]
+    try:
+        session.execute(PredictionAudit.__table__.insert().values(values))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
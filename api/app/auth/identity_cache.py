@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+
+
+class IdentityCache:
+    """
+    LRU cache of the identity of the users (their token data with the id and
+    name), keyed by email, for the access tokens that don't carry it in
+    their claims, like the ones issued before it was added. Entries expire
+    `ttl` seconds after being stored, so a change to a user reaches every
+    API process within that time.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, email: str):
+        """
+        Returns the cached identity of a user, or None if it isn't cached or
+        it expired.
+        """
+        entry = self._entries.get(email)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        identity, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[email]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(email)
+        self.hits += 1
+        return identity
+
+    def put(self, identity):
+        """
+        Stores the identity of a user read from the database just now.
+        """
+        if self.max_size <= 0:
+            return
+
+        self._entries[identity.email] = (identity, time.monotonic() + self.ttl)
+        self._entries.move_to_end(identity.email)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, user_id: int):
+        """
+        Drops the identity of a deleted user.
+        """
+        for email, (identity, _) in list(self._entries.items()):
+            if identity.id == user_id:
+                del self._entries[email]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
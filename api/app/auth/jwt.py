@@ -1,15 +1,50 @@
+import time
 from datetime import datetime, timedelta
 
+import redis.asyncio as redis
+from app import db
+from app import redis_pool
+from app import settings
+from app.metrics.instruments import TOKEN_CACHE_LOOKUPS
 from app.settings import SECRET_KEY
+from app.user.models import User
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
 from . import schema
+from .identity_cache import IdentityCache
+from .token_cache import TokenCache
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Tokens verified by this process, shared by every request
+token_cache = TokenCache(
+    max_size=settings.TOKEN_CACHE_SIZE,
+    revocation_check=settings.TOKEN_REVOCATION_CHECK,
+)
+
+# Users of the tokens without the user ID in their claims
+identity_cache = IdentityCache(
+    max_size=settings.IDENTITY_CACHE_SIZE,
+    ttl=settings.IDENTITY_CACHE_TTL,
+)
+
+
+def user_claims(user: User) -> dict:
+    """
+    Returns the claims identifying a user in their access tokens, so the
+    services don't have to read the user from the database.
+
+    Args:
+        user (User): The user the token is issued to.
+
+    Returns:
+        dict: The email ("sub"), ID ("uid") and name of the user.
+    """
+    return {"sub": user.email, "uid": user.id, "name": user.name}
+
 
 def create_access_token(data: dict) -> str:
     """
@@ -40,31 +75,97 @@ def verify_token(token: str, credentials_exception):
     algorithm. It checks for the presence of the user's email in the token's payload.
     If the email is not found or the token is invalid, an exception is raised.
 
+    Verified tokens are cached until they expire, so the signature of a token
+    is only checked the first time this process sees it. Revoked tokens are
+    always refused.
+
     Args:
         token (str): The JWT token to be verified.
         credentials_exception: The exception to raise if the token is invalid or the email is not found.
 
     Returns:
-        TokenData: An object containing the user's email extracted from the token.
+        TokenData: An object containing the user's email, and their ID and name if the
+                   token has them, extracted from the token.
 
     Raises:
         credentials_exception: If the token is invalid or does not contain an email.
     """
+    key = token_cache.make_key(token)
+    if token_cache.is_revoked(key):
+        TOKEN_CACHE_LOOKUPS.labels("revoked").inc()
+        raise credentials_exception
+
+    token_data = token_cache.get(key)
+    if token_data is not None:
+        TOKEN_CACHE_LOOKUPS.labels("hit").inc()
+        return token_data
+
+    TOKEN_CACHE_LOOKUPS.labels("miss").inc()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = schema.TokenData(email=email)
+        token_data = schema.TokenData(email=email, id=payload.get("uid"), name=payload.get("name"))
     except JWTError:
         raise credentials_exception
+
+    # Tokens without an expiration are verified every time
+    if "exp" in payload:
+        token_cache.put(key, token_data, payload["exp"])
+
     return token_data
 
 
+async def revoke_token(token: str, credentials_exception):
+    """
+    Revokes a valid JWT token until it expires, in every API process.
+
+    The other processes refuse it within `settings.TOKEN_REVOCATION_CHECK`
+    seconds, when they load the revoked tokens from Redis. With the "local"
+    `settings.TOKEN_REVOCATION_BACKEND`, only this process refuses it.
+
+    Args:
+        token (str): The JWT token to be revoked.
+        credentials_exception: The exception to raise if the token is invalid.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+
+    key = token_cache.make_key(token)
+    expires = payload.get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    token_cache.revoke(key, expires)
+
+    if settings.TOKEN_REVOCATION_BACKEND == "redis":
+        pipe = redis_pool.get_redis().pipeline(transaction=False)
+        pipe.zadd(settings.REDIS_REVOKED_TOKENS_KEY, {key: expires})
+        pipe.zremrangebyscore(settings.REDIS_REVOKED_TOKENS_KEY, "-inf", time.time())
+        await pipe.execute()
+
+
+async def load_revoked_tokens():
+    """
+    Loads the tokens revoked by every API process, that didn't expire yet,
+    from Redis into the token cache.
+    """
+    try:
+        revoked = await redis_pool.get_redis().zrangebyscore(
+            settings.REDIS_REVOKED_TOKENS_KEY, time.time(), "+inf", withscores=True
+        )
+    except (redis.ConnectionError, redis.TimeoutError):
+        # Keep the ones loaded before, and try again on the next check
+        token_cache.revocations_checked_at = time.monotonic()
+        return
+
+    token_cache.set_revoked({key.decode(): expires for key, expires in revoked})
+
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     Retrieves the current authenticated user based on the provided JWT token.
 
@@ -87,4 +188,55 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+    # Pick up the tokens revoked by the other API processes
+    if settings.TOKEN_REVOCATION_BACKEND == "redis" and token_cache.needs_revocation_check():
+        await load_revoked_tokens()
+
     return verify_token(token, credentials_exception)
+
+
+async def get_current_identity(
+    current_user: schema.TokenData = Depends(get_current_user),
+    database: db.AsyncSession = Depends(db.get_db),
+):
+    """
+    Retrieves the current authenticated user along with their ID and name.
+
+    They are taken from the token claims, so usually no query is made. Tokens
+    issued before the ID was added to the claims have the user read from the
+    database, and kept in the identity cache for `settings.IDENTITY_CACHE_TTL`
+    seconds.
+
+    Args:
+        current_user (TokenData): The user data verified from the token.
+        database (AsyncSession): The database session used for querying the database.
+
+    Returns:
+        TokenData: An object containing the user's email, ID and name.
+
+    Raises:
+        HTTPException: If the token is invalid, or its user doesn't exist anymore.
+    """
+    if current_user.id is not None:
+        return current_user
+
+    identity = identity_cache.get(current_user.email)
+    if identity is not None:
+        return identity
+
+    user = await database.run_sync(
+        lambda session: session.query(User.id, User.name)
+        .filter(User.email == current_user.email)
+        .first()
+    )
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    identity = schema.TokenData(email=current_user.email, id=user.id, name=user.name)
+    identity_cache.put(identity)
+    return identity
@@ -3,28 +3,61 @@ from app.user import hashing
 from app.user.models import User
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
 
-from .jwt import create_access_token
+from .jwt import create_access_token, oauth2_scheme, revoke_token, user_claims
 
 router = APIRouter(tags=["auth"])
 
 
 @router.post("/login")
-def login(
-    request: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(db.get_db)
+async def login(
+    request: OAuth2PasswordRequestForm = Depends(), database: db.AsyncSession = Depends(db.get_db)
 ):
-    
-    user = db.query(User).filter(User.email == request.username).first()
+    """
+    Checks the credentials and returns an access token. The password is
+    verified on the hashing thread pool, and rehashed if it was hashed with
+    other cost parameters.
+    """
+    user = await database.run_sync(
+        lambda session: session.query(User).filter(User.email == request.username).first()
+    )
 
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Invalid credentials"
         )
-    if not hashing.verify_password(request.password, user.password):
+    verified, new_hash = await hashing.verify_and_update_password(request.password, user.password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Incorrect password"
         )
 
-    access_token = create_access_token(data={"sub": user.email})
+    # Read before the rehash commit expires the user, which would reload it
+    # from the database on the event loop
+    claims = user_claims(user)
+
+    if new_hash is not None:
+        def rehash(session):
+            user.password = new_hash
+            session.commit()
+
+        await database.run_sync(rehash)
+
+    access_token = create_access_token(data=claims)
     return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme)):
+    """
+    Revokes the access token of the request, so it can't be used anymore.
+    """
+    await revoke_token(
+        token,
+        HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        ),
+    )
+    return {"detail": "Logged out"}
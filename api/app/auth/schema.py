@@ -15,3 +15,6 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+    # Missing from the tokens issued before they were added to the claims
+    id: Optional[int] = None
+    name: Optional[str] = None
@@ -0,0 +1,114 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    """
+    LRU cache of verified access tokens, keyed by a hash of the token, so
+    repeated requests with the same token skip the signature check. Every
+    entry expires along with its token (the "exp" claim).
+
+    Also keeps the revoked tokens that didn't expire yet, which are refused
+    even when cached. The ones revoked by other API processes are loaded
+    from Redis every `revocation_check` seconds.
+    """
+
+    def __init__(self, max_size: int, revocation_check: float):
+        self.max_size = max_size
+        self.revocation_check = revocation_check
+
+        self.revocations_checked_at = float("-inf")
+
+        self._entries = OrderedDict()
+        self._revoked = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refused = 0
+
+    @staticmethod
+    def make_key(token: str) -> str:
+        return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the token data of a verified token, or None if it isn't
+        cached or it expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        token_data, expires = entry
+        if expires <= time.time():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return token_data
+
+    def put(self, key: str, token_data, expires: float):
+        """
+        Stores the data of a token verified just now, until `expires` (unix
+        time).
+        """
+        if self.max_size <= 0 or expires <= time.time():
+            return
+
+        self._entries[key] = (token_data, expires)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def is_revoked(self, key: str) -> bool:
+        expires = self._revoked.get(key)
+        if expires is None:
+            return False
+
+        if expires <= time.time():
+            # Expired tokens are refused anyway
+            del self._revoked[key]
+            return False
+
+        self.refused += 1
+        return True
+
+    def revoke(self, key: str, expires: float):
+        """
+        Refuses the token from now on, until it expires.
+        """
+        self._revoked[key] = expires
+        self._entries.pop(key, None)
+
+    def needs_revocation_check(self) -> bool:
+        return time.monotonic() - self.revocations_checked_at >= self.revocation_check
+
+    def set_revoked(self, revoked: dict):
+        """
+        Replaces the revoked tokens ({key: expires}) with the ones shared by
+        every API process.
+        """
+        self.revocations_checked_at = time.monotonic()
+
+        self._revoked = revoked
+        for key in revoked:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "revoked": len(self._revoked),
+            "refused": self.refused,
+        }
@@ -1,3 +1,6 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 from app import settings as config
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
@@ -10,29 +13,74 @@ DATABASE_NAME = config.DATABASE_NAME
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Connections are checked with a ping before being used, so a database
+# restart only fails the requests in flight
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=config.DATABASE_POOL_SIZE,
+    max_overflow=config.DATABASE_MAX_OVERFLOW,
+    pool_timeout=config.DATABASE_POOL_TIMEOUT,
+    pool_recycle=config.DATABASE_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# A thread per connection the pool can open, so the queries never wait for
+# a thread while holding a connection nor the other way around
+_executor = ThreadPoolExecutor(
+    max_workers=config.DATABASE_POOL_SIZE + config.DATABASE_MAX_OVERFLOW, thread_name_prefix="db"
+)
+
+
+class AsyncSession:
+    """
+    Awaitable wrapper of a SQLAlchemy session.
+
+    SQLAlchemy 1.3 has no asyncio support, so the queries run on the
+    database thread pool instead of the event loop, one call at a time per
+    session. `run_sync` follows the AsyncSession of SQLAlchemy 1.4, so the
+    services can move to it unchanged.
+    """
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """
+        Runs `fn(session, *args, **kwargs)` on the database thread pool.
+
+        Returns:
+            The result of `fn`.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _executor, lambda: fn(self.sync_session, *args, **kwargs)
+        )
+
+    async def close(self):
+        await self.run_sync(lambda session: session.close())
+
 
-def get_db():
+async def get_db():
     """
     Provides a database session for dependency injection.
 
     This function is used to obtain a new database session instance from the
-    `SessionLocal` factory. It is intended to be used with dependency injection
-    in FastAPI to manage database sessions.
+    `SessionLocal` factory, wrapped so its queries can be awaited without
+    blocking the event loop. It is intended to be used with dependency
+    injection in FastAPI to manage database sessions.
 
     Yields:
-        Session: A SQLAlchemy database session.
+        AsyncSession: An awaitable SQLAlchemy database session.
 
     Notes:
         The session is automatically closed after use to ensure proper resource management.
     """
-    db = SessionLocal()
+    db = AsyncSession(SessionLocal())
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
@@ -1,10 +1,14 @@
 from app.db import Base
-from sqlalchemy import Column, Float, ForeignKey, Integer, String, create_engine
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String, create_engine
 from sqlalchemy.orm import relationship
 
 
 class Feedback(Base):
     __tablename__ = "feedbacks"
+    __table_args__ = (
+        # Finds the feedback of a user, already in the listing order
+        Index("ix_feedbacks_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     score = Column(Float)
@@ -15,10 +19,14 @@ class Feedback(Base):
     user = relationship("User", back_populates="feedbacks")
 
     def __init__(
-        self, score, predicted_class, feedback, image_file_name, user, *args, **kwargs
+        self, score, predicted_class, feedback, image_file_name, user=None, *args, user_id=None, **kwargs
     ):
         self.predicted_class = predicted_class
         self.feedback = feedback
         self.score = score
         self.image_file_name = image_file_name
-        self.user = user
+        # The user is given by ID when it isn't loaded
+        if user is not None:
+            self.user = user
+        else:
+            self.user_id = user_id
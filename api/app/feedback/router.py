@@ -1,10 +1,11 @@
-from typing import List
+from typing import List, Optional
 
 from app import db
-from app.auth.jwt import get_current_user
-from app.user.schema import User
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from app import settings
+from app.auth.jwt import get_current_identity
+from app.auth.schema import TokenData
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 
 from . import schema, services
 
@@ -14,15 +15,38 @@ router = APIRouter(tags=["Feedback"], prefix="/feedback")
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_feedback(
     request: schema.Feedback,
-    database: Session = Depends(db.get_db),
-    current_user: User = Depends(get_current_user),
+    database: db.AsyncSession = Depends(db.get_db),
+    current_user: TokenData = Depends(get_current_identity),
 ):
     return await services.new_feedback(request, current_user, database)
 
 
 @router.get("/", response_model=List[schema.DisplayFeedback])
 async def get_all_feedback(
-    database: Session = Depends(db.get_db),
-    current_user: User = Depends(get_current_user),
+    response: Response,
+    after: Optional[int] = None,
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    database: db.AsyncSession = Depends(db.get_db),
+    current_user: TokenData = Depends(get_current_identity),
 ):
-    return await services.all_feedback(database, current_user)
+    """
+    Lists a page of the feedback of the current user. When there are more,
+    the `X-Next-Cursor` header has the `after` value of the next page.
+    """
+    feedback, next_cursor = await services.all_feedback(database, current_user, after, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return feedback
+
+
+@router.get("/export")
+async def export_feedback(
+    database: db.AsyncSession = Depends(db.get_db),
+    current_user: TokenData = Depends(get_current_identity),
+):
+    """
+    Streams all the feedback of the current user as NDJSON.
+    """
+    return StreamingResponse(
+        services.export_feedback(database, current_user), media_type="application/x-ndjson"
+    )
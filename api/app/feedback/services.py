@@ -1,66 +1,112 @@
+from app import settings
 from app.auth.schema import TokenData
-from app.user.models import User
-from sqlalchemy.orm import Session
+from app.pagination import keyset_page, ndjson_rows
+from app.db import AsyncSession
+from fastapi import HTTPException, status
+from sqlalchemy.exc import IntegrityError
 
 from . import models, schema
 
 
 async def new_feedback(
-    request: schema.Feedback, current_user: TokenData, database: Session
+    request: schema.Feedback, current_user: TokenData, database: AsyncSession
 ) -> models.Feedback:
     """
     Adds new feedback to the database associated with the current user.
 
     This asynchronous function creates a new feedback entry in the database using
-    the provided feedback data and associates it with the current user. It first
-    retrieves the user from the database based on the email in the `current_user` object,
-    then creates and stores the new feedback entry.
+    the provided feedback data and associates it with the current user, by the ID in
+    the `current_user` object, so the user isn't read from the database.
 
     Args:
         request (schema.Feedback): An object containing the feedback details such as score,
                                    image file name, predicted class, and feedback text.
-        current_user (TokenData): An object containing the email of the currently authenticated user.
-        database (Session): The database session used for querying and committing changes to the database.
+        current_user (TokenData): An object containing the ID of the currently authenticated user.
+        database (AsyncSession): The database session used for committing changes to the database.
 
     Returns:
         models.Feedback: The newly created feedback entry stored in the database.
 
     Raises:
-        Exception: If there is an issue with adding or committing the feedback to the database.
+        HTTPException: If the user was deleted after their token was issued.
     """
-    user = database.query(User).filter(User.email == current_user.email).first()
-    new_feedback = models.Feedback(
-        score=request.score,
-        image_file_name=request.image_file_name,
-        predicted_class=request.predicted_class,
-        user=user,
-        feedback=request.feedback,
-    )
-    database.add(new_feedback)
-    database.commit()
-    database.refresh(new_feedback)
+    def add(session):
+        new_feedback = models.Feedback(
+            score=request.score,
+            image_file_name=request.image_file_name,
+            predicted_class=request.predicted_class,
+            user_id=current_user.id,
+            feedback=request.feedback,
+        )
+        session.add(new_feedback)
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return None
+        session.refresh(new_feedback)
+        return new_feedback
+
+    new_feedback = await database.run_sync(add)
+    if new_feedback is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"User with the id {current_user.id} is not available",
+        )
     return new_feedback
 
 
-async def all_feedback(database: Session, current_user: TokenData) -> models.Feedback:
+async def all_feedback(
+    database: AsyncSession, current_user: TokenData, after=None, limit=settings.PAGE_SIZE
+):
     """
-    Retrieves all feedback entries associated with the current user from the database.
+    Retrieves a page of the feedback entries associated with the current user from the database.
 
-    This asynchronous function queries the database for all feedback entries linked to
-    the user identified by the `current_user` object. It returns a list of feedback entries
-    associated with the user's ID.
+    This asynchronous function queries the database for the feedback entries linked to
+    the ID of the `current_user` object, ordered by ID, using the (user_id, id) index.
+    Pages are fetched by keyset pagination, so any page takes the same time however
+    many entries there are.
 
     Args:
-        database (Session): The database session used for querying the database.
-        current_user (TokenData): An object containing the email of the currently authenticated user.
+        database (AsyncSession): The database session used for querying the database.
+        current_user (TokenData): An object containing the ID of the currently authenticated user.
+        after (int, optional): ID of the last entry of the previous page, None for the first page.
+        limit (int): Maximum number of entries of the page.
 
     Returns:
-        list[models.Feedback]: A list of feedback entries associated with the current user.
+        tuple(list[models.Feedback], Optional[int]): The feedback entries of the page, and the
+        cursor of the next page (None if this is the last one).
+    """
+    def page(session):
+        query = session.query(models.Feedback).filter(models.Feedback.user_id == current_user.id)
+        return keyset_page(query, models.Feedback.id, after, limit)
 
-    Raises:
-        Exception: If there is an issue with querying the feedback entries from the database.
+    return await database.run_sync(page)
+
+
+def export_feedback(database: AsyncSession, current_user: TokenData):
+    """
+    Yields every feedback entry of the current user as a line of NDJSON.
+
+    The entries are fetched `settings.EXPORT_BATCH_SIZE` at a time as plain rows, not
+    ORM objects, so the memory used doesn't grow with the number of entries. It's iterated
+    on the threads of the streaming response.
+
+    Args:
+        database (AsyncSession): The database session used for querying the database.
+        current_user (TokenData): An object containing the ID of the currently authenticated user.
+
+    Yields:
+        str: A JSON object per feedback entry, followed by a newline.
     """
-    user = database.query(User).filter(User.email == current_user.email).first()
-    return (
-        database.query(models.Feedback).filter(models.Feedback.user_id == user.id).all()
+    query = (
+        database.sync_session.query(
+            models.Feedback.id,
+            models.Feedback.score,
+            models.Feedback.predicted_class,
+            models.Feedback.image_file_name,
+            models.Feedback.feedback,
+        )
+        .filter(models.Feedback.user_id == current_user.id)
     )
+    return ndjson_rows(query, models.Feedback.id, settings.EXPORT_BATCH_SIZE)
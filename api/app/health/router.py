@@ -0,0 +1,49 @@
+import time
+
+import redis.asyncio as redis
+from app import redis_pool
+from app import settings
+from app.audit.services import audit_log
+from app.auth.jwt import identity_cache, token_cache
+from app.model.services import prediction_cache
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+router = APIRouter(tags=["Health"], prefix="/health")
+
+
+@router.get("/")
+async def health():
+    # Redis is only needed to reach the ML service
+    model_workers = None
+    if settings.MODEL_BACKEND == "inprocess":
+        redis_ok = None
+        healthy = True
+    else:
+        redis_ok = await redis_pool.check_connection()
+        healthy = redis_ok
+
+    # ML service workers with the model warm, whose entry didn't expire
+    if redis_ok:
+        try:
+            model_workers = await redis_pool.get_redis().zcount(
+                settings.REDIS_READY_KEY, time.time(), "+inf"
+            )
+        except (redis.ConnectionError, redis.TimeoutError):
+            pass
+
+    rpse = {
+        "backend": settings.MODEL_BACKEND,
+        "redis": redis_ok,
+        "model_workers": model_workers,
+        "redis_pool": redis_pool.pool_stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "identity_cache": identity_cache.stats(),
+        "audit_log": audit_log.stats(),
+    }
+
+    return JSONResponse(
+        rpse,
+        status_code=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
@@ -0,0 +1,117 @@
+import logging
+import os
+import random
+import time
+
+from app import settings
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess
+
+# Latency buckets (seconds), from a cached prediction to a batch request
+# streaming thousands of rows
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+)
+
+REQUEST_DURATION = Histogram(
+    "api_request_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ["method", "route", "status"],
+    buckets=BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "api_requests_in_flight",
+    "Requests being handled",
+    multiprocess_mode="livesum",
+)
+MODEL_CALL_DURATION = Histogram(
+    "api_model_call_seconds",
+    "Time waiting for the model backend to score a prediction or a chunk of rows",
+    ["backend"],
+    buckets=BUCKETS,
+)
+PREDICTIONS_IN_FLIGHT = Gauge(
+    "api_predictions_in_flight",
+    "Predictions or chunks of rows waiting for the model backend",
+    ["backend"],
+    multiprocess_mode="livesum",
+)
+
+TOKEN_CACHE_LOOKUPS = Counter(
+    "api_token_cache_lookups",
+    "Access tokens looked up in the verified token cache, by result",
+    ["result"],
+)
+
+AUDIT_ROWS = Counter(
+    "api_audit_rows",
+    "Predictions written to the audit log, rejected when it was full, dropped when they couldn't be written, or lost on shutdown",
+    ["result"],
+)
+
+
+def get_registry():
+    """
+    Returns the registry to expose. When `PROMETHEUS_MULTIPROC_DIR` is set,
+    as with several gunicorn workers, it collects the metrics of every
+    worker process from that folder.
+
+    Returns:
+        CollectorRegistry: The registry with the API metrics.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request end to end, including the
+    streaming of its response, labelled by the route it matched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+
+            # The route template, not the path, keeps the label values bounded
+            route = scope.get("route")
+            REQUEST_DURATION.labels(
+                scope["method"], route.path if route is not None else "unmatched", status_code
+            ).observe(time.perf_counter() - start)
+
+
+class SampledLogger:
+    """
+    Logs only a `settings.LOG_SAMPLE_RATE` fraction of the messages, chosen
+    at random, so the per-request logs don't slow down the hot path. The
+    messages are only formatted when they are logged.
+    """
+
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(name)
+
+    def info(self, message, *args):
+        if settings.LOG_SAMPLE_RATE > 0 and random.random() < settings.LOG_SAMPLE_RATE:
+            self.logger.info(message, *args)
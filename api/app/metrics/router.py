@@ -0,0 +1,13 @@
+from app.metrics.instruments import get_registry
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus metrics of the API processes.
+    """
+    return Response(generate_latest(get_registry()), media_type=CONTENT_TYPE_LATEST)
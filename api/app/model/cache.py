@@ -0,0 +1,108 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+# Shared with the ML service feature plan, so the cache key and the model
+# see the same features
+from app.model.field_values import FEATURE_ALIASES, get_number
+
+
+class PredictionCache:
+    """
+    LRU prediction cache with a time to live, keyed by a hash of the
+    canonicalized feature vector and the model version.
+
+    The cache belongs to a single model version, reported by the ML service,
+    and is cleared as soon as a different version is seen.
+    """
+
+    def __init__(self, max_size: int, ttl: float, version_check: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_check = version_check
+
+        self.version = None
+        self.version_checked_at = float("-inf")
+
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(data: dict, version) -> str:
+        """
+        Hashes the input features, named after the model column they feed and
+        converted to numbers the same way the ML service does, sorted by name,
+        together with the model version.
+        """
+        # The last value of a column wins, as in the feature plan
+        features = {FEATURE_ALIASES.get(k, k): get_number(v) for k, v in data.items()}
+        values = sorted((str(k), v) for k, v in features.items())
+        canonical = json.dumps([version, values], separators=(",", ":"))
+        return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+    def needs_version_check(self) -> bool:
+        return time.monotonic() - self.version_checked_at >= self.version_check
+
+    def set_version(self, version):
+        """
+        Records the current model version, clearing the cache if it changed.
+        """
+        self.version_checked_at = time.monotonic()
+
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, version, value):
+        """
+        Stores a result computed by the given model version. Results from a
+        different version than the current one invalidate the cache instead.
+        """
+        if version != self.version:
+            self.set_version(version)
+            return
+
+        if self.max_size <= 0:
+            return
+
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import settings
+
+logger = logging.getLogger(__name__)
+
+_model = None
+
+
+class InProcessModel:
+    """
+    Runs the ML service model inside the API process.
+
+    Serves the active version of the ML service model registry, from
+    `settings.MODEL_REGISTRY`, and scores it the same way the ML service
+    does, with the compiled trees when the version has them. Scoring runs on
+    a thread pool so predictions never block the event loop.
+
+    Like the ML service workers, it checks every
+    `settings.MODEL_RELOAD_INTERVAL` seconds for a newly activated version,
+    through the registry CURRENT file and the Redis key, and swaps to it
+    between predictions, so both backends serve the same version.
+    """
+
+    def __init__(self, model_dir: str, registry_dir: str, threads: int):
+        # Reuse the model registry and scoring code of the ML service
+        sys.path.insert(0, model_dir)
+        import redis_pool as model_redis_pool
+        from model_registry import ModelRegistry, ModelWatcher
+
+        self.registry = ModelRegistry(registry_dir)
+        self.active = self.registry.load_active(
+            os.path.join(model_dir, "variables_dict_m5_3_1.pkl"),
+            os.path.join(model_dir, "scaler.pkl"),
+            model_redis_pool.get_redis(),
+        )
+
+        # Checked at most every MODEL_RELOAD_INTERVAL seconds, see `_check_reload`
+        self.watcher = ModelWatcher(self.registry, model_redis_pool.get_redis(), 0, self.active.version)
+        self._next_reload = time.monotonic() + settings.MODEL_RELOAD_INTERVAL
+        self._reloading = None
+
+        self._local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="model")
+
+    @property
+    def version(self) -> str:
+        return self.active.version
+
+    def _plan(self, model):
+        # The feature plan reuses its buffer, so every thread needs its own
+        if getattr(self._local, "model", None) is not model:
+            self._local.plan = model.feature_plan.copy()
+            self._local.model = model
+        return self._local.plan
+
+    def _predict(self, model, rows, explain=False):
+        X = model.features(rows, explain, plan=self._plan(model))
+        raw, _, contributions = model.score(X, explain=explain, threads=1)
+
+        y_prods = model.probability(raw)
+        y_pred = (y_prods > model.threshold).astype(int)
+
+        if explain:
+            return [
+                (int(prediction), float(probability), explanation)
+                for prediction, probability, explanation
+                in zip(y_pred, y_prods, model.feature_plan.explanations(contributions))
+            ]
+
+        return [
+            (int(prediction), float(probability))
+            for prediction, probability in zip(y_pred, y_prods)
+        ]
+
+    async def predict(self, rows, explain=False):
+        """
+        Scores a list of input feature dicts on the thread pool.
+
+        Returns:
+            tuple(list[tuple], str): Prediction and score of every row, and
+            their explanation if `explain` is set, and the version of the
+            model that scored them.
+        """
+        self._check_reload()
+
+        model = self.active
+        if not rows:
+            return [], model.version
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._predict, model, rows, explain), model.version
+
+    def _check_reload(self):
+        """
+        Starts checking for a newly activated version in the background, if
+        it's time to.
+        """
+        if time.monotonic() < self._next_reload or self._reloading is not None:
+            return
+        self._reloading = asyncio.ensure_future(self._reload())
+
+    async def _reload(self):
+        loop = asyncio.get_running_loop()
+        try:
+            # Reading the pointers and loading a version block, they run
+            # outside the event loop
+            model = await loop.run_in_executor(None, self._load_wanted)
+            if model is not None:
+                logger.info("Swapped model %s for %s", self.active.version, model.version)
+                self.active = model
+                self.watcher.swapped(model.version)
+
+        except Exception as e:
+            logger.warning("Could not switch to the active model version (%s)", e)
+
+        finally:
+            self._next_reload = time.monotonic() + settings.MODEL_RELOAD_INTERVAL
+            self._reloading = None
+
+    def _load_wanted(self):
+        """
+        Returns the newly activated version loaded and warmed up, or None if
+        the active one didn't change.
+        """
+        changed, version = self.watcher.poll()
+        if not changed or version is None:
+            return None
+
+        model = self.registry.load(version)
+        self._predict(model, [{}])
+        return model
+
+
+def get_model() -> InProcessModel:
+    """
+    Returns the in-process model, loading it on first use.
+    """
+    global _model
+
+    if _model is None:
+        _model = InProcessModel(
+            settings.MODEL_DIR, settings.MODEL_REGISTRY, settings.MODEL_THREADS or os.cpu_count()
+        )
+    return _model
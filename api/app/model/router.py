@@ -1,36 +1,101 @@
 import os
 import json
+import time
 
 from typing import List, Dict, Any
 
 from app import db
 from app import settings as config
 from app import utils
+from app.audit.services import record_predictions
 from app.auth.jwt import get_current_user
+from app.metrics.instruments import SampledLogger
 from app.model.schema import PredictRequest, PredictResponse
-from app.model.services import model_predict
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from app.model import streaming
+from app.model.services import model_predict, model_predict_batch
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
 
 router = APIRouter(tags=["Model"], prefix="/model")
 
+# Logs a sample of the predictions, never the input features
+log = SampledLogger(__name__)
+
 @router.post("/predict")
-async def predict(data: Dict[str, Any], 
+async def predict(data: Dict[str, Any], explain: bool = False,
     current_user=Depends(get_current_user)):
+    """
+    Scores the input features. With `explain=true`, the response also has
+    the contribution of every input field to the score.
+    """
 
-    print(f"Processing data {data}, type {type(data)}...") 
-
-    rpse = {"success": False, "prediction": None, "score": None}
+    rpse = {"success": False, "prediction": None, "score": None, "model_version": None}
 
     # Send the file to be processed by the model service
     #prediction, score = await model_predict(file_hash)
-    prediction, score = await model_predict(data)
+    started = time.perf_counter()
+    prediction, score, version, explanation = await model_predict(data, explain)
+    latency = time.perf_counter() - started
+
+    # Only waits when the audit log falls behind
+    await record_predictions(current_user, [data], [(prediction, score)], version, latency)
+
     rpse["success"] = True
     rpse["prediction"] = prediction
     rpse["score"] = score
+    rpse["model_version"] = version
+    if explain:
+        rpse["explanation"] = explanation
+
+    log.info("Predicted %s (score %.3f) with model %s", prediction, score, version)
     #rpse["image_file_name"] = file_hash
 
     # except Exception as e:
     #    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
     return PredictResponse(**rpse)
+
+
+@router.post("/predict/batch")
+async def predict_batch(request: Request, explain: bool = False,
+    current_user=Depends(get_current_user)):
+    """
+    Scores many rows in a single call. The body is a JSON array, NDJSON or
+    CSV (with a header row) of input features, selected by its Content-Type.
+    The results are streamed back in the same format and input order, with
+    the explanation of every row if `explain=true`.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in streaming.CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Content-Type must be one of {', '.join(streaming.CONTENT_TYPES)}",
+        )
+
+    # Spool the body before answering, the response can't be streamed while
+    # the request body is still being received
+    body = await streaming.spool(request.stream())
+
+    # Validate every row before answering, a malformed body can't be
+    # reported once the response started
+    try:
+        rows = streaming.check_rows(body, content_type)
+    except ValueError as e:
+        body.close()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid {content_type} body: {e}",
+        )
+
+    async def audit(chunk, results, version, latency):
+        await record_predictions(current_user, chunk, results, version, latency)
+
+    chunks = model_predict_batch(rows, audit, explain)
+
+    return StreamingResponse(
+        streaming.write_results(chunks, content_type, explain),
+        media_type=content_type,
+        background=BackgroundTask(body.close),
+    )
@@ -1,3 +1,5 @@
+from typing import Dict, Optional
+
 from pydantic import BaseModel
 
 
@@ -5,7 +7,16 @@ class PredictRequest(BaseModel):
     file: str
 
 
+class Explanation(BaseModel):
+    # Raw margin (log-odds) of the average input, and what every input
+    # field adds to it, adding up to the raw margin of the prediction
+    base: float
+    contributions: Dict[str, float]
+
+
 class PredictResponse(BaseModel):
     success: bool
     prediction: str
     score: float
+    model_version: Optional[str] = None
+    explanation: Optional[Explanation] = None
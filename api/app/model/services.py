@@ -1,72 +1,253 @@
+import asyncio
 import json
 import time
+from collections import deque
+from itertools import islice
 from uuid import uuid4
 
-import redis
+from app import redis_pool
 from app import settings #"app" was added.
+from app.metrics.instruments import MODEL_CALL_DURATION, PREDICTIONS_IN_FLIGHT
+from app.model import inprocess
+from app.model.cache import PredictionCache
+from fastapi import HTTPException, status
 
-# Connect to Redis and assign to variable `db``
-# Make use of settings.py module to get Redis settings like host, port, etc.
-# Connect to Redis
-db = redis.StrictRedis(
-    host=settings.REDIS_IP,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB_ID
-    #decode_responses=True
+# Cache of the latest predictions, shared by every request of this process
+prediction_cache = PredictionCache(
+    max_size=settings.PREDICT_CACHE_SIZE,
+    ttl=settings.PREDICT_CACHE_TTL,
+    version_check=settings.PREDICT_CACHE_VERSION_CHECK,
 )
-# Verify the connection
-try:
-    db.ping()
-    print("Connected to Redis successfully!")
-except redis.ConnectionError:
-    print("Failed to connect to Redis.")
-# db = None
 
-async def model_predict(data):
 
-    print(f"Processing model_predict {data}, type {type(data)}...")
+async def model_predict(data, explain=False):
     """
-    Receives an image name and queues the job into Redis.
-    Will loop until getting the answer from our ML service.
+    Receives the input features and scores them with the configured
+    backend, unless the same features were already scored by the current
+    model version. With `explain`, also returns the contribution of every
+    feature to the score, computed in the same model pass and cached along
+    with it.
+
+    With the "queue" backend, queues the job into Redis and waits on the
+    job reply list until getting the answer from our ML service, or until
+    `settings.API_TIMEOUT` seconds have passed. With the "inprocess"
+    backend, scores the features with the model loaded in this process.
 
     Parameters
     ----------
-    image_name : str
-        Name for the image uploaded by the user.
+    data : dict
+        Input features sent by the user.
+    explain : bool
+        Whether to explain the score.
 
     Returns
     -------
-    prediction, score : tuple(str, float)
-        Model predicted class as a string and the corresponding confidence
-        score as a number.
+    prediction, score, version, explanation : tuple(str, float, str, dict)
+        Model predicted class as a string, the corresponding confidence
+        score as a number, the version of the model that scored them, and
+        the base value and contribution of every feature in raw margin
+        units (None unless `explain` is set, or it was cached).
+
+    Raises
+    ------
+    HTTPException
+        504 if the ML service doesn't answer in time, 500 if it fails.
     """
     prediction = None
     score = None
+    explanation = None
+
+    # Refresh the current model version once in a while, so the cache is
+    # invalidated when the ML service loads a different model
+    if prediction_cache.needs_version_check():
+        prediction_cache.set_version(await _model_version())
+
+    # Return the cached result if these features were already scored
+    cache_key = prediction_cache.make_key(data, prediction_cache.version)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None and (not explain or cached[3] is not None):
+        return cached
+
+    if settings.MODEL_BACKEND == "inprocess":
+        [result], version = await _predict_inprocess([data], explain)
+        prediction, score = result[:2]
+        if explain:
+            explanation = result[2]
+
+    else:
+        # Assign an unique ID for this job and add it to the queue.
+        # We need to assing this ID because we must be able to keep track
+        # of this particular job across all the services
+
+        # Generate a unique ID for the job
+        job_id = str(uuid4())
+
+        # Create the job data
+        job_data = {
+            "id": job_id,
+            "features": data
+        }
+        if explain:
+            job_data["explain"] = True
+
+        result = await _queue_job(job_data)
+        prediction = result["prediction"]
+        score = result["score"]
+        version = result.get("version")
+        explanation = result.get("explanation")
+
+    prediction_cache.put(cache_key, version, (prediction, score, version, explanation))
+
+    return prediction, score, version, explanation
+
+
+async def model_predict_batch(rows, audit=None, explain=False):
+    """
+    Scores an iterable of input feature dicts with the configured backend.
+
+    The rows are scored in chunks of `settings.PREDICT_BATCH_CHUNK`, each of
+    them with a single vectorized model call (a single job with the "queue"
+    backend), keeping up to `settings.PREDICT_BATCH_IN_FLIGHT` chunks in
+    flight. Only those chunks are held in memory at any time.
+
+    Parameters
+    ----------
+    rows : iterable of dict
+        Input features of every row.
+    audit : coroutine function, optional
+        Called with the rows, results, model version and scoring time
+        (seconds) of every chunk once it's scored.
+    explain : bool
+        Whether to explain the score of every row.
+
+    Yields
+    ------
+    list of tuple
+        Prediction and score of every row of a chunk, in input order, and
+        their explanation if `explain` is set.
+
+    Raises
+    ------
+    HTTPException
+        504 if the ML service doesn't answer a chunk in time, 500 if it
+        fails.
+    """
+    rows = iter(rows)
+    pending = deque()
+
+    try:
+        while True:
+            chunk = list(islice(rows, settings.PREDICT_BATCH_CHUNK))
+            if chunk:
+                pending.append(asyncio.ensure_future(_predict_chunk(chunk, audit, explain)))
+
+            # Return the oldest chunk once the pipeline is full or the
+            # input is exhausted, so results keep the input order
+            if pending and (not chunk or len(pending) >= settings.PREDICT_BATCH_IN_FLIGHT):
+                yield await pending.popleft()
+
+            elif not chunk:
+                break
+
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _predict_chunk(chunk, audit=None, explain=False):
+    """
+    Scores a chunk of rows with the configured backend.
+    """
+    started = time.perf_counter()
+
+    if settings.MODEL_BACKEND == "inprocess":
+        results, version = await _predict_inprocess(chunk, explain)
+
+    else:
+        # Queue the whole chunk as a single job
+        job_data = {
+            "id": str(uuid4()),
+            "batch": chunk
+        }
+        if explain:
+            job_data["explain"] = True
+
+        result = await _queue_job(job_data)
+        if explain:
+            results = [(row["prediction"], row["score"], row["explanation"]) for row in result["results"]]
+        else:
+            results = [(row["prediction"], row["score"]) for row in result["results"]]
+        version = result.get("version")
+
+    if audit is not None:
+        await audit(chunk, results, version, time.perf_counter() - started)
+
+    return results
+
+
+async def _model_version():
+    """
+    Returns the version of the model used by the configured backend.
+    """
+    if settings.MODEL_BACKEND == "inprocess":
+        return inprocess.get_model().version
+
+    version = await redis_pool.get_redis().get(settings.REDIS_MODEL_VERSION_KEY)
+    return version.decode() if version else None
+
+
+async def _predict_inprocess(rows, explain=False):
+    """
+    Scores the rows with the model loaded in this process. Returns the
+    results and the version of the model that scored them.
+    """
+    try:
+        with PREDICTIONS_IN_FLIGHT.labels("inprocess").track_inprogress(), \
+                MODEL_CALL_DURATION.labels("inprocess").time():
+            return await inprocess.get_model().predict(rows, explain)
+
+    # The inputs the feature plan can't map into features
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"The model service failed: The job could not be scored: {e}",
+        )
+
+
+async def _queue_job(job_data):
+    """
+    Adds the job to the Redis queue and waits for the ML service to push
+    the answer to the job reply list.
+    """
+    # Get the Redis client from the shared connection pool
+    db = redis_pool.get_redis()
+
+    # The ML service measures how long the job waited in the queue
+    job_data["queued_at"] = time.time()
+
+    with PREDICTIONS_IN_FLIGHT.labels("queue").track_inprogress(), \
+            MODEL_CALL_DURATION.labels("queue").time():
+        # Add the job to the Redis queue
+        await db.lpush(settings.REDIS_QUEUE, json.dumps(job_data))
+
+        # Wait for the ML service to push the answer to the job reply list
+        reply = await db.blpop(
+            settings.REDIS_REPLY_PREFIX + job_data["id"], timeout=settings.API_TIMEOUT
+        )
+    if reply is None:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Timed out waiting for the model service",
+        )
+
+    _, result = reply
+    result = json.loads(result)
+
+    # The ML service gave up on the job
+    if "error" in result:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"The model service failed: {result['error']}",
+        )
 
-    # Assign an unique ID for this job and add it to the queue.
-    # We need to assing this ID because we must be able to keep track
-    # of this particular job across all the services
-
-    # Generate a unique ID for the job
-    job_id = str(uuid4())
-
-    # Create the job data
-    job_data = {
-        "id": job_id,
-        "features": data
-    }
-
-    # Add the job to the Redis queue
-    db.lpush(settings.REDIS_QUEUE, json.dumps(job_data))
-
-    # Loop until getting the answer from the ML service
-    while True:
-        result = db.get(job_id)
-        if result:
-            result = json.loads(result)
-            prediction = result["prediction"]
-            score = result["score"]
-            break
-        time.sleep(settings.API_SLEEP)
-
-    return prediction, score
+    return result
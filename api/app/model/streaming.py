@@ -0,0 +1,248 @@
+import csv
+import io
+import json
+import logging
+import re
+import tempfile
+
+# Content types accepted by the batch prediction endpoint
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+CSV = "text/csv"
+
+CONTENT_TYPES = (JSON, NDJSON, CSV)
+
+# Size of the chunks read from the request body and from the spooled file
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r"\s*")
+
+logger = logging.getLogger(__name__)
+
+
+async def spool(stream):
+    """
+    Copies the request body stream into a temporary file, so it can be
+    parsed incrementally without keeping the whole body in memory.
+
+    Args:
+        stream: Async iterator over the request body chunks.
+
+    Returns:
+        io.TextIOWrapper: The spooled body, opened as UTF-8 text at the start.
+    """
+    f = tempfile.TemporaryFile()
+    async for chunk in stream:
+        f.write(chunk)
+    f.seek(0)
+    return io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+
+def read_json_array(f):
+    """
+    Yields the elements of a JSON array one at a time, reading the file in
+    chunks.
+
+    Raises:
+        ValueError: If the content is not a valid JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+
+    def read_more():
+        nonlocal buffer, pos
+        chunk = f.read(CHUNK_SIZE)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return bool(chunk)
+
+    expect = "["
+    while True:
+        pos = WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if not read_more():
+                raise ValueError("Unexpected end of the JSON array")
+            continue
+
+        char = buffer[pos]
+        if expect == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            pos += 1
+            expect = "first"
+
+        elif char == "]" and expect in ("first", "next"):
+            return
+
+        elif expect == "next":
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in the JSON array")
+            pos += 1
+            expect = "value"
+
+        else:
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk
+                if not read_more():
+                    raise
+                continue
+
+            yield value
+            expect = "next"
+
+
+def read_ndjson(f):
+    """
+    Yields one decoded JSON value per non-empty line.
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_rows(f, content_type: str):
+    """
+    Yields the feature dicts from a spooled request body.
+
+    Args:
+        f: The spooled request body, as returned by `spool()`.
+        content_type (str): One of `CONTENT_TYPES`.
+
+    Raises:
+        ValueError: If the body can't be parsed, a row is not a JSON object,
+            or a CSV row doesn't match the header.
+    """
+    if content_type == CSV:
+        rows = csv.DictReader(f)
+        header = rows.fieldnames or []
+        if any(not name for name in header) or len(set(header)) != len(header):
+            raise ValueError("The CSV header must have a unique name for every column")
+    elif content_type == NDJSON:
+        rows = read_ndjson(f)
+    else:
+        rows = read_json_array(f)
+
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError("Every row must be an object with the input features")
+        if None in row:
+            # csv.DictReader puts the values beyond the header under None
+            raise ValueError("A CSV row has more values than the header")
+        yield row
+
+
+def check_rows(f, content_type: str):
+    """
+    Parses the whole spooled body once, so a malformed body or a row that
+    isn't an object is reported before answering, instead of ending the
+    results early. Returns an iterator over the rows read again from the
+    start of the body.
+
+    Raises:
+        ValueError: If the body can't be parsed, or any of its rows is
+            invalid (see `read_rows()`).
+    """
+    for _ in read_rows(f, content_type):
+        pass
+
+    f.seek(0)
+    return read_rows(f, content_type)
+
+
+def result_dict(result):
+    """
+    Returns the JSON object of a (prediction, score[, explanation]) result.
+    """
+    output = {"prediction": result[0], "score": result[1]}
+    if len(result) > 2:
+        output["explanation"] = result[2]
+    return output
+
+
+def csv_line(result, names):
+    """
+    Returns the CSV line of a result, with the base value and contribution
+    of every field in `names` after the score when it's explained.
+    """
+    values = [result[0], result[1]]
+    if names is not None:
+        explanation = result[2]
+        values.append(explanation["base"])
+        values.extend(explanation["contributions"].get(name, "") for name in names)
+    return ",".join(map(str, values)) + "\n"
+
+
+def error_message(e):
+    """
+    Returns the message of a failure while scoring, with the detail of an
+    HTTPException (model backend timeouts and errors, a full audit log).
+    """
+    return str(getattr(e, "detail", e))
+
+
+async def write_results(chunks, content_type: str, explain: bool = False):
+    """
+    Formats the prediction results in the same format as the request,
+    one piece of text per chunk of results.
+
+    The status was already sent by then, so a failure while scoring ends
+    the results with an error record: {"error": message} in JSON and NDJSON,
+    and an "error,<message>" line in CSV.
+
+    Args:
+        chunks: Async iterator over lists of (prediction, score) tuples, or
+            (prediction, score, explanation) ones if `explain` is set.
+        content_type (str): One of `CONTENT_TYPES`.
+        explain (bool): Whether the results have explanations. In CSV they
+            take a "base" column and a "contribution_<field>" column per
+            input field.
+    """
+    error = None
+
+    if content_type == CSV:
+        names = None
+        if not explain:
+            yield "prediction,score\n"
+
+        try:
+            async for chunk in chunks:
+                if explain and names is None and chunk:
+                    # The columns come from the fields of the first explanation
+                    names = list(chunk[0][2]["contributions"])
+                    yield ",".join(["prediction", "score", "base"] + [f"contribution_{name}" for name in names]) + "\n"
+
+                yield "".join(csv_line(result, names) for result in chunk)
+        except Exception as e:
+            error = error_message(e)
+
+        if explain and names is None:
+            yield "prediction,score,base\n"
+        if error is not None:
+            yield 'error,"' + error.replace('"', '""') + '"\n'
+
+    elif content_type == NDJSON:
+        try:
+            async for chunk in chunks:
+                yield "".join(json.dumps(result_dict(result)) + "\n" for result in chunk)
+        except Exception as e:
+            error = error_message(e)
+            yield json.dumps({"error": error}) + "\n"
+
+    else:
+        yield "["
+        separator = ""
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    yield separator + ",".join(json.dumps(result_dict(result)) for result in chunk)
+                    separator = ","
+        except Exception as e:
+            error = error_message(e)
+            yield separator + json.dumps({"error": error})
+        yield "]"
+
+    if error is not None:
+        logger.warning("Batch prediction failed after the response started: %s", error)
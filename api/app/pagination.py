@@ -0,0 +1,54 @@
+import json
+
+
+def keyset_page(query, column, after, limit):
+    """
+    Returns a page of a query, ordered by a unique indexed column, starting
+    after the cursor. The database seeks straight to the cursor in the
+    index, so every page takes the same time however deep it is, unlike
+    OFFSET.
+
+    Args:
+        query: SQLAlchemy query of the rows.
+        column: Unique column the rows are ordered by, e.g. the primary key.
+        after: Value of `column` of the last row of the previous page, or
+            None for the first page.
+        limit (int): Maximum number of rows of the page.
+
+    Returns:
+        tuple(list, Optional[Any]): The rows of the page, and the cursor of
+        the next page (None if this is the last one).
+    """
+    if after is not None:
+        query = query.filter(column > after)
+
+    # One more row tells whether there is a next page
+    rows = query.order_by(column).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, getattr(rows[-1], column.key)
+
+
+def iter_keyset(query, column, batch_size):
+    """
+    Yields every row of a query, fetching `batch_size` of them at a time by
+    keyset pagination, so only one batch is held in memory.
+    """
+    after = None
+    while True:
+        rows, after = keyset_page(query, column, after, batch_size)
+        yield from rows
+
+        if after is None:
+            return
+
+
+def ndjson_rows(query, column, batch_size):
+    """
+    Yields every row of a query of columns as a line of NDJSON, for a
+    streaming export.
+    """
+    for row in iter_keyset(query, column, batch_size):
+        yield json.dumps(row._asdict()) + "\n"
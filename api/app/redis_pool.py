@@ -0,0 +1,103 @@
+import redis.asyncio as redis
+from app import settings
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+
+_pool = None
+_client = None
+
+
+def get_redis() -> redis.StrictRedis:
+    """
+    Returns the Redis client shared by the whole API process.
+
+    The client sits on a blocking connection pool, so concurrent requests
+    use separate connections instead of serializing on one socket, and
+    wait up to `settings.REDIS_POOL_TIMEOUT` seconds for a free connection
+    when the pool is exhausted. Failed commands are retried with
+    exponential backoff, reconnecting after a Redis restart, and idle
+    connections are health checked before being reused.
+
+    The pool is created on first use, inside the running event loop.
+
+    Returns:
+        redis.StrictRedis: The asynchronous Redis client.
+    """
+    global _pool, _client
+
+    if _client is None:
+        _pool = redis.BlockingConnectionPool(
+            host=settings.REDIS_IP,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB_ID,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+            socket_keepalive=True,
+            retry=Retry(
+                ExponentialBackoff(
+                    cap=settings.REDIS_BACKOFF_CAP, base=settings.REDIS_BACKOFF_BASE
+                ),
+                settings.REDIS_RETRIES,
+            ),
+        )
+        _client = redis.StrictRedis(connection_pool=_pool)
+
+    return _client
+
+
+def use_client(client: redis.StrictRedis):
+    """
+    Makes `get_redis` return `client` instead of a client on the connection
+    pool, e.g. an in-memory Redis for the load tests.
+
+    Args:
+        client (redis.StrictRedis): The asynchronous Redis client to use.
+    """
+    global _client
+    _client = client
+
+
+def pool_stats() -> dict:
+    """
+    Returns the size metrics of the Redis connection pool.
+
+    Returns:
+        dict: Maximum, created, in use and idle connection counts.
+    """
+    if _pool is None:
+        return {"max_connections": settings.REDIS_MAX_CONNECTIONS, "created": 0, "in_use": 0, "idle": 0}
+
+    created = len(_pool._connections)
+    idle = sum(1 for connection in _pool.pool._queue if connection is not None)
+    return {
+        "max_connections": _pool.max_connections,
+        "created": created,
+        "in_use": created - idle,
+        "idle": idle,
+    }
+
+
+async def check_connection() -> bool:
+    """
+    Verifies the connection to Redis.
+
+    Returns:
+        bool: True if Redis answered the ping, False otherwise.
+    """
+    try:
+        return await get_redis().ping()
+    except (redis.ConnectionError, redis.TimeoutError):
+        return False
+
+
+async def close():
+    """
+    Closes every connection in the pool.
+    """
+    global _pool, _client
+
+    if _pool is not None:
+        await _pool.disconnect()
+    _pool = None
+    _client = None
@@ -23,13 +23,122 @@ REDIS_PORT = 6379
 REDIS_DB_ID = 0
 # Host IP
 REDIS_IP = os.getenv("REDIS_IP", "redis")
-# Sleep parameters which manages the
-# interval between requests to our redis queue
-API_SLEEP = 0.05
+# Maximum number of connections in the pool. Every prediction waiting for
+# its result holds one, so this also bounds the predictions in flight
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 1000))
+# Maximum time (seconds) to wait for a free connection from the pool
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+# Idle time (seconds) after which a connection is health checked before use
+REDIS_HEALTH_CHECK_INTERVAL = 30
+# Retries, with exponential backoff, for commands failing to reach Redis
+REDIS_RETRIES = 5
+REDIS_BACKOFF_BASE = 0.05
+REDIS_BACKOFF_CAP = 2
+# Prefix of the per-job reply lists, followed by the job ID
+REDIS_REPLY_PREFIX = "result:"
+# Key where the ML service publishes the version of the loaded model
+REDIS_MODEL_VERSION_KEY = "model_version"
+# Sorted set of the ML service workers ready to take jobs, scored by the
+# time their entry expires
+REDIS_READY_KEY = "ml_service:ready"
+# Maximum time (seconds) to wait for the ML service to answer a job
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", 30))
+
+# Model backend settings
+# "queue" sends the predictions to the ML service through Redis,
+# "inprocess" loads the model in the API process (single node deployments)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "queue")
+# Folder with the ML service files (model, scaler and feature pipeline)
+MODEL_DIR = os.getenv("MODEL_DIR", "/src/model_service")
+# Folder with the registered model versions, shared with the ML service
+MODEL_REGISTRY = os.getenv("MODEL_REGISTRY", os.path.join(MODEL_DIR, "registry"))
+# Interval (seconds) between checks for a newly activated version, as in
+# the ML service
+MODEL_RELOAD_INTERVAL = 5
+# Threads scoring the in-process predictions, 0 uses one per core
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", 4))
+
+# Prediction cache settings
+# Maximum number of cached predictions per API process, 0 disables the cache
+PREDICT_CACHE_SIZE = int(os.getenv("PREDICT_CACHE_SIZE", 10000))
+# Time (seconds) a cached prediction is valid
+PREDICT_CACHE_TTL = float(os.getenv("PREDICT_CACHE_TTL", 3600))
+# Interval (seconds) between checks of the model version loaded by the ML service
+PREDICT_CACHE_VERSION_CHECK = 5
+
+# Batch prediction settings
+# Number of rows sent to the ML service in a single job
+PREDICT_BATCH_CHUNK = int(os.getenv("PREDICT_BATCH_CHUNK", 500))
+# Maximum number of chunks of a single request being scored at the same time
+PREDICT_BATCH_IN_FLIGHT = 4
+
+# Telemetry settings
+# Fraction of the predictions logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+
+# Access token cache settings
+# Maximum number of verified tokens cached per API process, 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+# Where the revoked tokens are shared, "redis" makes every API process refuse
+# them, "local" only the one that revoked them (single process deployments
+# without Redis)
+TOKEN_REVOCATION_BACKEND = os.getenv("TOKEN_REVOCATION_BACKEND", "redis")
+# Interval (seconds) between loads of the tokens revoked by the other API processes
+TOKEN_REVOCATION_CHECK = 5
+# Sorted set of the revoked token hashes, scored by the time the token expires
+REDIS_REVOKED_TOKENS_KEY = "auth:revoked_tokens"
+
+# User identity cache settings, for the access tokens without the user ID
+# Maximum number of users cached per API process, 0 disables the cache
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", 10000))
+# Time (seconds) a cached user is used before being read again
+IDENTITY_CACHE_TTL = 300
+
+# Password hashing settings
+# argon2 cost parameters: iterations, memory (KiB) and lanes. Changing them
+# rehashes every password on its next login
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", 3))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", 65536))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", 4))
+# Threads hashing and verifying passwords, per API process
+HASHING_THREADS = int(os.getenv("HASHING_THREADS", 2))
+
+# Listing settings
+# Rows per page of the listings, when the request doesn't set a limit
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 100))
+# Maximum rows per page a request can ask for
+MAX_PAGE_SIZE = 1000
+# Rows fetched at a time by the streaming exports
+EXPORT_BATCH_SIZE = 1000
+
+# Prediction audit log settings
+# Maximum number of predictions buffered per API process before the requests
+# have to wait for the database
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", 10000))
+# Predictions written with a single INSERT, and maximum time (seconds) a
+# prediction waits in the buffer before a smaller batch is written
+AUDIT_BATCH_SIZE = 500
+AUDIT_FLUSH_INTERVAL = 1
+# Maximum time (seconds) a request waits for room in a full buffer before
+# failing with a 503
+AUDIT_BACKPRESSURE_TIMEOUT = 2
+# Maximum delay (seconds) between retries of a failed write
+AUDIT_RETRY_BACKOFF_CAP = 5
+# Maximum time (seconds) to write the buffered predictions when shutting down
+AUDIT_SHUTDOWN_TIMEOUT = 10
 
 # Database settings
 DATABASE_USERNAME = os.getenv("POSTGRES_USER")
 DATABASE_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 DATABASE_HOST = os.getenv("DATABASE_HOST")
 DATABASE_NAME = os.getenv("POSTGRES_DB")
+# Connections kept open to the database per API process, and the extra ones
+# opened under load and closed once idle
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", 10))
+# Maximum time (seconds) to wait for a free connection from the pool
+DATABASE_POOL_TIMEOUT = 10
+# Age (seconds) after which a connection is replaced, before the server or
+# a proxy drops it
+DATABASE_POOL_RECYCLE = 1800
 SECRET_KEY = os.getenv("SECRET_KEY", "S09WWWHXBAJDIUEREHCN3752346572452VGGGVWWW526194")
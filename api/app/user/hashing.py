@@ -1,11 +1,49 @@
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
\ No newline at end of file
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from app import settings
+from passlib.context import CryptContext
+
+# Hashes made with other cost parameters are upgraded on the next login
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__rounds=settings.ARGON2_TIME_COST,
+    argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+    argon2__parallelism=settings.ARGON2_PARALLELISM,
+)
+
+# argon2 releases the GIL, so these threads hash without blocking the event
+# loop. Every hash in progress takes ARGON2_MEMORY_COST KiB, the number of
+# threads bounds the memory and cores a burst of logins can take
+_executor = ThreadPoolExecutor(max_workers=settings.HASHING_THREADS, thread_name_prefix="hashing")
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+
+async def hash_password(password):
+    """
+    Hashes a password on the hashing thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain_password, hashed_password):
+    """
+    Verifies a password on the hashing thread pool.
+
+    Returns:
+        tuple(bool, str): If the password matches, and its new hash if the
+        stored one was made with other cost parameters (None otherwise).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
@@ -14,10 +14,13 @@ class User(Base):
     password = Column(String(255))
     feedbacks = relationship("Feedback", back_populates="user")
 
-    def __init__(self, name, email, password, *args, **kwargs):
+    def __init__(self, name, email, password=None, *args, password_hash=None, **kwargs):
         self.name = name
         self.email = email
-        self.password = hashing.get_password_hash(password)
+        # The API hashes the password beforehand, off the event loop
+        if password_hash is None:
+            password_hash = hashing.get_password_hash(password)
+        self.password = password_hash
 
     def check_password(self, password):
-        return hashing.verify_password(self.password, password)
+        return hashing.verify_password(password, self.password)
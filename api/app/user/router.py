@@ -1,9 +1,10 @@
-from typing import List
+from typing import List, Optional
 
 from app import db
+from app import settings
 from app.auth.jwt import get_current_user
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 
 from . import schema, services, validator
 
@@ -11,8 +12,8 @@ router = APIRouter(tags=["Users"], prefix="/user")
 
 @router.post("/", status_code=status.HTTP_201_CREATED)
 async def create_user_registration(
-    request: schema.User, database: Session = Depends(db.get_db)
-    #request: schema.User, database: Session = Depends(db.get_db)
+    request: schema.User, database: db.AsyncSession = Depends(db.get_db)
+    #request: schema.User, database: db.AsyncSession = Depends(db.get_db)
 ):
     # TODO: Implement the create_user_registration endpoint
     # Make sure to:
@@ -33,18 +34,39 @@ async def create_user_registration(
     return new_user
 
 
-@router.get("/")
+@router.get("/", response_model=List[schema.DisplayUser])
 async def get_all_users(
-    database: Session = Depends(db.get_db),
+    response: Response,
+    after: Optional[int] = None,
+    limit: int = Query(settings.PAGE_SIZE, ge=1, le=settings.MAX_PAGE_SIZE),
+    database: db.AsyncSession = Depends(db.get_db),
     current_user: schema.User = Depends(get_current_user),
 ):
-    return await services.all_users(database)
+    """
+    Lists a page of the users. When there are more, the `X-Next-Cursor`
+    header has the `after` value of the next page.
+    """
+    users, next_cursor = await services.all_users(database, after, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return users
+
+
+@router.get("/export")
+async def export_users(
+    database: db.AsyncSession = Depends(db.get_db),
+    current_user: schema.User = Depends(get_current_user),
+):
+    """
+    Streams all the users as NDJSON.
+    """
+    return StreamingResponse(services.export_users(database), media_type="application/x-ndjson")
 
 
 @router.get("/{id}", response_model=schema.DisplayUser)
 async def get_user_by_id(
     id: int,
-    database: Session = Depends(db.get_db),
+    database: db.AsyncSession = Depends(db.get_db),
     current_user: schema.User = Depends(get_current_user),
 ):
     return await services.get_user_by_id(id, database)
@@ -53,7 +75,7 @@ async def get_user_by_id(
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user_by_id(
     id: int,
-    database: Session = Depends(db.get_db),
+    database: db.AsyncSession = Depends(db.get_db),
     current_user: schema.User = Depends(get_current_user),
 ):
     return await services.delete_user_by_id(id, database)
@@ -1,49 +1,84 @@
+from app import settings
+from app.auth.jwt import identity_cache
+from app.db import AsyncSession
+from app.pagination import keyset_page, ndjson_rows
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
 
-from . import models, schema
+from . import hashing, models, schema
 
 
-async def new_user_register(request: schema.User, database: Session) -> models.User:
+async def new_user_register(request: schema.User, database: AsyncSession) -> models.User:
     """
     Registers a new user in the database.
 
     This asynchronous function creates a new user entry in the database using the provided
     user details from the request. It adds the user to the database, commits the changes,
-    and returns the newly created user.
+    and returns the newly created user. The password is hashed on the hashing thread
+    pool, so it doesn't block the event loop.
 
     Args:
         request (schema.User): An object containing user details such as name, email, and password.
-        database (Session): The database session used for adding and committing the user to the database.
+        database (AsyncSession): The database session used for adding and committing the user to the database.
 
     Returns:
         models.User: The newly created user entry stored in the database.
     """
     new_user = models.User(
-        name=request.name, email=request.email, password=request.password
+        name=request.name,
+        email=request.email,
+        password_hash=await hashing.hash_password(request.password),
     )
-    database.add(new_user)
-    database.commit()
-    database.refresh(new_user)
-    return new_user
 
+    def add(session):
+        session.add(new_user)
+        session.commit()
+        session.refresh(new_user)
+        return new_user
 
-async def all_users(database: Session) -> models.User:
+    return await database.run_sync(add)
+
+
+async def all_users(database: AsyncSession, after=None, limit=settings.PAGE_SIZE):
     """
-    Retrieves all users from the database.
+    Retrieves a page of the users from the database.
 
-    This asynchronous function queries the database to retrieve a list of all users.
+    This asynchronous function queries the database for the users ordered by ID. Pages
+    are fetched by keyset pagination on the primary key, so any page takes the same time
+    however many users there are.
 
     Args:
-        database (Session): The database session used for querying the database.
+        database (AsyncSession): The database session used for querying the database.
+        after (int, optional): ID of the last user of the previous page, None for the first page.
+        limit (int): Maximum number of users of the page.
 
     Returns:
-        list[models.User]: A list of all user entries in the database.
+        tuple(list[models.User], Optional[int]): The users of the page, and the cursor of
+        the next page (None if this is the last one).
     """
-    return database.query(models.User).all()
+    return await database.run_sync(
+        lambda session: keyset_page(session.query(models.User), models.User.id, after, limit)
+    )
 
 
-async def get_user_by_id(id: int, database: Session) -> models.User:
+def export_users(database: AsyncSession):
+    """
+    Yields every user as a line of NDJSON, without their password hash.
+
+    The users are fetched `settings.EXPORT_BATCH_SIZE` at a time as plain rows, not ORM
+    objects, so the memory used doesn't grow with the number of users. It's iterated on
+    the threads of the streaming response.
+
+    Args:
+        database (AsyncSession): The database session used for querying the database.
+
+    Yields:
+        str: A JSON object per user, followed by a newline.
+    """
+    query = database.sync_session.query(models.User.id, models.User.name, models.User.email)
+    return ndjson_rows(query, models.User.id, settings.EXPORT_BATCH_SIZE)
+
+
+async def get_user_by_id(id: int, database: AsyncSession) -> models.User:
     """
     Retrieves a user from the database by their ID.
 
@@ -52,7 +87,7 @@ async def get_user_by_id(id: int, database: Session) -> models.User:
 
     Args:
         id (int): The ID of the user to retrieve.
-        database (Session): The database session used for querying the database.
+        database (AsyncSession): The database session used for querying the database.
 
     Returns:
         models.User: The user entry with the specified ID.
@@ -60,7 +95,9 @@ async def get_user_by_id(id: int, database: Session) -> models.User:
     Raises:
         HTTPException: If the user with the specified ID is not found.
     """
-    user = database.query(models.User).filter(models.User.id == id).first()
+    user = await database.run_sync(
+        lambda session: session.query(models.User).filter(models.User.id == id).first()
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -69,16 +106,20 @@ async def get_user_by_id(id: int, database: Session) -> models.User:
     return user
 
 
-async def delete_user_by_id(id: int, database: Session):
+async def delete_user_by_id(id: int, database: AsyncSession):
     """
     Deletes a user from the database by their ID.
 
     This asynchronous function removes the user with the specified ID from the database
-    and commits the changes.
+    and commits the changes, and drops them from the identity cache of this process.
 
     Args:
         id (int): The ID of the user to delete.
-        database (Session): The database session used for querying and committing changes to the database.
+        database (AsyncSession): The database session used for querying and committing changes to the database.
     """
-    database.query(models.User).filter(models.User.id == id).delete()
-    database.commit()
+    def delete(session):
+        session.query(models.User).filter(models.User.id == id).delete()
+        session.commit()
+
+    await database.run_sync(delete)
+    identity_cache.discard(id)
@@ -1,11 +1,11 @@
 from typing import Optional
 
-from sqlalchemy.orm import Session
+from app.db import AsyncSession
 
 from .models import User
 
 
-async def verify_email_exist(email: str, database: Session) -> Optional[User]:
+async def verify_email_exist(email: str, database: AsyncSession) -> Optional[User]:
     """
     Checks if a user with the specified email exists in the database.
 
@@ -14,9 +14,11 @@ async def verify_email_exist(email: str, database: Session) -> Optional[User]:
 
     Args:
         email (str): The email address to check for existence.
-        database (Session): The database session used for querying the database.
+        database (AsyncSession): The database session used for querying the database.
 
     Returns:
         Optional[User]: The user object if a user with the specified email exists, otherwise `None`.
     """
-    return database.query(User).filter(User.email == email).first()
+    return await database.run_sync(
+        lambda session: session.query(User).filter(User.email == email).first()
+    )
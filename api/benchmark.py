@@ -0,0 +1,658 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from app import redis_pool
+from app import settings
+from app.model import inprocess
+from app.model import services
+
+# Fields of the UI form (ui/hospital_classifier_app.py:get_payload), with
+# the range of the integer ones. The others are checkboxes sent as 0 or 1
+FIELDS = {
+    "r4agey": (50, 120),
+    "r4rxdiab": None,
+    "r4mobila": (0, 5),
+    "r4nagi10": (0, 10),
+    "r4cholst": None,
+    "r4diabe": None,
+    "r4walk1": None,
+    "r4arthre": None,
+    "r4grossa": None,
+    "r4hosp1y": None,
+    "r4doctim1y": (0, 365),
+    "r4hspnit1y": (0, 365),
+}
+
+# Default file with the saved micro-benchmark baselines
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+def sample_payloads(rows, seed):
+    rng = random.Random(seed)
+    return [
+        {name: rng.randint(*values) if values else rng.randint(0, 1) for name, values in FIELDS.items()}
+        for _ in range(rows)
+    ]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def print_header():
+    print(f"{'target':>10} {'concurrency':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/sec':>9} {'errors':>7}")
+
+
+def print_row(target, concurrency, latencies, elapsed, errors):
+    if not latencies:
+        print(f"{target:>10} {concurrency:>11} {'-':>8} {'-':>8} {'-':>8} {'-':>9} {errors:>7}")
+        return
+
+    print(
+        f"{target:>10} {concurrency:>11} "
+        f"{percentile(latencies, 50) * 1000:>8.2f} "
+        f"{percentile(latencies, 95) * 1000:>8.2f} "
+        f"{percentile(latencies, 99) * 1000:>8.2f} "
+        f"{len(latencies) / elapsed:>9.0f} {errors:>7}"
+    )
+
+
+def start_fake_redis():
+    """
+    Replaces Redis with an in-memory fakeredis server shared by the API and
+    an ML service worker running in a thread of this process. Returns a
+    function stopping the worker.
+
+    The worker competes with the API for the GIL, so the latencies are
+    higher than with separate processes, but every stage of the queue path
+    runs and no Redis server is needed.
+    """
+    import fakeredis
+    import fakeredis.aioredis
+
+    server = fakeredis.FakeServer()
+    redis_pool.use_client(fakeredis.aioredis.FakeRedis(server=server))
+
+    # The ML service modules take their client when imported
+    sys.path.insert(0, settings.MODEL_DIR)
+    import redis_pool as model_redis_pool
+
+    model_redis_pool.use_client(fakeredis.FakeStrictRedis(server=server))
+    import ml_service
+
+    ml_service.warm_up()
+    worker = threading.Thread(target=ml_service.classify_process, daemon=True)
+    worker.start()
+
+    def stop():
+        ml_service.stopping = True
+        worker.join()
+
+    return stop
+
+
+async def measure(payloads, concurrency, send):
+    """
+    Sends the payloads with `send(payload)`, keeping `concurrency` requests
+    in flight. Returns the latency of every successful request (seconds),
+    the total time and the number of failed requests.
+    """
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request(payload):
+        nonlocal errors
+
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await send(payload)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request(payload) for payload in payloads])
+    elapsed = time.perf_counter() - start
+
+    return latencies, elapsed, errors
+
+
+async def backends(names, requests, concurrency, warmup, explain):
+    """
+    Compares the latency of the model backends through `model_predict`,
+    also with the predictions explained if `explain` is set.
+    """
+    # Every payload is scored, not taken from the prediction cache
+    services.prediction_cache.max_size = 0
+
+    async def explained(payload):
+        return await services.model_predict(payload, explain=True)
+
+    print_header()
+    for backend in names:
+        settings.MODEL_BACKEND = backend
+        if backend == "inprocess":
+            inprocess.get_model()
+
+        modes = [(backend, services.model_predict)]
+        if explain:
+            modes.append((f"{backend[:6]}+exp", explained))
+
+        for target, predict in modes:
+            await measure(sample_payloads(warmup, seed=0), 1, predict)
+
+            for n in concurrency:
+                latencies, elapsed, errors = await measure(sample_payloads(requests, seed=n), n, predict)
+                print_row(target, n, latencies, elapsed, errors)
+
+    await redis_pool.close()
+
+
+async def load(url, requests, concurrency, warmup):
+    """
+    Drives `/model/predict` over HTTP, paying for the authentication,
+    routing, validation and serialization of every request: on the API
+    deployed at `url`, or on the app of this process if None.
+    """
+    import httpx
+
+    from app.auth.jwt import create_access_token
+
+    if url is None:
+        from app.audit.services import audit_log
+        from main import app
+
+        # The ASGI transport doesn't run the startup events
+        if settings.MODEL_BACKEND == "inprocess":
+            inprocess.get_model()
+
+        # Audit the predictions into a temporary SQLite file
+        audit_log.session_factory = audit_session_factory(None)
+
+        client = httpx.AsyncClient(app=app, base_url="http://api")
+    else:
+        client = httpx.AsyncClient(base_url=url, limits=httpx.Limits(max_connections=max(concurrency)))
+
+    # Signed with settings.SECRET_KEY, which a deployed API has to share
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'loadtest@example.com'})}"}
+
+    async def send(payload):
+        response = await client.post("/model/predict", json=payload, headers=headers, timeout=settings.API_TIMEOUT)
+        response.raise_for_status()
+
+    async with client:
+        await measure(sample_payloads(warmup, seed=0), 1, send)
+
+        print_header()
+        for n in concurrency:
+            latencies, elapsed, errors = await measure(sample_payloads(requests, seed=n), n, send)
+            print_row(url or settings.MODEL_BACKEND, n, latencies, elapsed, errors)
+
+    if url is None:
+        await audit_log.close(settings.AUDIT_SHUTDOWN_TIMEOUT)
+    await redis_pool.close()
+
+
+def audit_session_factory(database_url):
+    """
+    Returns a session factory of `database_url`, or of a temporary SQLite
+    file if it's None, with an empty prediction audit table.
+    """
+    from app.audit.models import PredictionAudit
+    from sqlalchemy.orm import sessionmaker
+
+    engine = benchmark_engine(database_url, "audit.db")
+    PredictionAudit.__table__.drop(engine, checkfirst=True)
+    PredictionAudit.__table__.create(engine)
+    return sessionmaker(bind=engine)
+
+
+async def audit(requests, concurrency, database_url):
+    """
+    Measures `model_predict` along with the audit of every prediction: none,
+    inserted by the request before answering, and buffered for the
+    write-behind audit log.
+    """
+    from app.audit import services as audit_services
+    from app.audit.models import PredictionAudit
+    from app.audit.writer import _insert
+    from app.auth.schema import TokenData
+    from app.db import AsyncSession
+
+    SessionLocal = audit_session_factory(database_url)
+    audit_services.audit_log.session_factory = SessionLocal
+    write_behind = audit_services.audit_log
+
+    class InsertPerRequest:
+        async def record(self, row):
+            database = AsyncSession(SessionLocal())
+            try:
+                await database.run_sync(_insert, [row])
+            finally:
+                await database.close()
+
+    current_user = TokenData(email="user1@example.com", id=1, name="User 1")
+
+    services.prediction_cache.max_size = 0
+    if settings.MODEL_BACKEND == "inprocess":
+        inprocess.get_model()
+
+    await measure(sample_payloads(50, seed=0), 1, services.model_predict)
+
+    print_header()
+    for name, audit_log in [("no audit", None), ("inline", InsertPerRequest()), ("buffered", write_behind)]:
+        audit_services.audit_log = audit_log
+
+        async def send(payload):
+            started = time.perf_counter()
+            prediction, score, version, _ = await services.model_predict(payload)
+            if audit_log is not None:
+                await audit_services.record_predictions(
+                    current_user, [payload], [(prediction, score)], version, time.perf_counter() - started
+                )
+
+        latencies, elapsed, errors = await measure(sample_payloads(requests, seed=concurrency), concurrency, send)
+        print_row(name, concurrency, latencies, elapsed, errors)
+
+    audit_services.audit_log = write_behind
+    await write_behind.close(settings.AUDIT_SHUTDOWN_TIMEOUT)
+
+    database = SessionLocal()
+    print(f"Audited {database.query(PredictionAudit).count()} predictions, {write_behind.stats()}")
+    database.close()
+
+    await redis_pool.close()
+
+
+async def login_storm(requests, concurrency, logins):
+    """
+    Measures `model_predict` while `logins` concurrent logins keep verifying
+    passwords: none, verified on the event loop (as login and registration
+    used to), and verified on the hashing thread pool.
+    """
+    from app.user import hashing
+
+    services.prediction_cache.max_size = 0
+    if settings.MODEL_BACKEND == "inprocess":
+        inprocess.get_model()
+
+    password_hash = hashing.get_password_hash("loadtest password")
+
+    async def verify_on_loop():
+        hashing.verify_password("loadtest password", password_hash)
+        await asyncio.sleep(0)
+
+    async def verify_on_pool():
+        await hashing.verify_and_update_password("loadtest password", password_hash)
+
+    await measure(sample_payloads(50, seed=0), 1, services.model_predict)
+
+    print_header()
+    for name, verify in [("no logins", None), ("on loop", verify_on_loop), ("on pool", verify_on_pool)]:
+        done = asyncio.Event()
+
+        async def storm():
+            while not done.is_set():
+                await verify()
+
+        storms = [asyncio.ensure_future(storm()) for _ in range(logins if verify else 0)]
+
+        latencies, elapsed, errors = await measure(
+            sample_payloads(requests, seed=concurrency), concurrency, services.model_predict
+        )
+        print_row(name, concurrency, latencies, elapsed, errors)
+
+        done.set()
+        await asyncio.gather(*storms)
+
+    await redis_pool.close()
+
+
+def fill_tables(engine, rows):
+    """
+    Recreates the tables with `rows` users, and `rows` feedback entries of
+    the first user.
+    """
+    from app.db import Base
+    from app.feedback.models import Feedback
+    from app.user import hashing
+    from app.user.models import User
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    password_hash = hashing.get_password_hash("loadtest password")
+    for start in range(0, rows, 10000):
+        ids = range(start + 1, min(start + 10000, rows) + 1)
+        engine.execute(User.__table__.insert(), [
+            {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": password_hash}
+            for i in ids
+        ])
+        engine.execute(Feedback.__table__.insert(), [
+            {"id": i, "score": 0.5, "predicted_class": "0", "feedback": "ok", "user_id": 1, "image_file_name": ""}
+            for i in ids
+        ])
+
+
+def time_and_peak(func):
+    """
+    Returns the time (seconds) taken by `func`, and the peak memory (bytes)
+    it allocated, measured in a second call.
+    """
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def benchmark_engine(database_url, file_name):
+    """
+    Returns an engine of `database_url`, or of a temporary SQLite file if
+    it's None, which the database threads can share.
+    """
+    from sqlalchemy import create_engine
+
+    if database_url is None:
+        database_url = f"sqlite:///{tempfile.mkdtemp()}/{file_name}"
+
+    connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
+    return create_engine(database_url, connect_args=connect_args)
+
+
+def listing(sizes, page_size, database_url):
+    """
+    Times the feedback and user listings, and the memory they take, as the
+    tables grow: loading every row (the previous listings), the first and
+    the last page, and the streaming export.
+    """
+    from app.auth.schema import TokenData
+    from app.db import AsyncSession
+    from app.feedback import services as feedback_services
+    from app.feedback.models import Feedback
+    from app.user import services as user_services
+    from app.user.models import User
+    from sqlalchemy.orm import sessionmaker
+
+    engine = benchmark_engine(database_url, "listing.db")
+
+    current_user = TokenData(email="user1@example.com", id=1, name="User 1")
+
+    print(f"{'rows':>9} {'listing':<22} {'ms':>9} {'peak MiB':>9}")
+    for rows in sizes:
+        fill_tables(engine, rows)
+        session = sessionmaker(bind=engine)()
+        database = AsyncSession(session)
+
+        # The next pages start after these IDs
+        last = rows - page_size
+
+        cases = {
+            "feedback all rows": lambda: session.query(Feedback).filter(Feedback.user_id == 1).all(),
+            "feedback first page": lambda: asyncio.run(
+                feedback_services.all_feedback(database, current_user, None, page_size)),
+            "feedback last page": lambda: asyncio.run(
+                feedback_services.all_feedback(database, current_user, last, page_size)),
+            "feedback export": lambda: sum(1 for _ in feedback_services.export_feedback(database, current_user)),
+            "users all rows": lambda: session.query(User).all(),
+            "users first page": lambda: asyncio.run(user_services.all_users(database, None, page_size)),
+            "users last page": lambda: asyncio.run(user_services.all_users(database, last, page_size)),
+            "users export": lambda: sum(1 for _ in user_services.export_users(database)),
+        }
+        for name, func in cases.items():
+            elapsed, peak = time_and_peak(func)
+
+            # Don't count the ORM objects kept by the session in the next case
+            session.expunge_all()
+            print(f"{rows:>9} {name:<22} {elapsed * 1000:>9.2f} {peak / 1024 / 1024:>9.2f}")
+
+        session.close()
+
+
+async def mixed(requests, concurrency, writers, database_url):
+    """
+    Measures `model_predict` while `writers` concurrent clients keep sending
+    feedback: none, with the queries on the event loop (as the services used
+    to run them), and on the database thread pool.
+    """
+    from app.auth.schema import TokenData
+    from app.db import AsyncSession
+    from app.feedback import schema as feedback_schema
+    from app.feedback import services as feedback_services
+    from sqlalchemy.orm import sessionmaker
+
+    class OnLoopSession(AsyncSession):
+        async def run_sync(self, fn, *args, **kwargs):
+            return fn(self.sync_session, *args, **kwargs)
+
+    engine = benchmark_engine(database_url, "mixed.db")
+    fill_tables(engine, 1)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    current_user = TokenData(email="user1@example.com", id=1, name="User 1")
+    feedback = feedback_schema.Feedback(score=0.5, predicted_class="0", image_file_name="", feedback="ok")
+
+    services.prediction_cache.max_size = 0
+    if settings.MODEL_BACKEND == "inprocess":
+        inprocess.get_model()
+
+    await measure(sample_payloads(50, seed=0), 1, services.model_predict)
+
+    print_header()
+    for name, session_class in [("no writes", None), ("on loop", OnLoopSession), ("on pool", AsyncSession)]:
+        done = asyncio.Event()
+        written = 0
+
+        async def write():
+            nonlocal written
+            while not done.is_set():
+                database = session_class(SessionLocal())
+                try:
+                    await feedback_services.new_feedback(feedback, current_user, database)
+                finally:
+                    await database.close()
+                written += 1
+                await asyncio.sleep(0)
+
+        writes = [asyncio.ensure_future(write()) for _ in range(writers if session_class else 0)]
+
+        latencies, elapsed, errors = await measure(
+            sample_payloads(requests, seed=concurrency), concurrency, services.model_predict
+        )
+        print_row(name, concurrency, latencies, elapsed, errors)
+        if writes:
+            print(f"{'':>10} {written / elapsed:>11.0f} feedback writes/sec")
+
+        done.set()
+        await asyncio.gather(*writes)
+
+    await redis_pool.close()
+
+
+def micro_benchmarks():
+    """
+    Returns the hot path operations measured by the micro-benchmarks, as
+    {name: function}.
+    """
+    sys.path.insert(0, settings.MODEL_DIR)
+    import pandas as pd
+
+    import ml_service
+    from app.auth import jwt
+    from app.user import hashing
+    from fastapi import HTTPException
+
+    job = json.dumps(sample_payloads(1, seed=0)[0])
+
+    scaler = ml_service.active.get_scaler()
+    df = pd.DataFrame([[0.0] * len(scaler.feature_names_in_)], columns=scaler.feature_names_in_)
+
+    token = jwt.create_access_token({"sub": "loadtest@example.com"})
+    password_hash = hashing.get_password_hash("loadtest password")
+
+    return {
+        "ml_service.predict": lambda: ml_service.predict(job),
+        "scaler.transform": lambda: scaler.transform(df),
+        # Auth cost per request: a cached token, and the full signature check
+        # of a token seen for the first time
+        "jwt.verify_token": lambda: jwt.verify_token(token, HTTPException(status_code=401)),
+        "jwt.decode": lambda: jwt.jwt.decode(token, jwt.SECRET_KEY, algorithms=[jwt.ALGORITHM]),
+        "password_hash": lambda: hashing.get_password_hash("loadtest password"),
+        "password_verify": lambda: hashing.verify_password("loadtest password", password_hash),
+    }
+
+
+def time_per_call(func, repeat, min_time):
+    """
+    Returns the median time (seconds) per call of `func` over `repeat`
+    rounds, each of them calling it for at least `min_time` seconds.
+    """
+    func()
+
+    rounds = []
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        rounds.append(elapsed / calls)
+
+    return statistics.median(rounds)
+
+
+def micro(baseline, save, tolerance, repeat, min_time):
+    """
+    Runs the micro-benchmarks and compares them with the saved baseline.
+    Returns False if any of them got more than `tolerance` slower.
+    """
+    saved = {}
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            saved = json.load(f)
+
+    results = {}
+    ok = True
+
+    print(f"{'benchmark':<20} {'us/call':>10} {'baseline':>10} {'change':>8}")
+    for name, func in micro_benchmarks().items():
+        results[name] = time_per_call(func, repeat, min_time)
+
+        line = f"{name:<20} {results[name] * 1e6:>10.1f}"
+        if name in saved:
+            change = results[name] / saved[name] - 1
+            regressed = change > tolerance
+            ok = ok and not regressed
+            line += f" {saved[name] * 1e6:>10.1f} {change:>+8.1%}" + ("  REGRESSED" if regressed else "")
+        print(line)
+
+    if save:
+        with open(baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved the baseline to {baseline}")
+
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="API benchmarks and load tests")
+    parser.add_argument(
+        "--redis", choices=["live", "fake"], default="live",
+        help="live uses the configured Redis and ML service, fake runs both in this process",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("backends", help="latency of the model backends through model_predict")
+    cmd.add_argument("--backends", nargs="+", choices=["queue", "inprocess"], default=["queue", "inprocess"])
+    cmd.add_argument("--requests", type=int, default=1000, help="requests per concurrency level")
+    cmd.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    cmd.add_argument("--warmup", type=int, default=50)
+    cmd.add_argument("--explain", action="store_true", help="also measure the explained predictions")
+
+    cmd = commands.add_parser("load", help="latency and throughput of /model/predict")
+    cmd.add_argument("--url", default=None, help="deployed API to test (default: the app of this process)")
+    cmd.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    cmd.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    cmd.add_argument("--warmup", type=int, default=50)
+
+    cmd = commands.add_parser("logins", help="model_predict latency during a storm of logins")
+    cmd.add_argument("--requests", type=int, default=500)
+    cmd.add_argument("--concurrency", type=int, default=16)
+    cmd.add_argument("--logins", type=int, default=8, help="concurrent logins")
+
+    cmd = commands.add_parser("listing", help="feedback and user listings time and memory as the tables grow")
+    cmd.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    cmd.add_argument("--page-size", type=int, default=settings.PAGE_SIZE)
+    cmd.add_argument("--database-url", default=None, help="database to fill (default: a temporary SQLite file)")
+
+    cmd = commands.add_parser("mixed", help="model_predict latency while feedback is written")
+    cmd.add_argument("--requests", type=int, default=500)
+    cmd.add_argument("--concurrency", type=int, default=16)
+    cmd.add_argument("--writers", type=int, default=8, help="concurrent feedback writers")
+    cmd.add_argument("--database-url", default=None, help="database to write to (default: a temporary SQLite file)")
+
+    cmd = commands.add_parser("audit", help="model_predict latency with the predictions audited")
+    cmd.add_argument("--requests", type=int, default=1000)
+    cmd.add_argument("--concurrency", type=int, default=16)
+    cmd.add_argument("--database-url", default=None, help="database to write to (default: a temporary SQLite file)")
+
+    cmd = commands.add_parser("micro", help="hot path micro-benchmarks, compared with the saved baseline")
+    cmd.add_argument("--baseline", default=BASELINE)
+    cmd.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    cmd.add_argument("--tolerance", type=float, default=0.25, help="slowdown failing the run (0.25 = 25%%)")
+    cmd.add_argument("--repeat", type=int, default=5)
+    cmd.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+
+    args = parser.parse_args()
+
+    stop_worker = start_fake_redis() if args.redis == "fake" and args.command != "micro" else None
+
+    ok = True
+    try:
+        if args.command == "backends":
+            asyncio.run(backends(args.backends, args.requests, args.concurrency, args.warmup, args.explain))
+
+        elif args.command == "load":
+            asyncio.run(load(args.url, args.requests, args.concurrency, args.warmup))
+
+        elif args.command == "logins":
+            asyncio.run(login_storm(args.requests, args.concurrency, args.logins))
+
+        elif args.command == "listing":
+            listing(args.rows, args.page_size, args.database_url)
+
+        elif args.command == "mixed":
+            asyncio.run(mixed(args.requests, args.concurrency, args.writers, args.database_url))
+
+        elif args.command == "audit":
+            asyncio.run(audit(args.requests, args.concurrency, args.database_url))
+
+        elif args.command == "micro":
+            ok = micro(args.baseline, args.save, args.tolerance, args.repeat, args.min_time)
+
+    finally:
+        if stop_worker is not None:
+            stop_worker()
+
+    sys.exit(0 if ok else 1)
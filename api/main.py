@@ -1,12 +1,47 @@
+import logging
+
+from app import redis_pool
+from app import settings
+from app.audit.services import audit_log
+from app.model import inprocess
 from app.auth import router as auth_router
 from app.feedback import router as feedback_router
+from app.health import router as health_router
+from app.metrics import router as metrics_router
+from app.metrics.instruments import MetricsMiddleware
 from app.model import router as model_router
 from app.user import router as user_router
 from fastapi import FastAPI
 
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
 app = FastAPI(title="Image Prediction API", version="0.0.1")
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth_router.router)
 app.include_router(model_router.router)
 app.include_router(user_router.router)
 app.include_router(feedback_router.router)
+app.include_router(health_router.router)
+app.include_router(metrics_router.router)
+
+
+@app.on_event("startup")
+async def startup():
+    # Load the model before taking requests
+    if settings.MODEL_BACKEND == "inprocess":
+        inprocess.get_model()
+        return
+
+    # Verify the connection to Redis
+    if await redis_pool.check_connection():
+        print("Connected to Redis successfully!")
+    else:
+        print("Failed to connect to Redis.")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Write the predictions still buffered for the audit log
+    await audit_log.close(settings.AUDIT_SHUTDOWN_TIMEOUT)
+    await redis_pool.close()
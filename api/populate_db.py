@@ -1,5 +1,6 @@
 import psycopg2
 from app import settings as config
+from app.audit.models import PredictionAudit
 from app.db import Base
 from app.feedback.models import Feedback
 from app.user.models import User
@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from app.audit.models import PredictionAudit
+from app.audit.writer import AuditWriter
+from sqlalchemy import create_engine
+from sqlalchemy.exc import (
+    DataError,
+    DisconnectionError,
+    InterfaceError,
+    OperationalError,
+    ProgrammingError,
+)
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'audit.db'}", connect_args={"check_same_thread": False}
+    )
+    PredictionAudit.__table__.create(engine)
+    return sessionmaker(bind=engine)
+
+
+def make_writer(session_factory):
+    return AuditWriter(
+        session_factory=session_factory,
+        max_size=100,
+        batch_size=10,
+        flush_interval=0.05,
+        backpressure_timeout=1,
+        retry_backoff_cap=0.1,
+    )
+
+
+def make_row(user_id, features=None):
+    return {
+        "created_at": datetime.utcnow(),
+        "user_id": user_id,
+        "user_email": f"user{user_id}@example.com",
+        "features": {"age": 70} if features is None else features,
+        "prediction": "0",
+        "score": 0.5,
+        "model_version": "v1",
+        "latency_ms": 1.0,
+    }
+
+
+def written_users(session_factory):
+    session = session_factory()
+    try:
+        return sorted(user_id for (user_id,) in session.query(PredictionAudit.user_id))
+    finally:
+        session.close()
+
+
+@pytest.mark.asyncio
+async def test_bad_row_does_not_block_the_next_ones(session_factory):
+    writer = make_writer(session_factory)
+
+    # The features of the second row can't be serialized, so its batch fails
+    await writer.record(make_row(1))
+    await writer.record(make_row(2, features={"age": object()}))
+    await writer.record(make_row(3))
+    await asyncio.sleep(0.2)
+
+    for user_id in range(4, 7):
+        await writer.record(make_row(user_id))
+    await writer.close(timeout=5)
+
+    assert written_users(session_factory) == [1, 3, 4, 5, 6]
+    assert writer.stats()["dropped"] == 1
+    assert writer.stats()["written"] == 5
+
+
+@pytest.mark.asyncio
+async def test_writer_restarts_after_an_error(session_factory):
+    writer = make_writer(session_factory)
+    write = writer._write
+    calls = []
+
+    async def fail_once(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        await write(rows)
+
+    writer._write = fail_once
+
+    await writer.record(make_row(1))
+    await asyncio.sleep(0.2)
+    await writer.record(make_row(2))
+    await writer.close(timeout=5)
+
+    assert written_users(session_factory) == [1, 2]
+
+
+def fail_first_insert(writer, error):
+    insert = writer._insert
+    calls = []
+
+    async def fail_once(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            raise error
+        await insert(rows)
+
+    writer._insert = fail_once
+    return calls
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [
+    OperationalError("INSERT", {}, Exception("server closed the connection")),
+    InterfaceError("INSERT", {}, Exception("connection already closed")),
+    DisconnectionError("connection invalidated"),
+    ProgrammingError("INSERT", {}, Exception("SSL SYSCALL error"), connection_invalidated=True),
+    DataError("INSERT", {}, Exception("terminating connection"), connection_invalidated=True),
+])
+async def test_connection_errors_keep_the_rows(session_factory, error):
+    writer = make_writer(session_factory)
+    calls = fail_first_insert(writer, error)
+
+    for user_id in range(1, 4):
+        await writer.record(make_row(user_id))
+    await writer.close(timeout=5)
+
+    # The same batch is retried whole, nothing is split or dropped
+    assert calls == [3, 3]
+    assert written_users(session_factory) == [1, 2, 3]
+    assert writer.stats()["dropped"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rejected_row_is_dropped_alone(session_factory):
+    writer = make_writer(session_factory)
+
+    # The database refuses a row without created_at
+    row = make_row(2)
+    row["created_at"] = None
+    await writer.record(make_row(1))
+    await writer.record(row)
+    await writer.record(make_row(3))
+    await writer.close(timeout=5)
+
+    assert written_users(session_factory) == [1, 3]
+    assert writer.stats()["dropped"] == 1
@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import pytest
+from app.model import field_values
+
+# Source of the vendored copy, only in a checkout of the whole repository
+SOURCE = Path(__file__).resolve().parents[2] / "model" / "field_values.py"
+
+
+@pytest.mark.skipif(not SOURCE.exists(), reason="the ML service source isn't available")
+def test_vendored_copy_matches_the_ml_service():
+    assert Path(field_values.__file__).read_text() == SOURCE.read_text()
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(1, 1.0), ("2.5", 2.5), (True, 1.0), ("yes", 0.0), (None, 0.0), ([1, 2], 0.0), ({}, 0.0)],
+)
+def test_get_number(value, expected):
+    assert field_values.get_number(value) == expected
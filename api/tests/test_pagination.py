@@ -0,0 +1,149 @@
+import json
+
+import httpx
+import pytest
+from app import db, settings
+from app.auth.jwt import get_current_identity
+from app.auth.schema import TokenData
+from app.feedback import models, router
+from app.pagination import iter_keyset, keyset_page, ndjson_rows
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+USER_ID = 1
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'feedback.db'}", connect_args={"check_same_thread": False}
+    )
+    db.Base.metadata.create_all(engine)
+
+    session = sessionmaker(bind=engine)()
+    # 25 entries of the user, with entries of another user between them
+    for i in range(30):
+        session.add(models.Feedback(
+            score=i / 30,
+            predicted_class=str(i % 2),
+            feedback=f"feedback {i}",
+            image_file_name=f"{i}.jpg",
+            user_id=2 if i % 6 == 5 else USER_ID,
+        ))
+    session.commit()
+    session.close()
+
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def user_ids(session_factory):
+    session = session_factory()
+    try:
+        return [id for (id,) in user_query(session, models.Feedback.id)]
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(session_factory):
+    def get_db():
+        database = db.AsyncSession(session_factory())
+        try:
+            yield database
+        finally:
+            database.sync_session.close()
+
+    app = FastAPI()
+    app.include_router(router.router)
+    app.dependency_overrides[db.get_db] = get_db
+    app.dependency_overrides[get_current_identity] = lambda: TokenData(
+        email="user1@example.com", id=USER_ID
+    )
+    return httpx.AsyncClient(app=app, base_url="http://test")
+
+
+def user_query(session, *columns):
+    query = session.query(*columns) if columns else session.query(models.Feedback)
+    return query.filter(models.Feedback.user_id == USER_ID)
+
+
+def test_pages_split_at_their_cursor(session_factory, user_ids):
+    session = session_factory()
+
+    rows, after = keyset_page(user_query(session), models.Feedback.id, None, 10)
+    assert [row.id for row in rows] == user_ids[:10]
+    assert after == user_ids[9]
+
+    rows, after = keyset_page(user_query(session), models.Feedback.id, after, 10)
+    assert [row.id for row in rows] == user_ids[10:20]
+    assert after == user_ids[19]
+
+    # The last page has no cursor, even when it's full
+    rows, after = keyset_page(user_query(session), models.Feedback.id, after, 5)
+    assert [row.id for row in rows] == user_ids[20:]
+    assert after is None
+
+    rows, after = keyset_page(user_query(session), models.Feedback.id, user_ids[-1], 5)
+    assert rows == [] and after is None
+
+    session.close()
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 25, 100])
+def test_iter_keyset_yields_every_row_once(session_factory, user_ids, batch_size):
+    session = session_factory()
+
+    ids = [row.id for row in iter_keyset(user_query(session), models.Feedback.id, batch_size)]
+
+    assert ids == user_ids
+    session.close()
+
+
+def test_ndjson_rows(session_factory, user_ids):
+    session = session_factory()
+    query = user_query(session, models.Feedback.id, models.Feedback.feedback)
+
+    lines = list(ndjson_rows(query, models.Feedback.id, 4))
+
+    assert all(line.endswith("\n") for line in lines)
+    assert [json.loads(line) for line in lines][:2] == [
+        {"id": user_ids[0], "feedback": "feedback 0"},
+        {"id": user_ids[1], "feedback": "feedback 1"},
+    ]
+    assert [json.loads(line)["id"] for line in lines] == user_ids
+    session.close()
+
+
+@pytest.mark.asyncio
+async def test_listing_follows_the_next_cursor(client, user_ids):
+    ids = []
+    params = {"limit": 10}
+    async with client:
+        while True:
+            response = await client.get("/feedback/", params=params)
+            assert response.status_code == 200
+            ids.extend(entry["id"] for entry in response.json())
+
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+            params["after"] = cursor
+
+    assert ids == user_ids
+    assert params["after"] == str(user_ids[19])
+
+
+@pytest.mark.asyncio
+async def test_export_streams_every_entry(client, user_ids, monkeypatch):
+    monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 4)
+
+    async with client:
+        response = await client.get("/feedback/export")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    entries = [json.loads(line) for line in response.text.splitlines()]
+    assert [entry["id"] for entry in entries] == user_ids
+    assert set(entries[0]) == {"id", "score", "predicted_class", "image_file_name", "feedback"}
@@ -0,0 +1,79 @@
+import time
+
+from app.model.cache import PredictionCache
+
+
+def make_cache(max_size=10, ttl=60):
+    cache = PredictionCache(max_size=max_size, ttl=ttl, version_check=5)
+    cache.set_version("v1")
+    return cache
+
+
+def test_key_ignores_the_field_order_and_number_format():
+    key = PredictionCache.make_key({"r4agey": 70, "r4bmi": "25.0"}, "v1")
+
+    assert PredictionCache.make_key({"r4bmi": 25, "r4agey": 70.0}, "v1") == key
+    assert PredictionCache.make_key({"r4agey": 70, "r4bmi": 26}, "v1") != key
+
+
+def test_key_takes_non_numbers_as_zero():
+    key = PredictionCache.make_key({"r4agey": 0}, "v1")
+
+    for value in ("text", None, [1, 2]):
+        assert PredictionCache.make_key({"r4agey": value}, "v1") == key
+
+
+def test_key_maps_aliases_to_their_column():
+    key = PredictionCache.make_key({"r4walk1_1.Yes": 1}, "v1")
+
+    assert PredictionCache.make_key({"r4walk1": 1}, "v1") == key
+    # The last value of a column wins, as in the feature plan
+    assert PredictionCache.make_key({"r4walk1": 0, "r4walk1_1.Yes": 1}, "v1") == key
+    assert PredictionCache.make_key({"r4walk1_1.Yes": 0, "r4walk1": 1}, "v1") == key
+
+
+def test_key_depends_on_the_model_version():
+    assert PredictionCache.make_key({"r4agey": 70}, "v1") != PredictionCache.make_key({"r4agey": 70}, "v2")
+
+
+def test_entries_expire_after_the_ttl():
+    cache = make_cache(ttl=0.01)
+    cache.put("a", "v1", "result")
+    assert cache.get("a") == "result"
+
+    time.sleep(0.05)
+
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = make_cache(max_size=2)
+    cache.put("a", "v1", 1)
+    cache.put("b", "v1", 2)
+    cache.get("a")
+    cache.put("c", "v1", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_zero_size_disables_the_cache():
+    cache = make_cache(max_size=0)
+    cache.put("a", "v1", 1)
+
+    assert cache.get("a") is None
+
+
+def test_result_of_another_version_clears_the_cache():
+    cache = make_cache()
+    cache.put("a", "v1", 1)
+    cache.put("b", "v2", 2)
+
+    assert cache.version == "v2"
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,128 @@
+import io
+import json
+
+import pytest
+from app.model import streaming
+
+
+async def body_stream(text):
+    yield text.encode()
+
+
+async def spooled(text):
+    return await streaming.spool(body_stream(text))
+
+
+async def results(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(lines):
+    return "".join([line async for line in lines])
+
+
+@pytest.mark.asyncio
+async def test_json_array_across_chunks(monkeypatch):
+    # Values split across the chunk boundaries must still be decoded
+    monkeypatch.setattr(streaming, "CHUNK_SIZE", 3)
+    rows = [{"age": 70, "name": "a b"}, {"age": 71.5}, {}]
+    f = await spooled(" [\n" + " , ".join(json.dumps(row) for row in rows) + " ]\n")
+
+    assert list(streaming.check_rows(f, streaming.JSON)) == rows
+
+
+@pytest.mark.asyncio
+async def test_empty_json_array():
+    f = await spooled("[ ]")
+
+    assert list(streaming.check_rows(f, streaming.JSON)) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("text", [
+    '{"age": 70}',
+    '[{"age": 70}',
+    '[{"age": 70} {"age": 71}]',
+    '[{"age": 70},]',
+    "[1, 2]",
+    '[{"age": 70}, 5]',
+])
+async def test_invalid_json_array(text):
+    f = await spooled(text)
+
+    with pytest.raises(ValueError):
+        streaming.check_rows(f, streaming.JSON)
+
+
+@pytest.mark.asyncio
+async def test_ndjson_skips_blank_lines():
+    f = await spooled('{"age": 70}\n\n  \n{"age": 71}\n')
+
+    assert list(streaming.check_rows(f, streaming.NDJSON)) == [{"age": 70}, {"age": 71}]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("text", [
+    '{"age": 70}\n5\n',
+    '{"age": 70}\n{"age": \n',
+])
+async def test_invalid_ndjson(text):
+    f = await spooled(text)
+
+    with pytest.raises(ValueError):
+        streaming.check_rows(f, streaming.NDJSON)
+
+
+@pytest.mark.asyncio
+async def test_csv_rows():
+    f = await spooled('age,name\r\n70,"a, b"\r\n71,\r\n')
+
+    assert list(streaming.check_rows(f, streaming.CSV)) == [
+        {"age": "70", "name": "a, b"},
+        {"age": "71", "name": ""},
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("text", [
+    "age,age\n70,71\n",
+    "age,\n70,71\n",
+    "age\n70\n71,72\n",
+])
+async def test_invalid_csv(text):
+    f = await spooled(text)
+
+    with pytest.raises(ValueError):
+        streaming.check_rows(f, streaming.CSV)
+
+
+@pytest.mark.asyncio
+async def test_results_keep_the_request_format():
+    chunks = [[(1, 0.75), (0, 0.25)], [(0, 0.5)]]
+
+    expected = [
+        {"prediction": 1, "score": 0.75},
+        {"prediction": 0, "score": 0.25},
+        {"prediction": 0, "score": 0.5},
+    ]
+
+    text = await collect(streaming.write_results(results(chunks), streaming.JSON))
+    assert json.loads(text) == expected
+
+    text = await collect(streaming.write_results(results(chunks), streaming.NDJSON))
+    assert [json.loads(line) for line in io.StringIO(text)] == expected
+
+    text = await collect(streaming.write_results(results(chunks), streaming.CSV))
+    assert text == "prediction,score\n1,0.75\n0,0.25\n0,0.5\n"
+
+
+@pytest.mark.asyncio
+async def test_failure_ends_the_results_with_an_error():
+    async def failing():
+        yield [(1, 0.75)]
+        raise RuntimeError("the model failed")
+
+    text = await collect(streaming.write_results(failing(), streaming.JSON))
+
+    assert json.loads(text) == [{"prediction": 1, "score": 0.75}, {"error": "the model failed"}]
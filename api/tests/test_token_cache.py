@@ -0,0 +1,124 @@
+import time
+from types import SimpleNamespace
+
+import fakeredis.aioredis
+import pytest
+from app import redis_pool, settings
+from app.auth import jwt
+from app.auth import token_cache as token_cache_module
+from app.auth.token_cache import TokenCache
+from fastapi import HTTPException
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    client = fakeredis.aioredis.FakeRedis()
+    monkeypatch.setattr(redis_pool, "_client", client)
+    monkeypatch.setattr(settings, "TOKEN_REVOCATION_BACKEND", "redis")
+    return client
+
+
+def make_cache():
+    return TokenCache(max_size=10, revocation_check=settings.TOKEN_REVOCATION_CHECK)
+
+
+def make_token():
+    return jwt.create_access_token({"sub": "user1@example.com", "uid": 1, "name": "User 1"})
+
+
+def as_process(monkeypatch, cache):
+    # Every API process has its own token cache
+    monkeypatch.setattr(jwt, "token_cache", cache)
+
+
+@pytest.mark.asyncio
+async def test_logout_is_seen_by_the_other_processes(monkeypatch, fake_redis):
+    first, second = make_cache(), make_cache()
+    token = make_token()
+
+    as_process(monkeypatch, second)
+    assert (await jwt.get_current_user(token)).id == 1
+
+    as_process(monkeypatch, first)
+    await jwt.revoke_token(token, Exception("invalid token"))
+    with pytest.raises(HTTPException) as e:
+        await jwt.get_current_user(token)
+    assert e.value.status_code == 401
+
+    key = TokenCache.make_key(token)
+    assert await fake_redis.zscore(settings.REDIS_REVOKED_TOKENS_KEY, key) > time.time()
+
+    # The other process serves the cached token until its next check
+    as_process(monkeypatch, second)
+    assert (await jwt.get_current_user(token)).id == 1
+
+    second.revocations_checked_at = float("-inf")
+    with pytest.raises(HTTPException) as e:
+        await jwt.get_current_user(token)
+    assert e.value.status_code == 401
+    assert second.stats()["revoked"] == 1
+    assert second.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_revoking_trims_the_expired_revocations(monkeypatch, fake_redis):
+    as_process(monkeypatch, make_cache())
+    await fake_redis.zadd(settings.REDIS_REVOKED_TOKENS_KEY, {"expired": time.time() - 60})
+
+    token = make_token()
+    await jwt.revoke_token(token, Exception("invalid token"))
+
+    revoked = await fake_redis.zrange(settings.REDIS_REVOKED_TOKENS_KEY, 0, -1)
+    assert revoked == [TokenCache.make_key(token).encode()]
+
+
+@pytest.mark.asyncio
+async def test_expired_token_is_refused_from_the_cache(monkeypatch):
+    cache = make_cache()
+    as_process(monkeypatch, cache)
+
+    token = jwt.jwt.encode(
+        {"sub": "user1@example.com", "uid": 1, "exp": int(time.time()) - 60},
+        jwt.SECRET_KEY,
+        algorithm=jwt.ALGORITHM,
+    )
+    key = TokenCache.make_key(token)
+
+    # Verified and cached an hour ago, when it was still valid
+    with monkeypatch.context() as m:
+        m.setattr(token_cache_module, "time", SimpleNamespace(time=lambda: time.time() - 3600))
+        cache.put(key, jwt.schema.TokenData(email="user1@example.com", id=1), time.time() - 60)
+        assert cache.get(key) is not None
+
+    with pytest.raises(HTTPException) as e:
+        await jwt.get_current_user(token)
+    assert e.value.status_code == 401
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_with_their_token():
+    cache = make_cache()
+    cache.put("valid", "data", time.time() + 60)
+    cache.put("expiring", "data", time.time() + 0.05)
+    cache.put("expired", "data", time.time() - 1)
+
+    assert cache.get("expired") is None
+    assert cache.get("expiring") == "data"
+    time.sleep(0.1)
+    assert cache.get("expiring") is None
+    assert cache.get("valid") == "data"
+    assert cache.stats()["size"] == 1
+
+
+def test_revoked_token_is_refused_until_it_expires():
+    cache = make_cache()
+    cache.put("token", "data", time.time() + 60)
+
+    cache.revoke("token", time.time() + 0.05)
+    assert cache.get("token") is None
+    assert cache.is_revoked("token")
+
+    time.sleep(0.1)
+    assert not cache.is_revoked("token")
+    assert cache.stats()["revoked"] == 0
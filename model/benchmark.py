@@ -0,0 +1,275 @@
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import ml_service
+from field_values import FEATURE_ALIASES, get_number
+
+# Input fields sent by the UI form, with their valid range
+FIELDS = {
+    "r4agey": (50, 120),
+    "r4rxdiab": (0, 1),
+    "r4mobila": (0, 5),
+    "r4nagi10": (0, 10),
+    "r4cholst": (0, 1),
+    "r4diabe": (0, 1),
+    "r4walk1": (0, 1),
+    "r4arthre": (0, 1),
+    "r4grossa": (0, 1),
+    "r4hosp1y": (0, 1),
+    "r4doctim1y": (0, 365),
+    "r4hspnit1y": (0, 365),
+}
+
+
+def sample_payloads(rows, seed=0):
+    """
+    Generates `rows` random payloads like the ones sent by the UI form.
+    """
+    rng = random.Random(seed)
+    return [
+        { k: rng.randint(low, high) for k, (low, high) in FIELDS.items() }
+        for _ in range(rows)
+    ]
+
+
+def model_payload(payload):
+    """
+    Renames the form fields to the model column names and sorts them in the
+    model's column order, as expected by the pandas reference path.
+    """
+    fields = { FEATURE_ALIASES.get(k, k): v for k, v in payload.items() }
+    return { k: fields[k] for k in ml_service.active.feature_plan.feature_names if k in fields }
+
+
+def reference_predict_batch(batch):
+    """
+    Pandas reference implementation of the feature pipeline (the previous
+    per-request path), used to check the compiled feature plan.
+    """
+    scaler = ml_service.active.get_scaler()
+    values = [{ k: get_number(v) for k, v in fields.items()} for fields in batch]
+
+    rows = [{ i: row.get(i, 0.0) for i in scaler.feature_names_in_ } for row in values]
+    df = pd.DataFrame(rows, columns=scaler.feature_names_in_)
+    scale_data = pd.DataFrame(scaler.transform(df), columns=df.columns).to_dict('records')
+
+    scale_values = []
+    for row, scaled in zip(values, scale_data):
+        scale_values.append({ k: scaled.get(k, v) for k, v in row.items() })
+
+    return ml_service.active.get_model()['best_model'].predict_proba(pd.DataFrame(scale_values))[:, 1]
+
+
+def plan_predict_batch(batch):
+    """
+    Pickled model on the compiled feature plan, the path used when there is
+    no compiled model.
+    """
+    X = ml_service.active.feature_plan.transform(batch)
+    return ml_service.active.get_model()['best_model'].predict_proba(X)[:, 1]
+
+
+def compiled_predict_batch(batch):
+    """
+    Compiled model (compiled_model.py) on the unscaled feature plan matrix.
+    """
+    return ml_service.active.compiled.predict_proba(ml_service.active.feature_plan.fill(batch))
+
+
+def scoring_paths():
+    """
+    Returns the scoring paths to compare against the pandas reference path.
+    """
+    paths = {"plan": plan_predict_batch}
+    if ml_service.active.compiled is not None:
+        paths["compiled"] = compiled_predict_batch
+    else:
+        print("No compiled model loaded, register the model with model_registry.py")
+    return paths
+
+
+def parity(rows, tolerance):
+    """
+    Checks that the compiled feature plan and the compiled model score like
+    the pandas reference path. Returns False if any probability differs
+    more than `tolerance`, or any predicted class differs.
+    """
+    payloads = [model_payload(payload) for payload in sample_payloads(rows)]
+    threshold = ml_service.active.threshold
+
+    expected = reference_predict_batch(payloads)
+
+    ok = True
+    for name, func in scoring_paths().items():
+        actual = func(payloads)
+
+        diff = max(abs(a - e) for a, e in zip(actual, expected))
+        flips = sum((a > threshold) != (e > threshold) for a, e in zip(actual, expected))
+        print(f"{name:<10} rows={rows}  max abs diff={diff:.3e}  class flips={flips}  tolerance={tolerance:.1e}")
+
+        ok = ok and diff <= tolerance and flips == 0
+
+    # The compiled model must reach the same leaves as LightGBM
+    if ml_service.active.compiled is not None:
+        X = ml_service.active.feature_plan.transform(payloads)
+        expected = ml_service.active.get_model()['best_model'].booster_.predict(X, pred_leaf=True)
+
+        _, nodes = ml_service.active.compiled.evaluate(ml_service.active.feature_plan.fill(payloads))
+        mismatches = int((ml_service.active.compiled.leaf_index(nodes) != expected).any(axis=1).sum())
+        print(f"{'leaves':<10} rows={rows}  rows with a different leaf={mismatches}")
+
+        ok = ok and mismatches == 0
+
+    return ok
+
+
+def latency(rows):
+    """
+    Prints the mean single-row latency of the pandas reference path, of the
+    other scoring paths and of the whole `predict_batch` call.
+    """
+    payloads = [model_payload(payload) for payload in sample_payloads(rows)]
+
+    funcs = {"reference": reference_predict_batch, **scoring_paths(), "service": ml_service.predict_batch}
+    for name, func in funcs.items():
+        start = time.perf_counter()
+        for payload in payloads:
+            func([payload])
+        elapsed = time.perf_counter() - start
+
+        print(f"{name:<10} {elapsed / rows * 1e6:>10.1f} us/row")
+
+
+def two_pass_predict_batch(batch):
+    """
+    The previous worker hot path: `predict` (thrown away) and then
+    `predict_proba`, evaluating every tree twice.
+    """
+    X = ml_service.active.feature_plan.transform(batch)
+    ml_service.active.get_model()['best_model'].predict(X)
+    return ml_service.active.get_model()['best_model'].predict_proba(X)[:, 1]
+
+
+def single_pass_predict_batch(batch):
+    """
+    A single raw score evaluation of the pickled model, as `evaluate` does
+    without a compiled model.
+    """
+    X = ml_service.active.feature_plan.transform(batch)
+    raw = ml_service.active.get_model()['best_model'].booster_.predict(X, raw_score=True)
+    return 1.0 / (1.0 + np.exp(-ml_service.active.sigmoid * raw))
+
+
+def evaluation(rows, batch_sizes):
+    """
+    Prints the cost per row of scoring with two model evaluations and with a
+    single one, for every batch size, and checks both give the same
+    probabilities.
+    """
+    payloads = sample_payloads(rows)
+
+    expected = two_pass_predict_batch(payloads)
+    diff = np.abs(single_pass_predict_batch(payloads) - expected).max()
+    print(f"single pass vs two passes: max abs diff={diff:.3e}")
+
+    funcs = {"two pass": two_pass_predict_batch, "one pass": single_pass_predict_batch}
+    if ml_service.active.compiled is not None:
+        funcs["compiled"] = lambda batch: ml_service.active.compiled.evaluate(ml_service.active.feature_plan.fill(batch))
+
+    for batch_size in batch_sizes:
+        costs = []
+        for name, func in funcs.items():
+            start = time.perf_counter()
+            for i in range(0, rows, batch_size):
+                func(payloads[i:i + batch_size])
+            costs.append(f"{name} {(time.perf_counter() - start) / rows * 1e6:>8.1f}")
+
+        print(f"batch_size={batch_size:>5}  " + "  ".join(costs) + " us/row")
+
+
+def throughput(rows, batch_sizes):
+    """
+    Scores `rows` payloads with `predict_batch` for every batch size and
+    prints the resulting rows/sec.
+    """
+    payloads = sample_payloads(rows)
+
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, rows, batch_size):
+            ml_service.predict_batch(payloads[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+
+        print(f"batch_size={batch_size:>5}  {rows / elapsed:>10.1f} rows/sec")
+
+
+def explain(rows, batch_sizes):
+    """
+    Prints the cost per row of `predict_batch` with and without the feature
+    contributions, for every batch size, and checks both give the same
+    probabilities.
+    """
+    payloads = sample_payloads(rows)
+
+    plain = [result['probability'] for result in ml_service.predict_batch(payloads)]
+    explained = [result['probability'] for result in ml_service.predict_batch(payloads, explain=True)]
+    print(f"explained vs plain: max abs diff={np.abs(np.subtract(explained, plain)).max():.3e}")
+
+    for batch_size in batch_sizes:
+        costs = []
+        for name, flag in [("plain", False), ("explain", True)]:
+            start = time.perf_counter()
+            for i in range(0, rows, batch_size):
+                ml_service.predict_batch(payloads[i:i + batch_size], explain=flag)
+            costs.append((time.perf_counter() - start) / rows * 1e6)
+
+        print(
+            f"batch_size={batch_size:>5}  plain {costs[0]:>8.1f}  explain {costs[1]:>8.1f} us/row"
+            f"  ({costs[1] / costs[0]:.1f}x)"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="ML Service benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("throughput", help="predict_batch rows/sec per batch size")
+    cmd.add_argument("--rows", type=int, default=2000)
+    cmd.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+
+    cmd = commands.add_parser("evaluation", help="cost of one vs two model evaluations per batch")
+    cmd.add_argument("--rows", type=int, default=2000)
+    cmd.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 512])
+
+    cmd = commands.add_parser("explain", help="cost of the feature contributions per batch")
+    cmd.add_argument("--rows", type=int, default=2000)
+    cmd.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 512])
+
+    cmd = commands.add_parser("parity", help="feature plan and compiled model vs pandas reference path")
+    cmd.add_argument("--rows", type=int, default=5000)
+    cmd.add_argument("--tolerance", type=float, default=1e-6)
+
+    cmd = commands.add_parser("latency", help="single-row latency of every scoring path")
+    cmd.add_argument("--rows", type=int, default=500)
+
+    args = parser.parse_args()
+
+    if args.command == "throughput":
+        throughput(args.rows, args.batch_sizes)
+
+    elif args.command == "evaluation":
+        evaluation(args.rows, args.batch_sizes)
+
+    elif args.command == "explain":
+        explain(args.rows, args.batch_sizes)
+
+    elif args.command == "parity":
+        sys.exit(0 if parity(args.rows, args.tolerance) else 1)
+
+    elif args.command == "latency":
+        latency(args.rows)
@@ -0,0 +1,79 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import ml_service
+from chunk_io import ChunkWriter, read_chunks
+
+# Default number of rows read, scored and written at a time
+CHUNK_SIZE = 100000
+
+
+def score_frame(df, threads):
+    """
+    Scores every row of a DataFrame of input features with the loaded model.
+    Returns the thresholded predictions and the probabilities as arrays.
+    """
+    plan = ml_service.active.feature_plan
+
+    # Map the columns into a matrix in the model's column order. Values
+    # that are not numbers are taken as 0, as in the live service
+    X = np.zeros((len(df), len(plan.feature_names)), dtype=np.float32)
+    for name in df.columns:
+        i = plan.index.get(name)
+        if i is not None:
+            X[:, i] = pd.to_numeric(df[name], errors="coerce").fillna(0.0)
+
+    plan.scale(X)
+
+    y_prods = ml_service.active.get_model()['best_model'].predict_proba(X, num_threads=threads)[:, 1]
+    y_pred = (y_prods > ml_service.active.threshold).astype(int)
+
+    return y_pred, y_prods
+
+
+def bulk_score(input_path, output_path, chunk_size=CHUNK_SIZE, threads=None, keep=None):
+    """
+    Scores a whole CSV/Parquet file chunk by chunk and writes the input
+    columns (or only the `keep` ones) plus `prediction` and `score` to the
+    output file. Reports the progress and throughput on stderr.
+    """
+    threads = threads or os.cpu_count()
+    writer = ChunkWriter(output_path)
+
+    rows = 0
+    start = time.perf_counter()
+    try:
+        for df in read_chunks(input_path, chunk_size):
+            y_pred, y_prods = score_frame(df, threads)
+
+            out = df[keep] if keep is not None else df
+            out = out.assign(prediction=y_pred, score=y_prods)
+            writer.write(out)
+
+            rows += len(df)
+            elapsed = time.perf_counter() - start
+            print(f"{rows} rows scored, {rows / elapsed:.1f} rows/sec", file=sys.stderr)
+    finally:
+        writer.close()
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Score a CSV or Parquet file with the ML Service model, without Redis"
+    )
+    parser.add_argument("input", help="input .csv or .parquet file")
+    parser.add_argument("output", help="output .csv or .parquet file")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--threads", type=int, default=None, help="LightGBM threads (default: all cores)")
+    parser.add_argument("--keep", nargs="+", default=None, help="input columns to copy to the output (default: all)")
+
+    args = parser.parse_args()
+
+    bulk_score(args.input, args.output, args.chunk_size, args.threads, args.keep)
@@ -0,0 +1,311 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from feature_plan import FeaturePlan
+
+
+def file_version(path):
+    """
+    Identifies a model file by the hash of its content.
+    """
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def objective_sigmoid(booster):
+    """
+    Returns the sigmoid parameter turning the raw margin of a LightGBM
+    binary classifier into a probability. Raises ValueError for other
+    objectives.
+    """
+    objective = booster.dump_model()["objective"].split()
+    if objective[0] != "binary":
+        raise ValueError(f"Unsupported objective {' '.join(objective)}")
+
+    for param in objective[1:]:
+        if param.startswith("sigmoid:"):
+            return float(param.split(":")[1])
+    return 1.0
+
+
+def raw_threshold(threshold, multiplier, offset):
+    """
+    Returns the largest float32 raw value x for which the scaled value
+    float32(float32(x * multiplier) + offset), as computed by the feature
+    plan, is <= threshold. Comparing raw values against it takes the same
+    branch as comparing scaled values against `threshold`, bit for bit.
+    """
+    multiplier = np.float32(multiplier)
+    offset = np.float32(offset)
+
+    def scaled(x):
+        return float(np.float32(np.float32(x * multiplier) + offset))
+
+    # Start from the exact inverse and walk to the boundary, one float32
+    # at a time, since the rounding of the scaling may move it a few ulps
+    with np.errstate(over="ignore"):
+        x = np.float32((threshold - float(offset)) / float(multiplier))
+
+    up = np.float32(np.inf)
+    down = np.float32(-np.inf)
+    if scaled(x) <= threshold:
+        while x != up and scaled(np.nextafter(x, up)) <= threshold:
+            x = np.nextafter(x, up)
+    else:
+        while x != down and scaled(x) > threshold:
+            x = np.nextafter(x, down)
+
+    return x
+
+
+class CompiledModel:
+    """
+    LightGBM binary classifier flattened into NumPy arrays, with the scaler
+    folded into the split thresholds.
+
+    Every tree node is a row of the node arrays, and leaves are nodes that
+    loop back to themselves, so a batch walks every tree at once for exactly
+    `depth` steps with a few vectorized gathers. The input is the unscaled
+    feature matrix in the model's column order (`FeaturePlan.fill`), and no
+    sklearn or LightGBM code runs when scoring.
+
+    It also keeps the feature plan scaling and the classification threshold,
+    so the service can boot from it alone. It is saved as one .npy file per
+    array, memory-mapped when loaded: startup doesn't deserialize anything,
+    and the worker processes share the same pages.
+    """
+
+    # Rows scored at a time, bounding the size of the node index matrices
+    BLOCK_ROWS = 1024
+
+    ARRAYS = (
+        "feature", "threshold", "nan_left", "left", "right", "value", "leaf", "roots",
+        "multiplier", "offset",
+    )
+
+    def __init__(self, feature, threshold, nan_left, left, right, value, leaf, roots,
+                 multiplier, offset, depth, sigmoid, cutoff, feature_names, sources):
+        self.feature = feature
+        self.threshold = threshold
+        self.nan_left = nan_left
+        self.left = left
+        self.right = right
+        self.value = value
+        self.leaf = leaf
+        self.roots = roots
+        self.multiplier = multiplier
+        self.offset = offset
+        self.depth = depth
+        self.sigmoid = sigmoid
+        self.cutoff = cutoff
+        self.feature_names = list(feature_names)
+        self.sources = dict(sources)
+
+    @classmethod
+    def compile(cls, booster, plan, cutoff, sources):
+        """
+        Flattens a LightGBM booster, folding in the affine scaling of the
+        feature plan. `cutoff` is the probability above which a row is
+        classified as positive. Raises ValueError for models using features this
+        evaluator doesn't implement (categorical splits, zero as missing,
+        multiclass or non sigmoid objectives).
+        """
+        dump = booster.dump_model()
+
+        sigmoid = objective_sigmoid(booster)
+        if dump["num_tree_per_iteration"] != 1:
+            raise ValueError("Unsupported multiclass model")
+
+        if dump["feature_names"] != plan.feature_names:
+            raise ValueError("The feature plan doesn't follow the model's column order")
+
+        feature, threshold, nan_left, left, right, value, leaf = [], [], [], [], [], [], []
+        roots = []
+        depth = 0
+
+        def add(node, level):
+            nonlocal depth
+
+            i = len(feature)
+            feature.append(0)
+            threshold.append(np.float32(np.inf))
+            nan_left.append(True)
+            left.append(i)
+            right.append(i)
+            value.append(0.0)
+            leaf.append(-1)
+
+            if "split_index" not in node:
+                value[i] = node["leaf_value"]
+                leaf[i] = node.get("leaf_index", 0)
+                depth = max(depth, level)
+                return i
+
+            if node["decision_type"] != "<=":
+                raise ValueError(f"Unsupported {node['decision_type']} split")
+            if node["missing_type"] == "Zero":
+                raise ValueError("Unsupported zero as missing value split")
+
+            j = node["split_feature"]
+            feature[i] = j
+            threshold[i] = raw_threshold(node["threshold"], plan.multiplier[j], plan.offset[j])
+
+            # LightGBM takes a missing value as 0 unless the split learnt
+            # where to send them
+            if node["missing_type"] == "NaN":
+                nan_left[i] = node["default_left"]
+            else:
+                nan_left[i] = 0.0 <= node["threshold"]
+
+            left[i] = add(node["left_child"], level + 1)
+            right[i] = add(node["right_child"], level + 1)
+            return i
+
+        for tree in dump["tree_info"]:
+            roots.append(add(tree["tree_structure"], 0))
+
+        return cls(
+            feature=np.array(feature, dtype=np.intp),
+            threshold=np.array(threshold, dtype=np.float32),
+            nan_left=np.array(nan_left, dtype=bool),
+            left=np.array(left, dtype=np.intp),
+            right=np.array(right, dtype=np.intp),
+            value=np.array(value, dtype=np.float64),
+            leaf=np.array(leaf, dtype=np.int32),
+            roots=np.array(roots, dtype=np.intp),
+            multiplier=plan.multiplier,
+            offset=plan.offset,
+            depth=depth,
+            sigmoid=sigmoid,
+            cutoff=cutoff,
+            feature_names=plan.feature_names,
+            sources=sources,
+        )
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name), allow_pickle=False)
+
+        # Written last, a folder without it is an incomplete export
+        metadata = {
+            "depth": self.depth,
+            "sigmoid": self.sigmoid,
+            "cutoff": self.cutoff,
+            "feature_names": self.feature_names,
+            "sources": self.sources,
+        }
+        with open(os.path.join(path, "metadata.json"), "w") as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "metadata.json")) as f:
+            metadata = json.load(f)
+
+        arrays = {
+            # Plain arrays over the mapped memory, the np.memmap subclass
+            # slows down every operation on small batches
+            name: np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False))
+            for name in cls.ARRAYS
+        }
+
+        return cls(**arrays, **metadata)
+
+    def evaluate(self, X):
+        """
+        Walks every tree once for every row of the unscaled matrix `X`.
+
+        Returns:
+            A tuple with the raw margin (sum of the leaf values) of every row,
+            and the node reached in every tree, as a (rows, trees) matrix
+            (see `leaf_index`).
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) > self.BLOCK_ROWS:
+            blocks = [self.evaluate(X[i:i + self.BLOCK_ROWS]) for i in range(0, len(X), self.BLOCK_ROWS)]
+            return (
+                np.concatenate([margin for margin, _ in blocks]),
+                np.concatenate([nodes for _, nodes in blocks]),
+            )
+
+        rows = np.arange(len(X))[:, None]
+
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            x = X[rows, self.feature[node]]
+            go_left = np.where(np.isnan(x), self.nan_left[node], x <= self.threshold[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+
+        return self.value[node].sum(axis=1), node
+
+    def leaf_index(self, nodes):
+        """
+        Maps the nodes returned by `evaluate` to the leaf index within each
+        tree, as LightGBM's `pred_leaf` reports them.
+        """
+        return self.leaf[nodes]
+
+    def raw_score(self, X):
+        """
+        Returns the raw margin (sum of the leaf values) of every row of the
+        unscaled matrix `X`.
+        """
+        return self.evaluate(X)[0]
+
+    def predict_proba(self, X):
+        """
+        Returns the probability of the positive class of every row of the
+        unscaled matrix `X`.
+        """
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * self.raw_score(X)))
+
+
+def export(model, scaler, sources, output):
+    """
+    Compiles the pickled model dict and scaler into the `output` folder.
+    Returns the compiled model, or None if the model can't be compiled, in
+    which case the service uses the pickled model.
+    """
+    # Always built from the scaler, not from an earlier export
+    plan = FeaturePlan.from_scaler(scaler, model['best_model'].feature_name_)
+
+    try:
+        compiled = CompiledModel.compile(
+            model['best_model'].booster_, plan, model['best_f1_threshold'], sources
+        )
+    except ValueError as e:
+        print(f"The model can't be compiled: {e}")
+        return None
+
+    compiled.save(output)
+
+    print(f"Exported {len(compiled.roots)} trees ({len(compiled.feature)} nodes, depth {compiled.depth}) to {output}")
+    return compiled
+
+
+def load_compiled(path, sources):
+    """
+    Loads the compiled model if it was exported from the given model files,
+    identified by `sources` ({file name: version}). Returns None otherwise,
+    so the caller falls back to the pickled model.
+    """
+    if not os.path.exists(os.path.join(path, "metadata.json")):
+        print(f"No compiled model at {path}, using the pickled model")
+        return None
+
+    try:
+        compiled = CompiledModel.load(path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Compiled model {path} can't be loaded ({e}), using the pickled model")
+        return None
+
+    if compiled.sources != sources:
+        print(f"Compiled model {path} was exported from other model files, using the pickled model")
+        return None
+
+    return compiled
@@ -0,0 +1,122 @@
+import copy
+
+import numpy as np
+
+from field_values import get_number
+
+
+class FeaturePlan:
+    """
+    Precompiled feature pipeline, built once at startup from the scaler
+    (`from_scaler`), or from a compiled model export, and the model's
+    feature names.
+
+    It holds a fixed column-index map (in the model's column order) and the
+    scaler's mean/scale folded into a single multiplier/offset pair, so a
+    request goes from the input dict to a float32 row scaled with one affine
+    transform, without building any DataFrame.
+    """
+
+    def __init__(self, feature_names, multiplier, offset, aliases=None, max_rows=1):
+        self.feature_names = list(feature_names)
+
+        # Column index of every accepted input field
+        self.index = { name: i for i, name in enumerate(self.feature_names) }
+        for alias, name in (aliases or {}).items():
+            if name in self.index:
+                self.index[alias] = self.index[name]
+
+        # Input field of every column, to report them back by that name
+        inputs = { name: alias for alias, name in (aliases or {}).items() }
+        self.input_names = [inputs.get(name, name) for name in self.feature_names]
+
+        self.multiplier = np.asarray(multiplier, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+
+        self._buffer = np.zeros((max_rows, len(self.feature_names)), dtype=np.float32)
+
+    @classmethod
+    def from_scaler(cls, scaler, feature_names, aliases=None, max_rows=1):
+        """
+        Builds the plan from a fitted StandardScaler.
+        """
+        feature_names = list(feature_names)
+
+        # Fold (x - mean) / scale into x * multiplier + offset. Columns not
+        # handled by the scaler are left untouched.
+        multiplier = np.ones(len(feature_names))
+        offset = np.zeros(len(feature_names))
+        scaler_index = { name: i for i, name in enumerate(scaler.feature_names_in_) }
+        for i, name in enumerate(feature_names):
+            j = scaler_index.get(name)
+            if j is not None:
+                multiplier[i] = 1.0 / scaler.scale_[j]
+                offset[i] = -scaler.mean_[j] / scaler.scale_[j]
+
+        return cls(feature_names, multiplier, offset, aliases=aliases, max_rows=max_rows)
+
+    def copy(self):
+        """
+        Returns a plan with the same columns and scaling and a buffer of its
+        own, for another thread.
+        """
+        plan = copy.copy(self)
+        plan._buffer = np.zeros_like(self._buffer)
+        return plan
+
+    def transform(self, batch):
+        """
+        Maps a list of input feature dicts into a scaled float32 matrix with
+        one row per input. Missing fields are taken as 0 and unknown fields
+        are ignored.
+
+        The returned array is a view over a preallocated buffer that is
+        reused on the next call.
+        """
+        return self.scale(self.fill(batch))
+
+    def fill(self, batch):
+        """
+        Same as `transform`, without applying the scaler.
+
+        Raises:
+            ValueError: If an input isn't a dict.
+        """
+        if len(batch) > len(self._buffer):
+            self._buffer = np.zeros((len(batch), len(self.feature_names)), dtype=np.float32)
+
+        X = self._buffer[:len(batch)]
+        X.fill(0.0)
+
+        index = self.index
+        for row, fields in zip(X, batch):
+            if not isinstance(fields, dict):
+                raise ValueError(f"Expected an object of features, got {type(fields).__name__}")
+
+            for key, value in fields.items():
+                i = index.get(key)
+                if i is not None:
+                    row[i] = get_number(value)
+
+        return X
+
+    def explanations(self, contributions):
+        """
+        Turns the feature contributions computed by LightGBM (`pred_contrib`),
+        a row per input with the expected value in the last column, into a
+        dict per row with the base value and the contribution of every input
+        field, in raw margin (log-odds) units.
+        """
+        names = self.input_names
+        return [
+            { "base": row[-1], "contributions": dict(zip(names, row[:-1])) }
+            for row in contributions.tolist()
+        ]
+
+    def scale(self, X):
+        """
+        Applies the scaler in place to a matrix in the model's column order.
+        """
+        X *= self.multiplier
+        X += self.offset
+        return X
@@ -0,0 +1,24 @@
+"""
+Conventions the API and the ML service must share to see the same features
+in an input. The API image vendors this file as app/model/field_values.py,
+keep both copies the same (api/tests/test_field_values.py checks it). It
+only needs the standard library.
+"""
+
+# Input fields whose name differs from the model column they feed
+FEATURE_ALIASES = {
+    "r4walk1": "r4walk1_1.Yes",
+}
+
+
+def get_number(value):
+    """
+    Converts an input field value into the number fed to the model. Values
+    that aren't numbers (text, null, lists...) are taken as 0, like missing
+    fields.
+    """
+    try:
+        return float(value)
+
+    except (ValueError, TypeError):
+        return 0.0
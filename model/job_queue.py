@@ -0,0 +1,143 @@
+import json
+import time
+
+import settings
+
+
+class ReliableQueue:
+    """
+    At-least-once consumer of the Redis job queue.
+
+    Jobs are atomically moved from the queue to a processing list when
+    taken, and only removed from it (acknowledged) once their results are
+    stored. Every taken job gets a lease: if it is not acknowledged within
+    `settings.VISIBILITY_TIMEOUT` seconds, e.g. because its worker died,
+    any worker puts it back on the queue. Jobs taken more than
+    `settings.MAX_ATTEMPTS` times, or that fail to be scored, are moved to
+    a dead-letter list and answered with an error.
+
+    Jobs are identified by their raw data, which is unique since it holds
+    the job ID.
+    """
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.processing = f"{name}:processing"
+        self.dead_letter = f"{name}:dead"
+        self.leases = f"{name}:leases"
+        self.attempts = f"{name}:attempts"
+
+        self._next_reclaim = 0
+
+    def fetch(self, batch_size, window, timeout):
+        """
+        Waits up to `timeout` seconds for a job and then keeps taking jobs
+        until there are `batch_size` of them or `window` seconds have
+        elapsed. Every job taken is leased.
+
+        Returns:
+            A tuple with the raw data of the jobs to process, and of the jobs
+            that exceeded the maximum number of attempts.
+        """
+        # Take the first job from Redis (blocking move to the processing list)
+        job = self.db.blmove(self.name, self.processing, timeout, src="RIGHT", dest="LEFT")
+        if job is None:
+            return [], []
+
+        jobs = [job]
+
+        # Take whatever else arrives within the batching window
+        deadline = time.monotonic() + window
+        while len(jobs) < batch_size:
+            pipe = self.db.pipeline(transaction=False)
+            for _ in range(batch_size - len(jobs)):
+                pipe.lmove(self.name, self.processing, src="RIGHT", dest="LEFT")
+            more = [job for job in pipe.execute() if job is not None]
+            if more:
+                jobs.extend(more)
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(settings.BATCH_POLL, remaining))
+
+        # Lease the jobs and count the attempt
+        pipe = self.db.pipeline(transaction=False)
+        lease = time.time() + settings.VISIBILITY_TIMEOUT
+        for job in jobs:
+            pipe.hset(self.leases, job, lease)
+            pipe.hincrby(self.attempts, job, 1)
+        attempts = pipe.execute()[1::2]
+
+        ready = [job for job, n in zip(jobs, attempts) if n <= settings.MAX_ATTEMPTS]
+        exhausted = [job for job, n in zip(jobs, attempts) if n > settings.MAX_ATTEMPTS]
+        return ready, exhausted
+
+    def ack(self, pipe, job):
+        """
+        Queues on the pipeline the commands removing a processed job.
+        """
+        pipe.lrem(self.processing, 1, job)
+        pipe.hdel(self.leases, job)
+        pipe.hdel(self.attempts, job)
+
+    def fail(self, pipe, job, error):
+        """
+        Queues on the pipeline the commands moving a job to the dead-letter
+        list and answering it with `error`.
+        """
+        self.ack(pipe, job)
+        pipe.lpush(self.dead_letter, job)
+
+        try:
+            job_id = json.loads(job)['id']
+        except (ValueError, KeyError, TypeError):
+            return
+
+        self.reply(pipe, job_id, {"error": error})
+
+    def reply(self, pipe, job_id, output):
+        """
+        Queues on the pipeline the commands answering a job. The reply list
+        expires after `settings.RESULT_TTL` seconds in case nobody reads it.
+        """
+        key = settings.REDIS_REPLY_PREFIX + job_id
+        pipe.lpush(key, json.dumps(output))
+        pipe.expire(key, settings.RESULT_TTL)
+
+    def reclaim(self):
+        """
+        Puts back on the queue the jobs whose lease expired, at most once
+        every `settings.RECLAIM_INTERVAL` seconds. Returns the number of
+        jobs reclaimed by this call.
+        """
+        if time.monotonic() < self._next_reclaim:
+            return 0
+        self._next_reclaim = time.monotonic() + settings.RECLAIM_INTERVAL
+
+        now = time.time()
+        leases = self.db.hgetall(self.leases)
+
+        reclaimed = 0
+        for job in self.db.lrange(self.processing, 0, -1):
+            lease = leases.get(job)
+            if lease is None:
+                # Taken but not leased yet, or its worker died in between
+                self.db.hsetnx(self.leases, job, now + settings.VISIBILITY_TIMEOUT)
+                continue
+
+            if float(lease) > now:
+                continue
+
+            # Only the worker removing the job from the processing list
+            # puts it back, so it's never queued twice
+            if self.db.lrem(self.processing, 1, job):
+                pipe = self.db.pipeline(transaction=False)
+                pipe.hdel(self.leases, job)
+                pipe.rpush(self.name, job)
+                pipe.execute()
+                reclaimed += 1
+
+        return reclaimed
@@ -0,0 +1,117 @@
+import logging
+import os
+import random
+import tempfile
+
+import settings
+
+# With several worker processes, every one of them writes its samples to
+# files in this folder and the supervisor serves them merged. It has to be
+# set before prometheus_client is imported
+if settings.WORKERS != 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="ml_service_metrics-")
+
+from prometheus_client import CollectorRegistry, Gauge, Histogram, REGISTRY, multiprocess, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+# Latency buckets (seconds), from the model call on a single row to a
+# queued job waiting behind a backlog
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+QUEUE_WAIT = Histogram(
+    "ml_service_queue_wait_seconds",
+    "Time from a job being queued by the API to a worker taking it",
+    buckets=BUCKETS,
+)
+JOB_DURATION = Histogram(
+    "ml_service_job_seconds",
+    "Time from a batch of jobs being taken to their results being stored",
+    buckets=BUCKETS,
+)
+FEATURE_TRANSFORM = Histogram(
+    "ml_service_feature_transform_seconds",
+    "Time mapping a batch of inputs into the feature matrix",
+    ["version"],
+    buckets=BUCKETS,
+)
+MODEL_SCORE = Histogram(
+    "ml_service_model_score_seconds",
+    "Time evaluating the model on a batch",
+    ["version"],
+    buckets=BUCKETS,
+)
+JOBS_IN_FLIGHT = Gauge(
+    "ml_service_jobs_in_flight",
+    "Jobs taken by the workers and not answered yet",
+    multiprocess_mode="livesum",
+)
+
+
+class QueueCollector:
+    """
+    Reports the length of the job queue, processing and dead-letter lists
+    when scraped, so the workers don't pay for it.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def collect(self):
+        gauge = GaugeMetricFamily("ml_service_queue_depth", "Jobs in the Redis lists", labels=["list"])
+
+        lists = {"queue": self.queue.name, "processing": self.queue.processing, "dead": self.queue.dead_letter}
+        try:
+            pipe = self.queue.db.pipeline(transaction=False)
+            for key in lists.values():
+                pipe.llen(key)
+            lengths = pipe.execute()
+        except Exception:
+            # An unreachable Redis just leaves the gauge out of the scrape
+            return
+
+        for name, length in zip(lists, lengths):
+            gauge.add_metric([name], length)
+        yield gauge
+
+
+def start_server(port, queue):
+    """
+    Serves the metrics of this process, or of every worker process, on
+    `port`, along with the queue lengths.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    registry.register(QueueCollector(queue))
+    start_http_server(port, registry=registry)
+
+    print(f"Serving metrics on port {port}")
+
+
+def worker_exited(pid):
+    """
+    Drops the live gauges of a worker process that exited.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+class SampledLogger:
+    """
+    Logs only a `rate` fraction of the messages, chosen at random, so the
+    per-job logs don't slow down the hot path. The messages are only
+    formatted when they are logged.
+    """
+
+    def __init__(self, name, rate):
+        self.logger = logging.getLogger(name)
+        self.rate = rate
+
+    def info(self, message, *args):
+        if self.rate > 0 and random.random() < self.rate:
+            self.logger.info(message, *args)
@@ -1,28 +1,74 @@
+import time
+
+# Startup phase timings (ms), logged and published with the readiness signal
+startup_timings = {}
+boot_clock = time.perf_counter()
+
 import os
 import json
+import logging
 import redis
-import time
-import lightgbm as lgb
-from lightgbm import LGBMClassifier
+import signal
+import socket
 import settings
+import metrics
+import redis_pool
+from model_registry import SHADOW_FILE, ModelRegistry, ModelWatcher
+from job_queue import ReliableQueue
+from supervisor import Supervisor
 
-import pandas as pd
 import numpy as np
-import joblib
-import pickle
-import skopt
 
 
-db = redis.StrictRedis(host=settings.REDIS_IP, port=settings.REDIS_PORT, db=0)
+def boot_phase(name):
+    """
+    Logs the time taken by a startup phase, since the previous one.
+    """
+    global boot_clock
 
-# Load the scaler from the pickle file
-SCALER = os.path.join(os.path.dirname(__file__), 'scaler.pkl')
-with open(SCALER, "rb") as f:
-    scaler = pickle.load(f)
+    now = time.perf_counter()
+    startup_timings[name] = round((now - boot_clock) * 1000, 1)
+    boot_clock = now
 
-# Load the LightGBM model from the pickle file
+    print(f"Startup: {name} took {startup_timings[name]} ms")
+
+
+boot_phase("imports")
+
+db = redis_pool.get_redis()
+queue = ReliableQueue(db, settings.REDIS_QUEUE)
+
+# Logs a sample of the batches processed
+log = metrics.SampledLogger("ml_service", settings.LOG_SAMPLE_RATE)
+
+# Model bundled with the service, activated when the registry doesn't have it
+SCALER = os.path.join(os.path.dirname(__file__), 'scaler.pkl')
 MODEL = os.path.join(os.path.dirname(__file__), 'variables_dict_m5_3_1.pkl')
-model = joblib.load(MODEL)
+
+registry = ModelRegistry(settings.MODEL_REGISTRY)
+
+# The version being served, results report it. It's only swapped between
+# batches, when a new version is activated
+active = registry.load_active(MODEL, SCALER, db)
+watcher = ModelWatcher(registry, db, settings.RELOAD_INTERVAL, active.version)
+
+# The candidate version scored along with the active one, only logged. It's
+# loaded by the first reload check
+shadow = None
+shadow_watcher = ModelWatcher(
+    registry, db, settings.RELOAD_INTERVAL, None, SHADOW_FILE, settings.REDIS_SHADOW_MODEL_KEY
+)
+
+boot_phase("model")
+
+# LightGBM threads used by each prediction call, 0 uses all the cores
+model_threads = settings.MODEL_THREADS
+
+# Set when the service is asked to stop, after finishing the current batch
+stopping = False
+
+# Set once this worker announced it's ready
+announced = False
 
 
 # ======== PREDICTION FUNCTION ========
@@ -30,121 +76,446 @@ def predict(str):
     """
     Runs inference using the loaded model. Returns a dict with the prediction result.
     """
+    # Convert input string to a dictionary
+    fields = json.loads(str)
 
-    print(f"Input str {type(str)}: {str}")
+    return predict_batch([fields])[0]
 
-    def get_number(value):
-        try:
-            return float(value)
-        
-        except ValueError:
-            return 0.0
 
-    # Convert input string to a dictionary
-    fields = json.loads(str)
-    values = { k: get_number(v) for k, v in fields.items()}
+def predict_batch(batch, margin=False, leaves=False, model=None, explain=False):
+    """
+    Runs inference for a list of input feature dicts using a single vectorized
+    model call. Returns a list of dicts with the prediction results, in the
+    same order as the input, optionally with the raw margin, the leaf index
+    reached in every tree and the contribution of every feature.
+    Uses the active model version unless another one is given.
+    """
+    model = model or active
+
+    if not batch:
+        return []
 
     # ----------------------------------------------------------
-    # Scale the input features
+    # Process the model, evaluating every tree once
+    raw, leaf_index, contributions = evaluate(batch, leaves, model, explain)
 
-    # Inicialize the scaler dictionary with zeros
-    dict_scaler = {}
-    for i in scaler.feature_names_in_:
-        dict_scaler[i] = 0.0
+    y_prods = model.probability(raw)
+    y_pred = (y_prods > model.threshold).astype(int)
 
-    # Update the scaler dictionary with the input values
-    for key, value in values.items():
-        if key in dict_scaler:
-            dict_scaler[key] = value
+    # Get the prediction and probability of every row
+    results = [
+        {
+            'prediction': int(prediction),
+            'probability': float(probability)
+        }
+        for prediction, probability in zip(y_pred, y_prods)
+    ]
 
-    # Convert the dictionary to a DataFrame
-    df = pd.DataFrame(dict_scaler, index=[0])
+    if margin:
+        for result, value in zip(results, raw):
+            result['margin'] = float(value)
 
-    # Scale the input features
-    transformed_data = scaler.transform(df)
+    if leaves:
+        for result, value in zip(results, leaf_index):
+            result['leaves'] = value.tolist()
 
-    # Convert the transformed data (NumPy array) back into a DataFrame
-    scale_data = pd.DataFrame(transformed_data, columns=df.columns).iloc[0].to_dict()
-    scale_values = values.copy()
+    if explain:
+        for result, explanation in zip(results, model.feature_plan.explanations(contributions)):
+            result['explanation'] = explanation
 
-    # Update the input values with the scaled values
-    for key, value in scale_data.items():
-        if key in scale_values:
-            scale_values[key] = value
+    return results
 
-    # ----------------------------------------------------------
-    # Process the model
 
-    # Convert input_dict to a DataFrame
-    X_df = pd.DataFrame([scale_values])
+def evaluate(batch, leaves, model, explain=False):
+    """
+    Evaluates the model version once on a list of input feature dicts.
+    Returns the raw margin of every row, if `leaves` is set, the leaf index
+    reached in every tree as a (rows, trees) matrix and, if `explain` is set,
+    the feature contributions as a (rows, features + 1) matrix (None
+    otherwise).
+    """
+    started = time.perf_counter()
+
+    # Map the inputs into a matrix in the model's column order
+    X = model.features(batch, explain)
+    transformed = time.perf_counter()
 
-    # Get the predictions
-    predictions = model['best_model'].predict(X_df)
-    y_prods = model['best_model'].predict_proba(X_df)[:, 1]
+    raw, leaf_index, contributions = model.score(X, leaves, explain, model_threads)
 
-    y_pred = (y_prods > model['best_f1_threshold']).astype(int)
+    metrics.FEATURE_TRANSFORM.labels(model.version).observe(transformed - started)
+    metrics.MODEL_SCORE.labels(model.version).observe(time.perf_counter() - transformed)
 
-    # Get the prediction and probability
-    return {
-        'prediction': int(y_pred[0]),
-        'probability': float(y_prods[0])
-    }
+    return raw, leaf_index, contributions
 
 # ======== REDIS LISTENER (Optional) ========
-import json
-import time
-import settings
-import pandas as pd
-# from your_ml_module import predict  # your predict() function
-# 'loaded_model' is presumably imported or accessible inside predict()
-
-def classify_process():
-    """
-    Loop indefinitely asking Redis for new jobs.
-    When a new job arrives, take it from the Redis queue, use the loaded ML
-    model to get predictions, and store the results back in Redis using
-    the original job ID.
-    """
-    while True:
-        # 1. Take a new job from Redis (blocking pop)
-        job = db.brpop(settings.REDIS_QUEUE)  
-        # job is a tuple (queue_name, job_data_bytes)
-        queue_name, job_data_bytes = job
-
-        # 2. Decode the JSON data for the given job
-        job_data = json.loads(job_data_bytes)
-
-        # 3. Get and keep the original job ID
-        job_id = job_data['id']
-
-        # 4. Prepare input features as a JSON string
-        #    e.g., if your job_data has a dict under "features":
-        input_features_json = json.dumps(job_data['features'])
-        
-        # 5. Run the loaded ML model using your predict() function
-        #    NOTE: Make sure your predict() references input_df instead of X_test 
-        #    for predict_proba if you want real-time inference.
-        result = predict(input_features_json) 
-
-        print(f"Job ID {job_id}: {result}") 
-        # result should look like {"prediction": <0/1>, "probability": <float>}
-
-        # 6. Prepare a new JSON with the results
-        output = {
-            "prediction": result['prediction'],
-            "score": result['probability']
-        }
+def classify_process(worker_id=0, counters=None):
+    """
+    Loop asking Redis for new jobs until the service is asked to stop.
+    When new jobs arrive, take up to `settings.BATCH_SIZE` of them from the
+    Redis queue, use the loaded ML model to get all the predictions in a
+    single call, and push the results back to Redis on the reply list of
+    each job. The number of rows scored is added to `counters[worker_id]`.
+    """
+    failures = 0
+    next_ready = 0
+
+    while not stopping:
+        try:
+            # Tell the API this worker has the model warm and takes jobs
+            if time.monotonic() >= next_ready:
+                publish_ready()
+                next_ready = time.monotonic() + settings.READY_INTERVAL
+
+            # Switch to a newly activated model version
+            reload_model()
+
+            # Put back on the queue the jobs abandoned by dead workers
+            queue.reclaim()
+
+            rows = process_batch()
+            failures = 0
+
+            if counters is not None:
+                counters[worker_id] += rows
+
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            # Redis is unreachable even after retrying, wait and reconnect
+            failures += 1
+            delay = redis_pool.backoff.compute(failures)
+            print(f"Redis unavailable ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    # The jobs this worker still holds are reclaimed by the others
+    try:
+        db.zrem(settings.REDIS_READY_KEY, worker_name())
+    except (redis.ConnectionError, redis.TimeoutError):
+        pass
+
 
-        # 7. Store the job results on Redis using the original job ID as the key
-        db.set(job_id, json.dumps(output))
+def warm_up():
+    """
+    Scores an empty row, so the first job doesn't pay for the lazy
+    initializations (buffers, memory-mapped pages, LightGBM's first call).
+    """
+    predict_batch([{}])
+    boot_phase("warmup")
 
-        # 8. Sleep briefly before checking for next job
-        time.sleep(settings.SERVER_SLEEP)
+    print(f"Model {active.version} ready in {sum(startup_timings.values()):.1f} ms")
 
 
+def reload_model():
+    """
+    Swaps the active and shadow models for the versions set in the registry,
+    if they changed. A new version is loaded and warmed up while the old one
+    is still in use, and jobs are never scored across the swap.
+    """
+    global active, announced, shadow
+
+    changed, version = watcher.poll()
+    if changed and version is not None:
+        model = load_version(version)
+        if model is not None:
+            print(f"Swapped model {active.version} for {version}")
+            active = model
+            watcher.swapped(version)
+
+            # Announce the worker again, with the new version
+            announced = False
+
+    changed, version = shadow_watcher.poll()
+    if changed:
+        if version is None:
+            print("Stopped shadow scoring")
+            shadow = None
+            shadow_watcher.swapped(None)
+        else:
+            model = load_version(version)
+            if model is not None:
+                print(f"Shadow scoring with model {version}")
+                shadow = model
+                shadow_watcher.swapped(version)
+
+
+def load_version(version):
+    """
+    Loads and warms up a registered model version. Returns None if it can't
+    be loaded, so the worker keeps the version it has.
+    """
+    started = time.perf_counter()
+    try:
+        model = registry.load(version)
+        predict_batch([{}], model=model)
+
+    except Exception as e:
+        print(f"Could not load model version {version} ({e})")
+        return None
+
+    print(f"Loaded model version {version} in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return model
+
+
+def score_shadow(pipe, rows, results):
+    """
+    Scores the rows of a batch with the shadow model too, and queues on the
+    pipeline the commands logging both outputs and the disagreements of the
+    two models. Returns the number of rows whose predicted class differs.
+    The jobs only ever get the primary results.
+    """
+    try:
+        shadow_results = predict_batch(rows, model=shadow)
+
+    except Exception as e:
+        # A broken candidate must not affect the primary results
+        print(f"Shadow model {shadow.version} failed ({e})")
+        return 0
+
+    primary = np.array([result['probability'] for result in results])
+    candidate = np.array([result['probability'] for result in shadow_results])
+    flips = sum(p['prediction'] != c['prediction'] for p, c in zip(results, shadow_results))
+    diff = np.abs(primary - candidate)
+
+    # One compact entry per batch: the inputs in the primary model's column
+    # order and both scores, as float32 arrays
+    pipe.xadd(
+        settings.REDIS_SHADOW_STREAM,
+        {
+            "primary": active.version,
+            "shadow": shadow.version,
+            "rows": len(rows),
+            "flips": flips,
+            "features": active.feature_plan.fill(rows).tobytes(),
+            "scores": np.stack([primary, candidate]).astype(np.float32).tobytes(),
+        },
+        maxlen=settings.SHADOW_STREAM_MAXLEN,
+        approximate=True
+    )
+
+    # Running totals of the model pair, shared by all the workers
+    stats = f"{settings.REDIS_SHADOW_STATS_PREFIX}{active.version}:{shadow.version}"
+    pipe.hincrby(stats, "rows", len(rows))
+    pipe.hincrby(stats, "flips", flips)
+    pipe.hincrbyfloat(stats, "diff_sum", float(diff.sum()))
+
+    return flips
+
+
+def worker_name():
+    """
+    Name of this worker process in the readiness signal.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def publish_ready():
+    """
+    Renews the entry of this worker in the ready set, scored by the time it
+    expires unless renewed again. The first time, also announces the worker
+    with its startup timings on the ready channel.
+    """
+    global announced
+
+    now = time.time()
+
+    pipe = db.pipeline(transaction=False)
+    pipe.zadd(settings.REDIS_READY_KEY, {worker_name(): now + settings.READY_TTL})
+
+    # Drop the workers that died without leaving the set
+    pipe.zremrangebyscore(settings.REDIS_READY_KEY, "-inf", now)
+
+    if not announced:
+        pipe.publish(settings.REDIS_READY_CHANNEL, json.dumps({
+            "worker": worker_name(),
+            "version": active.version,
+            "startup": startup_timings
+        }))
+    pipe.execute()
+
+    announced = True
+
+
+def process_batch():
+    """
+    Takes a batch of jobs from the Redis queue, scores them and pushes the
+    results back to Redis. A job holds either the features of a single row
+    or, for bulk scoring, a list of rows under "batch". Jobs setting
+    "margin", "leaves" or "explain" also get the raw margin, the leaf
+    indices or the feature contributions of every row.
+    Jobs that can't be scored are answered with an error and moved to the
+    dead-letter list. Returns the number of rows scored.
+    """
+    # 1. Take a batch of jobs from Redis, keeping them on the processing
+    #    list until their results are stored
+    jobs, exhausted = queue.fetch(
+        settings.BATCH_SIZE, settings.BATCH_WINDOW, settings.WORKER_POLL_TIMEOUT
+    )
+    if not jobs and not exhausted:
+        return 0
+
+    dequeued = time.time()
+    started = time.perf_counter()
+    metrics.JOBS_IN_FLIGHT.set(len(jobs))
+
+    pipe = db.pipeline(transaction=False)
+
+    # Jobs that were taken too many times without finishing
+    for job in exhausted:
+        queue.fail(pipe, job, "The job failed too many times")
+
+    # 2. Decode the JSON data for the given jobs
+    jobs_data = []
+    for job in jobs:
+        try:
+            job_data = json.loads(job)
+            job_rows = job_data['batch'] if 'batch' in job_data else [job_data['features']]
+            job_data['id']
+        except (ValueError, KeyError, TypeError):
+            queue.fail(pipe, job, "Invalid job data")
+            continue
+
+        jobs_data.append((job, job_data, job_rows))
+
+        # Set by the API when queuing the job
+        if 'queued_at' in job_data:
+            metrics.QUEUE_WAIT.observe(max(0.0, dequeued - job_data['queued_at']))
+
+    # 3. Run the loaded ML model on the rows of every job at once. The jobs
+    #    asking for explanations are scored in a call of their own, so the
+    #    others keep the faster path
+    margin = any(job_data.get('margin') for _, job_data, _ in jobs_data)
+    leaves = any(job_data.get('leaves') for _, job_data, _ in jobs_data)
+
+    results = []
+    scored = []
+    for explain in (False, True):
+        group = [job for job in jobs_data if bool(job[1].get('explain')) == explain]
+        if not group:
+            continue
+
+        try:
+            results.extend(predict_batch(
+                [row for _, _, job_rows in group for row in job_rows], margin, leaves, explain=explain
+            ))
+            scored.extend(group)
+
+        except Exception:
+            # Score the jobs one by one to find out which ones fail
+            for job, job_data, job_rows in group:
+                try:
+                    results.extend(predict_batch(job_rows, margin, leaves, explain=explain))
+                    scored.append((job, job_data, job_rows))
+                except Exception as e:
+                    queue.fail(pipe, job, f"The job could not be scored: {e}")
+
+    jobs_data = scored
+
+    # 3b. Score the same rows with the shadow model, if any, in a single
+    #     call too
+    flips = None
+    if shadow is not None and jobs_data:
+        scored_rows = [row for _, _, job_rows in jobs_data for row in job_rows]
+        flips = score_shadow(pipe, scored_rows, results)
+
+    results = iter(results)
+
+    # 4. Push the job results to the reply list of every job, named after
+    #    the original job ID, and remove the jobs from the processing list,
+    #    all of them in a single round trip
+    for job, job_data, job_rows in jobs_data:
+        if 'batch' in job_data:
+            output = {
+                "results": [format_result(next(results), job_data) for _ in job_rows],
+                "version": active.version
+            }
+        else:
+            output = format_result(next(results), job_data)
+            output["version"] = active.version
+
+        queue.reply(pipe, job_data['id'], output)
+        queue.ack(pipe, job)
+
+    # 5. Publish the version of the loaded model along with the results
+    if jobs_data:
+        pipe.set(settings.REDIS_MODEL_VERSION_KEY, active.version)
+    pipe.execute()
+
+    metrics.JOB_DURATION.observe(time.perf_counter() - started)
+    metrics.JOBS_IN_FLIGHT.set(0)
+
+    rows = sum(len(job_rows) for _, _, job_rows in jobs_data)
+    log.info(
+        "Processed batch of %d jobs (%d rows) in %.1f ms%s, pool %s",
+        len(jobs_data), rows, (time.perf_counter() - started) * 1000,
+        f", {flips} shadow disagreements" if flips is not None else "", redis_pool.pool_stats()
+    )
+
+    return rows
+
+
+def format_result(result, job_data):
+    """
+    Prepares the JSON output of a single row prediction, with the optional
+    outputs requested by the job.
+    """
+    output = {
+        "prediction": result['prediction'],
+        "score": result['probability']
+    }
+
+    for key in ('margin', 'leaves'):
+        if job_data.get(key):
+            output[key] = result[key]
+
+    if job_data.get('explain'):
+        output['explanation'] = result['explanation']
+
+    return output
+
+
+def stop(signum, frame):
+    """
+    Signal handler asking the service to stop once the current batch is done.
+    """
+    global stopping
+    stopping = True
+
+
+def serve_worker(worker_id, counters):
+    """
+    Entry point of every worker process forked by the supervisor.
+    """
+    global model_threads
+
+    # Don't oversubscribe the cores, every worker already has its own
+    model_threads = model_threads or 1
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    classify_process(worker_id, counters)
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
     print("Launching ML Service...")
-    # For a simple service that just listens to Redis:
-    classify_process()
+
+    # Warm the model up before taking jobs, the workers inherit it
+    warm_up()
+
+    if settings.METRICS_PORT:
+        metrics.start_server(settings.METRICS_PORT, queue)
+
+    if settings.WORKERS == 1:
+        # For a simple service that just listens to Redis:
+        signal.signal(signal.SIGTERM, stop)
+        classify_process()
+
+    else:
+        # Fork a pool of workers sharing the loaded model
+        Supervisor(
+            serve_worker,
+            workers=settings.WORKERS or os.cpu_count(),
+            report_interval=settings.REPORT_INTERVAL,
+            shutdown_timeout=settings.SHUTDOWN_TIMEOUT,
+            on_exit=metrics.worker_exited
+        ).run()
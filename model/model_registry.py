@@ -0,0 +1,487 @@
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import redis
+
+import settings
+from compiled_model import export, file_version, load_compiled, objective_sigmoid
+from feature_plan import FeaturePlan
+from field_values import FEATURE_ALIASES
+
+# Files of every registered version
+MODEL_FILE = "model.pkl"
+SCALER_FILE = "scaler.pkl"
+METADATA_FILE = "metadata.json"
+COMPILED_DIR = "compiled"
+
+# Files naming the active version, and the shadow version scored along
+# with it
+CURRENT_FILE = "CURRENT"
+SHADOW_FILE = "SHADOW"
+
+
+class ModelVersion:
+    """
+    A model version loaded for scoring: the compiled model when there is
+    one, and the feature plan, threshold and sigmoid to score with it.
+
+    The pickled model and scaler are only loaded on first use, when there
+    is no compiled model, or for the offline tools.
+    """
+
+    def __init__(self, version, model_file, scaler_file, compiled_dir=None, metadata=None):
+        self.version = version
+        self.model_file = model_file
+        self.scaler_file = scaler_file
+        self.metadata = metadata or {}
+
+        # Files a compiled model must have been exported from to be used
+        self.sources = {"model": file_version(model_file), "scaler": file_version(scaler_file)}
+
+        self._model = None
+        self._scaler = None
+
+        self.compiled = load_compiled(compiled_dir, self.sources) if compiled_dir else None
+
+        if self.compiled is not None:
+            # Compile the feature pipeline once, in the model's column order
+            self.feature_plan = FeaturePlan(
+                self.compiled.feature_names,
+                self.compiled.multiplier,
+                self.compiled.offset,
+                aliases=FEATURE_ALIASES,
+                max_rows=settings.BATCH_SIZE
+            )
+
+            # Probability above which a row is classified as positive
+            self.threshold = self.compiled.cutoff
+
+            # Turns the raw margin of the model into the positive class probability
+            self.sigmoid = self.compiled.sigmoid
+
+        else:
+            self.feature_plan = FeaturePlan.from_scaler(
+                self.get_scaler(),
+                self.get_model()['best_model'].feature_name_,
+                aliases=FEATURE_ALIASES,
+                max_rows=settings.BATCH_SIZE
+            )
+            self.threshold = self.get_model()['best_f1_threshold']
+            self.sigmoid = objective_sigmoid(self.get_model()['best_model'].booster_)
+
+    def features(self, batch, explain=False, plan=None):
+        """
+        Maps a list of input feature dicts into the matrix `score` takes for
+        them, with this version's feature plan or `plan` (a copy of it, for
+        another thread). The returned array is reused by the next call.
+        """
+        plan = plan or self.feature_plan
+
+        # The scaler is folded into the compiled trees, they take the
+        # unscaled matrix in the model's column order
+        if self.compiled is not None and not explain:
+            return plan.fill(batch)
+
+        return plan.transform(batch)
+
+    def score(self, X, leaves=False, explain=False, threads=0):
+        """
+        Evaluates the model once on the matrix returned by `features`.
+        Returns the raw margin of every row, if `leaves` is set, the leaf
+        index reached in every tree as a (rows, trees) matrix and, if
+        `explain` is set, the feature contributions as a (rows, features + 1)
+        matrix (None otherwise). `threads` is the number of LightGBM threads,
+        0 uses all the cores.
+        """
+        if explain:
+            # The contributions and the expected value add up to the raw
+            # margin, so a single TreeSHAP pass of LightGBM gives both. The
+            # compiled trees can't compute them, this takes the pickled model
+            booster = self.get_model()['best_model'].booster_
+            contributions = booster.predict(X, pred_contrib=True, num_threads=threads)
+            leaf_index = booster.predict(X, pred_leaf=True, num_threads=threads) if leaves else None
+            return contributions.sum(axis=1), leaf_index, contributions
+
+        if self.compiled is not None:
+            raw, nodes = self.compiled.evaluate(X)
+            return raw, self.compiled.leaf_index(nodes) if leaves else None, None
+
+        booster = self.get_model()['best_model'].booster_
+        raw = booster.predict(X, raw_score=True, num_threads=threads)
+
+        # LightGBM can't return both at once, the leaves take a second pass
+        leaf_index = booster.predict(X, pred_leaf=True, num_threads=threads) if leaves else None
+        return raw, leaf_index, None
+
+    def probability(self, raw):
+        """
+        Turns the raw margins returned by `score` into positive class
+        probabilities.
+        """
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * raw))
+
+    def get_scaler(self):
+        """
+        Returns the scaler, loading it from the pickle file on first use.
+        """
+        if self._scaler is None:
+            with open(self.scaler_file, "rb") as f:
+                self._scaler = pickle.load(f)
+        return self._scaler
+
+    def get_model(self):
+        """
+        Returns the dict with the LightGBM model, loading it from the pickle
+        file on first use. Loading it imports LightGBM, scikit-learn and
+        scikit-optimize, so it's skipped when there is a compiled model.
+        """
+        if self._model is None:
+            import joblib
+
+            self._model = joblib.load(self.model_file)
+        return self._model
+
+
+class ModelRegistry:
+    """
+    On-disk registry of model versions:
+
+        <root>/CURRENT              name of the active version
+        <root>/SHADOW               name of the shadow version, if any
+        <root>/<version>/
+            model.pkl               pickled dict with the LightGBM model
+            scaler.pkl
+            metadata.json           threshold, features, AUC, ...
+            compiled/               compiled model export (compiled_model.py)
+
+    A version is named after the hash of its model file. Versions are never
+    modified once registered: they are written to a temporary folder and
+    renamed into place, and CURRENT and SHADOW are replaced atomically, so a
+    worker never sees a half written version.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, version, *names):
+        return os.path.join(self.root, version, *names)
+
+    def versions(self):
+        """
+        Returns the metadata of every registered version, oldest first.
+        """
+        if not os.path.isdir(self.root):
+            return []
+
+        versions = [
+            self.metadata(name) for name in os.listdir(self.root)
+            if os.path.exists(self.path(name, METADATA_FILE))
+        ]
+        return sorted(versions, key=lambda metadata: metadata["registered_at"])
+
+    def metadata(self, version):
+        with open(self.path(version, METADATA_FILE)) as f:
+            return json.load(f)
+
+    def current(self):
+        """
+        Returns the name of the active version, or None if there isn't any.
+        """
+        return self.pointer(CURRENT_FILE)
+
+    def shadow(self):
+        """
+        Returns the name of the shadow version, or None if there isn't any.
+        """
+        return self.pointer(SHADOW_FILE)
+
+    def pointer(self, name):
+        """
+        Returns the version named by the CURRENT or SHADOW file, or None.
+        """
+        try:
+            with open(os.path.join(self.root, name)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def load(self, version):
+        """
+        Loads a registered version for scoring.
+        """
+        if not os.path.exists(self.path(version, METADATA_FILE)):
+            raise ValueError(f"Model version {version} is not registered")
+
+        return ModelVersion(
+            version,
+            self.path(version, MODEL_FILE),
+            self.path(version, SCALER_FILE),
+            compiled_dir=self.path(version, COMPILED_DIR),
+            metadata=self.metadata(version),
+        )
+
+    def load_active(self, model_file, scaler_file, db=None):
+        """
+        Loads the active version for a worker shipped with the `model_file`
+        and `scaler_file` bundled model. The bundled model is registered and
+        activated the first time a worker sees it, so an image with a new
+        model takes over a registry kept from an older image, while a version
+        activated by hand stays active when the same image restarts. If the
+        registry can't be written, the active version is loaded, or the
+        bundled model served straight from its files if there is none.
+        """
+        bundled = file_version(model_file)
+        if not os.path.exists(self.path(bundled, METADATA_FILE)):
+            try:
+                self.register(model_file, scaler_file)
+                print(f"Registered the bundled model version {bundled}")
+                self._activate_bundled(bundled, db)
+            except OSError as e:
+                print(f"Could not register the bundled model ({e})")
+
+        elif self.current() is None:
+            self._activate_bundled(bundled, db)
+
+        if self.current() is None:
+            print(f"Serving the bundled model from {model_file}")
+            return ModelVersion(bundled, model_file, scaler_file)
+
+        return self.load(self.current())
+
+    def _activate_bundled(self, version, db):
+        try:
+            self.activate(version, db)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            # CURRENT was already replaced, only the other hosts miss it
+            print(f"Could not signal the workers through Redis ({e})")
+        except OSError as e:
+            print(f"Could not activate the bundled model ({e})")
+
+    def register(self, model_file, scaler_file):
+        """
+        Adds the model and scaler files as a new version, with its metadata
+        and compiled model. Returns the version name. Registering the same
+        model file again returns the existing version.
+        """
+        import joblib
+
+        version = file_version(model_file)
+        if os.path.exists(self.path(version, METADATA_FILE)):
+            if self.metadata(version)["scaler"] != file_version(scaler_file):
+                raise ValueError(f"Model version {version} is registered with a different scaler")
+            return version
+
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".register-", dir=self.root)
+
+        try:
+            shutil.copyfile(model_file, os.path.join(staging, MODEL_FILE))
+            shutil.copyfile(scaler_file, os.path.join(staging, SCALER_FILE))
+
+            model = joblib.load(model_file)
+            with open(scaler_file, "rb") as f:
+                scaler = pickle.load(f)
+
+            sources = {"model": version, "scaler": file_version(scaler_file)}
+            compiled = export(model, scaler, sources, os.path.join(staging, COMPILED_DIR))
+
+            metadata = {
+                "version": version,
+                "registered_at": time.time(),
+                "source": os.path.basename(model_file),
+                "scaler": sources["scaler"],
+                "threshold": float(model['best_f1_threshold']),
+                "features": list(model['best_model'].feature_name_),
+                "auc": float(model['best_auc']),
+                "f1": float(model['best_f1_score']),
+                "params": model['best_params'],
+                "compiled": compiled is not None,
+            }
+            with open(os.path.join(staging, METADATA_FILE), "w") as f:
+                json.dump(metadata, f, indent=2, default=str)
+
+            os.chmod(staging, 0o755)
+            try:
+                os.rename(staging, self.path(version))
+            except OSError:
+                # Another worker registered it in the meantime
+                if not os.path.exists(self.path(version, METADATA_FILE)):
+                    raise
+                shutil.rmtree(staging, ignore_errors=True)
+
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        return version
+
+    def activate(self, version, db=None):
+        """
+        Makes `version` the active one. The workers switch to it within
+        `settings.RELOAD_INTERVAL` seconds: the ones sharing this registry
+        folder see the CURRENT file change, and the ones on every other host
+        see the Redis key change, if `db` is given.
+        """
+        self._set_pointer(CURRENT_FILE, version)
+
+        if db is not None:
+            db.set(settings.REDIS_ACTIVE_MODEL_KEY, version)
+
+    def set_shadow(self, version, db=None):
+        """
+        Makes `version` the shadow version, scored along with the active one
+        without answering any job, or stops shadow scoring if it's None. The
+        workers pick it up like an activated version.
+        """
+        if version is None:
+            try:
+                os.remove(os.path.join(self.root, SHADOW_FILE))
+            except FileNotFoundError:
+                pass
+        else:
+            self._set_pointer(SHADOW_FILE, version)
+
+        if db is not None:
+            if version is None:
+                db.delete(settings.REDIS_SHADOW_MODEL_KEY)
+            else:
+                db.set(settings.REDIS_SHADOW_MODEL_KEY, version)
+
+    def _set_pointer(self, name, version):
+        if not os.path.exists(self.path(version, METADATA_FILE)):
+            raise ValueError(f"Model version {version} is not registered")
+
+        fd, staging = tempfile.mkstemp(prefix=f".{name.lower()}-", dir=self.root)
+        with os.fdopen(fd, "w") as f:
+            f.write(version + "\n")
+        os.chmod(staging, 0o644)
+        os.replace(staging, os.path.join(self.root, name))
+
+
+class ModelWatcher:
+    """
+    Watches which active (or shadow) model version the worker should have,
+    at most once every `interval` seconds: the one last set through the
+    Redis key, shared by every host, or through the registry CURRENT (or
+    SHADOW) file of this host.
+
+    Until the worker confirms with `swapped()` that it loaded it, the
+    wanted version keeps being returned, so a failed load is retried on the
+    next check. On the first check, a Redis key set to another version than
+    `loaded`, the one the worker booted with, wins over the registry file,
+    which may be stale on this host.
+    """
+
+    def __init__(self, registry, db, interval, loaded, pointer=CURRENT_FILE, key=settings.REDIS_ACTIVE_MODEL_KEY):
+        self.registry = registry
+        self.db = db
+        self.interval = interval
+        self.pointer = pointer
+        self.key = key
+
+        self._loaded = loaded
+        self._wanted = loaded
+        self._file = loaded
+        self._signal = None
+        self._signal_seen = False
+        self._next_check = 0
+
+    def poll(self):
+        """
+        Returns a tuple telling if the wanted version differs from the one
+        the worker has, and the wanted version (None if it was removed).
+        The Redis key wins when both changed.
+        """
+        if time.monotonic() < self._next_check:
+            return False, None
+        self._next_check = time.monotonic() + self.interval
+
+        version = self.registry.pointer(self.pointer)
+        if version != self._file:
+            self._wanted = self._file = version
+
+        signal = self.db.get(self.key)
+        signal = signal.decode() if signal else None
+
+        # A key that was never set doesn't remove the version
+        if signal != self._signal and (self._signal_seen or signal is not None):
+            self._wanted = signal
+        self._signal = signal
+        self._signal_seen = True
+
+        return self._wanted != self._loaded, self._wanted
+
+    def swapped(self, version):
+        """
+        Records that the worker now has `version`.
+        """
+        self._loaded = version
+
+
+if __name__ == '__main__':
+    import redis_pool
+
+    parser = argparse.ArgumentParser(description="Manage the registered model versions")
+    parser.add_argument("--registry", default=settings.MODEL_REGISTRY)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("register", help="add a model version")
+    cmd.add_argument("model", help="pickled dict with the LightGBM model")
+    cmd.add_argument("scaler", help="pickled StandardScaler")
+    cmd.add_argument("--activate", action="store_true", help="also make it the active version")
+
+    cmd = commands.add_parser("activate", help="make a version the active one, on every worker")
+    cmd.add_argument("version")
+
+    cmd = commands.add_parser("shadow", help="score a version along with the active one, on every worker")
+    cmd.add_argument("version", nargs="?", help="version to shadow, stops shadow scoring if omitted")
+
+    commands.add_parser("list", help="list the registered versions")
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.registry)
+
+    version = None
+    if args.command == "register":
+        version = registry.register(args.model, args.scaler)
+        print(f"Registered model version {version}")
+
+        if not args.activate:
+            version = None
+
+    elif args.command == "activate":
+        version = args.version
+
+    elif args.command == "shadow":
+        try:
+            registry.set_shadow(args.version, redis_pool.get_redis())
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            print(f"Could not signal the workers through Redis ({e})")
+
+        print(f"Shadow model version {args.version}" if args.version else "Stopped shadow scoring")
+
+    elif args.command == "list":
+        current = registry.current()
+        shadow = registry.shadow()
+        for metadata in registry.versions():
+            mark = "*" if metadata['version'] == current else "s" if metadata['version'] == shadow else " "
+            print(
+                f"{mark} {metadata['version']}"
+                f"  auc={metadata['auc']:.3f}  threshold={metadata['threshold']}"
+                f"  compiled={metadata['compiled']}  source={metadata['source']}"
+            )
+
+    if version is not None:
+        try:
+            registry.activate(version, redis_pool.get_redis())
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            # CURRENT was already replaced, only the other hosts miss it
+            print(f"Could not signal the workers through Redis ({e})")
+
+        print(f"Activated model version {version}")
@@ -0,0 +1,79 @@
+import argparse
+import re
+
+import redis_pool
+import settings
+
+# Results of earlier versions were stored as strings under the bare job ID
+UUID_KEY = re.compile(rb"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# Number of keys checked per SCAN round trip
+SCAN_COUNT = 1000
+
+
+def orphaned_keys(db):
+    """
+    Yields the keys holding job results nobody will read: the bare UUID
+    string keys written by earlier versions, and the reply lists without
+    an expiration.
+    """
+    for key in db.scan_iter(count=SCAN_COUNT, _type="string"):
+        if UUID_KEY.match(key):
+            yield key
+
+    for key in db.scan_iter(match=settings.REDIS_REPLY_PREFIX + "*", count=SCAN_COUNT, _type="list"):
+        if db.ttl(key) == -1:
+            yield key
+
+
+def purge(db, dry_run=False):
+    """
+    Deletes the orphaned result keys, in batches. Returns the number of keys
+    and the memory (bytes) they were using.
+    """
+    keys = 0
+    reclaimed = 0
+
+    batch = []
+    for key in orphaned_keys(db):
+        batch.append(key)
+        if len(batch) >= SCAN_COUNT:
+            reclaimed += _purge_batch(db, batch, dry_run)
+            keys += len(batch)
+            batch = []
+
+    if batch:
+        reclaimed += _purge_batch(db, batch, dry_run)
+        keys += len(batch)
+
+    return keys, reclaimed
+
+
+def _purge_batch(db, batch, dry_run):
+    pipe = db.pipeline(transaction=False)
+    for key in batch:
+        pipe.memory_usage(key)
+    usage = sum(size or 0 for size in pipe.execute())
+
+    if not dry_run:
+        db.unlink(*batch)
+
+    return usage
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Purge the job results left in Redis that nobody will read"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be purged")
+    args = parser.parse_args()
+
+    db = redis_pool.get_redis()
+
+    used_before = db.info("memory")["used_memory"]
+    keys, reclaimed = purge(db, args.dry_run)
+    used_after = db.info("memory")["used_memory"]
+
+    action = "Would purge" if args.dry_run else "Purged"
+    print(f"{action} {keys} keys using {reclaimed / 1024 / 1024:.2f} MiB")
+    print(f"Redis used memory: {used_before / 1024 / 1024:.2f} MiB -> {used_after / 1024 / 1024:.2f} MiB")
@@ -0,0 +1,58 @@
+import redis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+
+import settings
+
+# Backoff used both for retrying commands and for the worker loop reconnects
+backoff = ExponentialBackoff(cap=settings.REDIS_BACKOFF_CAP, base=settings.REDIS_BACKOFF_BASE)
+
+# Blocking connection pool shared by every Redis client of the worker.
+# Failed commands are retried with exponential backoff, reconnecting after
+# a Redis restart, and idle connections are health checked before reuse.
+pool = redis.BlockingConnectionPool(
+    host=settings.REDIS_IP,
+    port=settings.REDIS_PORT,
+    db=settings.REDIS_DB_ID,
+    max_connections=settings.REDIS_MAX_CONNECTIONS,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    socket_keepalive=True,
+    retry=Retry(backoff, settings.REDIS_RETRIES),
+)
+
+# Client returned instead of the pool ones, see `use_client`
+_client = None
+
+
+def get_redis():
+    """
+    Returns a Redis client on the shared connection pool.
+    """
+    if _client is not None:
+        return _client
+    return redis.StrictRedis(connection_pool=pool)
+
+
+def use_client(client):
+    """
+    Makes `get_redis` return `client`, e.g. an in-memory Redis for the load
+    tests. Has to be called before importing the modules taking a client.
+    """
+    global _client
+    _client = client
+
+
+def pool_stats():
+    """
+    Returns the size metrics of the connection pool: maximum, created,
+    in use and idle connection counts.
+    """
+    created = len(pool._connections)
+    idle = sum(1 for connection in pool.pool.queue if connection is not None)
+    return {
+        "max_connections": pool.max_connections,
+        "created": created,
+        "in_use": created - idle,
+        "idle": idle,
+    }
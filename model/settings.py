@@ -13,6 +13,86 @@ REDIS_PORT = 6379
 REDIS_DB_ID = 0
 # Host IP
 REDIS_IP = os.getenv("REDIS_IP", "redis")
-# Sleep parameters which manages the
-# interval between requests to our redis queue
-SERVER_SLEEP = 0.05
+# Maximum number of connections in the pool
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 4))
+# Maximum time (seconds) to wait for a free connection from the pool
+REDIS_POOL_TIMEOUT = 5
+# Idle time (seconds) after which a connection is health checked before use
+REDIS_HEALTH_CHECK_INTERVAL = 30
+# Retries, with exponential backoff, for commands failing to reach Redis
+REDIS_RETRIES = 5
+REDIS_BACKOFF_BASE = 0.05
+REDIS_BACKOFF_CAP = 2
+# Prefix of the per-job reply lists, followed by the job ID
+REDIS_REPLY_PREFIX = "result:"
+# Time (seconds) a reply list is kept if the API doesn't read it
+RESULT_TTL = int(os.getenv("RESULT_TTL", 300))
+# Key where the version of the loaded model is published
+REDIS_MODEL_VERSION_KEY = "model_version"
+
+# BATCHING
+# Maximum number of jobs scored together in a single model call
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 32))
+# Maximum time (seconds) to wait for a batch to fill after the first job arrives
+BATCH_WINDOW = float(os.getenv("BATCH_WINDOW", 0.005))
+# Interval (seconds) between queue checks while a batch is filling
+BATCH_POLL = 0.001
+
+# RELIABLE QUEUE
+# Time (seconds) a taken job can stay unfinished before it's queued again
+VISIBILITY_TIMEOUT = int(os.getenv("VISIBILITY_TIMEOUT", 30))
+# Times a job can be taken before it's moved to the dead-letter list
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", 3))
+# Interval (seconds) between checks for jobs with an expired lease
+RECLAIM_INTERVAL = 5
+
+# WORKERS
+# Number of worker processes, 1 runs a single process and 0 one per core
+WORKERS = int(os.getenv("WORKERS", 0))
+# LightGBM threads per prediction call, 0 uses every core (1 per worker
+# when running several workers)
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", 0))
+# Maximum time (seconds) a worker waits for a job before checking if it
+# has to stop
+WORKER_POLL_TIMEOUT = 1
+# Interval (seconds) between the worker throughput reports
+REPORT_INTERVAL = 30
+# Maximum time (seconds) the workers have to finish their jobs on shutdown
+SHUTDOWN_TIMEOUT = 30
+
+# READINESS
+# Sorted set of the workers with the model warm and taking jobs, scored by
+# the time their entry expires unless renewed
+REDIS_READY_KEY = "ml_service:ready"
+# Channel announcing every worker that becomes ready
+REDIS_READY_CHANNEL = "ml_service:ready"
+# Interval (seconds) between renewals of the ready entry, and its lifetime
+READY_INTERVAL = 10
+READY_TTL = 30
+
+# MODEL REGISTRY
+# Folder with the registered model versions (model_registry.py)
+MODEL_REGISTRY = os.getenv(
+    "MODEL_REGISTRY", os.path.join(os.path.dirname(__file__), "registry")
+)
+# Key set to the version the workers must switch to when activating one
+REDIS_ACTIVE_MODEL_KEY = "model_version:active"
+# Interval (seconds) between checks for a newly activated version
+RELOAD_INTERVAL = 5
+
+# SHADOW SCORING
+# Key set to the version scored along with the active one, only logged
+REDIS_SHADOW_MODEL_KEY = "model_version:shadow"
+# Stream logging the primary and shadow outputs, one entry per batch
+REDIS_SHADOW_STREAM = "shadow:outputs"
+# Approximate number of batches kept in the stream
+SHADOW_STREAM_MAXLEN = int(os.getenv("SHADOW_STREAM_MAXLEN", 100000))
+# Prefix of the hashes with the disagreement totals, followed by
+# "<primary version>:<shadow version>"
+REDIS_SHADOW_STATS_PREFIX = "shadow:stats:"
+
+# METRICS
+# Port serving the Prometheus metrics of the workers, 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+# Fraction of the processed batches logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
@@ -0,0 +1,120 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import redis_pool
+import settings
+from chunk_io import ChunkWriter
+from model_registry import ModelRegistry
+
+# Number of stream entries (batches) read per XRANGE round trip
+PAGE_SIZE = 500
+
+
+def model_pairs(db):
+    """
+    Yields the running totals of every primary and shadow model pair scored
+    together, as dicts.
+    """
+    for key in db.scan_iter(match=settings.REDIS_SHADOW_STATS_PREFIX + "*", count=1000):
+        primary, shadow = key.decode()[len(settings.REDIS_SHADOW_STATS_PREFIX):].split(":")
+        stats = db.hgetall(key)
+
+        rows = int(stats.get(b"rows", 0))
+        flips = int(stats.get(b"flips", 0))
+        diff_sum = float(stats.get(b"diff_sum", 0.0))
+
+        yield {
+            "primary": primary,
+            "shadow": shadow,
+            "rows": rows,
+            "flips": flips,
+            "flip_rate": flips / rows if rows else 0.0,
+            "mean_abs_diff": diff_sum / rows if rows else 0.0,
+        }
+
+
+def stream_frames(db, registry):
+    """
+    Yields the shadow outputs stream as DataFrames, one per page of
+    batches, with a row per scored input: the input features, named after
+    the primary model's columns, and the score of both models.
+    """
+    feature_names = {}
+
+    def columns(version, n):
+        # Versions no longer in the registry get positional names
+        if version not in feature_names:
+            try:
+                feature_names[version] = registry.metadata(version)["features"]
+            except FileNotFoundError:
+                feature_names[version] = None
+        return feature_names[version] or [f"feature_{i}" for i in range(n)]
+
+    start = "-"
+    while True:
+        entries = db.xrange(settings.REDIS_SHADOW_STREAM, min=start, count=PAGE_SIZE)
+        if not entries:
+            return
+
+        frames = []
+        for entry_id, fields in entries:
+            rows = int(fields[b"rows"])
+            primary = fields[b"primary"].decode()
+
+            features = np.frombuffer(fields[b"features"], dtype=np.float32).reshape(rows, -1)
+            scores = np.frombuffer(fields[b"scores"], dtype=np.float32).reshape(2, rows)
+
+            df = pd.DataFrame(features, columns=columns(primary, features.shape[1]))
+            df.insert(0, "entry", entry_id.decode())
+            df.insert(1, "primary", primary)
+            df.insert(2, "shadow", fields[b"shadow"].decode())
+            df["primary_score"] = scores[0]
+            df["shadow_score"] = scores[1]
+            frames.append(df)
+
+        yield pd.concat(frames, ignore_index=True)
+
+        # Next page starts right after the last entry read
+        start = "(" + entries[-1][0].decode()
+
+
+def export(db, registry, output_path):
+    """
+    Writes the shadow outputs stream to a CSV or Parquet file. Returns the
+    number of rows written.
+    """
+    writer = ChunkWriter(output_path)
+
+    rows = 0
+    try:
+        for df in stream_frames(db, registry):
+            writer.write(df)
+            rows += len(df)
+    finally:
+        writer.close()
+
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Report how the shadow model versions compare with the primary ones"
+    )
+    parser.add_argument("--registry", default=settings.MODEL_REGISTRY)
+    parser.add_argument("--export", default=None, help="also write the logged outputs to a .csv or .parquet file")
+    args = parser.parse_args()
+
+    db = redis_pool.get_redis()
+
+    print(f"{'primary':>12} {'shadow':>12} {'rows':>10} {'flips':>8} {'flip rate':>10} {'mean |diff|':>12}")
+    for pair in model_pairs(db):
+        print(
+            f"{pair['primary']:>12} {pair['shadow']:>12} {pair['rows']:>10} {pair['flips']:>8} "
+            f"{pair['flip_rate']:>10.2%} {pair['mean_abs_diff']:>12.5f}"
+        )
+
+    if args.export:
+        rows = export(db, ModelRegistry(args.registry), args.export)
+        print(f"Exported {rows} shadow outputs to {args.export}")
@@ -0,0 +1,101 @@
+import multiprocessing
+import os
+import signal
+import time
+
+
+class Supervisor:
+    """
+    Forks a pool of worker processes and keeps it running.
+
+    Every worker runs `target(worker_id, counters)`, where `counters` is an
+    array in shared memory in which each worker adds the number of rows it
+    scored. Whatever the parent loaded before calling `run()` (the model,
+    the scaler) is shared copy-on-write with the workers.
+
+    Crashed workers are restarted, the throughput of every worker is
+    reported every `report_interval` seconds, and on SIGTERM/SIGINT the
+    workers are asked to stop, so they can finish the jobs they hold,
+    and are killed only after `shutdown_timeout` seconds. `on_exit(pid)`,
+    if given, is called for every worker process that exited.
+    """
+
+    def __init__(self, target, workers, report_interval, shutdown_timeout, on_exit=None):
+        self.target = target
+        self.workers = workers
+        self.report_interval = report_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.on_exit = on_exit
+
+        self.context = multiprocessing.get_context("fork")
+        self.counters = self.context.Array("Q", workers, lock=False)
+        self.processes = []
+        self.stopping = False
+
+    def start(self, worker_id):
+        process = self.context.Process(
+            target=self.target, args=(worker_id, self.counters), name=f"worker-{worker_id}"
+        )
+        process.start()
+        return process
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        print(f"Starting {self.workers} workers")
+        self.processes = [self.start(i) for i in range(self.workers)]
+
+        last_counts = list(self.counters)
+        last_report = time.monotonic()
+
+        while not self.stopping:
+            time.sleep(0.5)
+
+            # Restart the workers that died
+            for i, process in enumerate(self.processes):
+                if not process.is_alive() and not self.stopping:
+                    print(f"Worker {i} (pid {process.pid}) exited with code {process.exitcode}, restarting")
+                    self.exited(process)
+                    self.processes[i] = self.start(i)
+
+            if time.monotonic() - last_report >= self.report_interval:
+                last_counts, last_report = self.report(last_counts, last_report)
+
+        # Ask the workers to stop, they finish their current batch first
+        print("Stopping workers...")
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f"Worker {process.name} (pid {process.pid}) did not stop in time, killing it")
+                process.kill()
+                process.join()
+            self.exited(process)
+
+        self.report(last_counts, last_report)
+
+    def exited(self, process):
+        if self.on_exit is not None:
+            self.on_exit(process.pid)
+
+    def report(self, last_counts, last_report):
+        """
+        Prints the rows/sec of every worker since the last report.
+        """
+        counts = list(self.counters)
+        now = time.monotonic()
+        elapsed = max(now - last_report, 1e-9)
+
+        rates = [(count - last) / elapsed for count, last in zip(counts, last_counts)]
+        per_worker = ", ".join(f"{i}: {rate:.1f}" for i, rate in enumerate(rates))
+        print(f"Throughput {sum(rates):.1f} rows/sec (per worker {per_worker}), total {sum(counts)} rows")
+
+        return counts, now
@@ -0,0 +1,62 @@
+import os
+import pickle
+import sys
+
+import joblib
+import pytest
+
+# The service modules are imported from the model folder, like ml_service.py does
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MODEL_DIR)
+
+from feature_plan import FeaturePlan
+from field_values import FEATURE_ALIASES
+from model_registry import ModelVersion
+
+MODEL_FILE = os.path.join(MODEL_DIR, "variables_dict_m5_3_1.pkl")
+SCALER_FILE = os.path.join(MODEL_DIR, "scaler.pkl")
+
+
+@pytest.fixture(scope="session")
+def model():
+    return joblib.load(MODEL_FILE)
+
+
+@pytest.fixture(scope="session")
+def scaler():
+    with open(SCALER_FILE, "rb") as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(scope="session")
+def booster(model):
+    return model["best_model"].booster_
+
+
+@pytest.fixture
+def plan(model, scaler):
+    return FeaturePlan.from_scaler(scaler, model["best_model"].feature_name_, aliases=FEATURE_ALIASES)
+
+
+@pytest.fixture(scope="session")
+def pickled_version():
+    """
+    The bundled model loaded without a compiled model, scored by LightGBM.
+    """
+    return ModelVersion("bundled", MODEL_FILE, SCALER_FILE)
+
+
+@pytest.fixture(scope="session")
+def payloads(model, scaler):
+    """
+    The rows of the model's test set, unscaled back into the input dicts
+    the API sends, with the input field names.
+    """
+    X = model["X_test"].copy()
+    for j, name in enumerate(scaler.feature_names_in_):
+        if name in X:
+            X[name] = X[name] * scaler.scale_[j] + scaler.mean_[j]
+
+    inputs = {name: alias for alias, name in FEATURE_ALIASES.items()}
+    X.columns = [inputs.get(name, name) for name in X.columns]
+    return X.to_dict("records")
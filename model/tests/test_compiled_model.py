@@ -0,0 +1,160 @@
+import lightgbm as lgb
+import numpy as np
+import pytest
+from compiled_model import CompiledModel, load_compiled, raw_threshold
+from feature_plan import FeaturePlan
+
+
+@pytest.fixture
+def compiled(model, booster, plan):
+    return CompiledModel.compile(booster, plan, model["best_f1_threshold"], {"model": "test"})
+
+
+def splits(booster):
+    """
+    Yields the node index, feature and threshold of every split of the
+    booster, with the node indices `CompiledModel.compile` gives them.
+    """
+    index = 0
+
+    def walk(node):
+        nonlocal index
+        i = index
+        index += 1
+        if "split_index" in node:
+            yield i, node["split_feature"], node["threshold"]
+            yield from walk(node["left_child"])
+            yield from walk(node["right_child"])
+
+    for tree in booster.dump_model()["tree_info"]:
+        yield from walk(tree["tree_structure"])
+
+
+def scaled(plan, X):
+    return plan.scale(np.array(X, dtype=np.float32))
+
+
+def assert_same_as_booster(compiled, booster, plan, X):
+    raw, nodes = compiled.evaluate(X)
+    expected_raw = booster.predict(scaled(plan, X), raw_score=True)
+
+    np.testing.assert_array_equal(compiled.leaf_index(nodes), booster.predict(scaled(plan, X), pred_leaf=True))
+    np.testing.assert_allclose(raw, expected_raw, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(
+        compiled.predict_proba(X), 1.0 / (1.0 + np.exp(-compiled.sigmoid * expected_raw)), rtol=0, atol=1e-12
+    )
+
+
+def test_real_rows_match_the_booster(compiled, model, booster, plan, payloads):
+    X = plan.fill(payloads).copy()
+
+    assert_same_as_booster(compiled, booster, plan, X)
+    np.testing.assert_allclose(
+        compiled.predict_proba(X), model["best_model"].predict_proba(scaled(plan, X))[:, 1], rtol=0, atol=1e-9
+    )
+
+
+def test_rows_at_every_split_threshold_match_the_booster(compiled, booster, plan, payloads):
+    base = plan.fill(payloads[:1]).copy()[0]
+
+    rows = []
+    for i, feature, _ in splits(booster):
+        threshold = compiled.threshold[i]
+        for value in (np.nextafter(threshold, np.float32(-np.inf)), threshold, np.nextafter(threshold, np.float32(np.inf))):
+            row = base.copy()
+            row[feature] = value
+            rows.append(row)
+
+    assert_same_as_booster(compiled, booster, plan, np.array(rows))
+
+
+def test_missing_and_unseen_values_match_the_booster(compiled, booster, plan, payloads):
+    base = plan.fill(payloads[:1]).copy()[0]
+
+    rows = [np.full_like(base, np.nan), np.full_like(base, 7.0), np.zeros_like(base)]
+    for j in range(len(base)):
+        # Missing, way out of the training range, and a category the flags never had
+        for value in (np.nan, np.inf, -np.inf, 1e30, -1e30, -1.0, 7.0):
+            row = base.copy()
+            row[j] = value
+            rows.append(row)
+
+    assert_same_as_booster(compiled, booster, plan, np.array(rows))
+
+
+def test_inputs_that_are_not_numbers_match_the_booster(compiled, booster, plan):
+    X = plan.fill([{"r4agey": "nan"}, {"r4agey": "inf"}, {"r4agey": "old", "r4walk1": "Yes"}]).copy()
+
+    assert np.isnan(X[0]).any()
+    assert_same_as_booster(compiled, booster, plan, X)
+
+
+def test_thresholds_are_folded_to_the_raw_boundary(compiled, booster, plan):
+    for i, feature, threshold in splits(booster):
+        x = compiled.threshold[i]
+        multiplier = plan.multiplier[feature]
+        offset = plan.offset[feature]
+
+        assert x == raw_threshold(threshold, multiplier, offset)
+
+        # The largest raw value taking the left branch once scaled, LightGBM
+        # compares the scaled float32 value as a double
+        row = np.zeros((1, len(plan.feature_names)), dtype=np.float32)
+        row[0, feature] = x
+        assert float(scaled(plan, row)[0, feature]) <= threshold
+        row[0, feature] = np.nextafter(x, np.float32(np.inf))
+        assert float(scaled(plan, row)[0, feature]) > threshold
+
+
+@pytest.mark.parametrize("threshold", [-2.5, -1e-3, 0.0, 1e-35, 0.37668185803255105, 1.2345, 1e6])
+@pytest.mark.parametrize("multiplier, offset", [(1.0, 0.0), (0.1, -3.3), (1 / 7, 0.25), (1 / 365, -0.5)])
+def test_raw_threshold(threshold, multiplier, offset):
+    multiplier = np.float32(multiplier)
+    offset = np.float32(offset)
+
+    def scale(x):
+        return float(np.float32(np.float32(x * multiplier) + offset))
+
+    x = raw_threshold(threshold, multiplier, offset)
+
+    assert scale(x) <= threshold
+    assert scale(np.nextafter(x, np.float32(np.inf))) > threshold
+
+
+def test_learnt_missing_value_splits_match_the_booster():
+    # The bundled model has no split sending NaN a learnt way, train one
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 3))
+    y = (X[:, 0] + X[:, 1] > 0).astype(int)
+    X[rng.random(X.shape) < 0.2] = np.nan
+    y[np.isnan(X[:, 0])] = 1
+
+    booster = lgb.train(
+        {"objective": "binary", "num_leaves": 8, "min_data_in_leaf": 5, "verbose": -1},
+        lgb.Dataset(X, y, feature_name=["a", "b", "c"]),
+        num_boost_round=20,
+    )
+    assert any(
+        node.get("missing_type") == "NaN"
+        for tree in booster.dump_model()["tree_info"]
+        for node in [tree["tree_structure"]]
+    )
+
+    plan = FeaturePlan(["a", "b", "c"], [0.5, 2.0, 1.0], [1.0, -3.0, 0.0])
+    compiled = CompiledModel.compile(booster, plan, 0.5, {"model": "test"})
+
+    raw = X.astype(np.float32)
+    raw = (raw - plan.offset) / plan.multiplier
+    assert_same_as_booster(compiled, booster, plan, raw.astype(np.float32))
+
+
+def test_saved_model_is_loaded_memory_mapped(compiled, booster, plan, payloads, tmp_path):
+    compiled.save(tmp_path)
+    loaded = load_compiled(tmp_path, {"model": "test"})
+
+    assert loaded.feature_names == plan.feature_names
+    assert loaded.cutoff == compiled.cutoff
+    assert_same_as_booster(loaded, booster, plan, plan.fill(payloads).copy())
+
+    # Exported from other model files
+    assert load_compiled(tmp_path, {"model": "other"}) is None
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+from compiled_model import objective_sigmoid
+from field_values import FEATURE_ALIASES, get_number
+
+
+def reference_transform(batch, model, scaler):
+    """
+    Pandas reference implementation of the feature pipeline (the previous
+    per-request path), returning the scaled DataFrame the model was scored on.
+    """
+    feature_names = model["best_model"].feature_name_
+    values = [{FEATURE_ALIASES.get(k, k): get_number(v) for k, v in fields.items()} for fields in batch]
+
+    rows = [{i: row.get(i, 0.0) for i in scaler.feature_names_in_} for row in values]
+    df = pd.DataFrame(rows, columns=scaler.feature_names_in_)
+    scaled = pd.DataFrame(scaler.transform(df), columns=df.columns).to_dict("records")
+
+    scale_values = [{k: s.get(k, v) for k, v in row.items()} for row, s in zip(values, scaled)]
+    return pd.DataFrame(scale_values).reindex(columns=feature_names, fill_value=0.0)
+
+
+def test_transform_matches_the_pandas_reference(plan, model, scaler, payloads):
+    expected = reference_transform(payloads, model, scaler).to_numpy()
+
+    np.testing.assert_allclose(plan.transform(payloads), expected, rtol=1e-6, atol=1e-6)
+
+
+def test_missing_unknown_and_non_numeric_fields_are_zero(plan, model, scaler):
+    batch = [{}, {"unknown": 5, "r4agey": "old", "r4mobila": None, "r4nagi10": [1]}]
+    zeros = {name: 0 for name in plan.input_names}
+    expected = reference_transform([zeros, zeros], model, scaler).to_numpy()
+
+    np.testing.assert_allclose(plan.transform(batch), expected, rtol=1e-6, atol=1e-6)
+
+
+def test_aliases_feed_their_column(plan):
+    column = plan.feature_names.index("r4walk1_1.Yes")
+
+    assert plan.fill([{"r4walk1": 1}])[0, column] == 1.0
+    assert plan.fill([{"r4walk1_1.Yes": 1}])[0, column] == 1.0
+    assert plan.input_names[column] == "r4walk1"
+
+
+def test_rows_that_are_not_objects_are_refused(plan):
+    with pytest.raises(ValueError):
+        plan.fill([{"r4agey": 70}, 5])
+
+
+def test_copy_has_a_buffer_of_its_own(plan, payloads):
+    other = plan.copy()
+    X = plan.fill(payloads[:1])
+    other.fill(payloads[1:2])
+
+    np.testing.assert_array_equal(X, plan.copy().fill(payloads[:1]))
+
+
+def test_single_pass_matches_the_booster(model, scaler, booster, pickled_version, payloads):
+    version = pickled_version
+    raw, leaves, contributions = version.score(version.features(payloads))
+    reference = reference_transform(payloads, model, scaler)
+
+    np.testing.assert_allclose(raw, booster.predict(reference, raw_score=True), rtol=0, atol=1e-6)
+    assert leaves is None and contributions is None
+
+    expected = model["best_model"].predict_proba(reference)[:, 1]
+    probabilities = version.probability(raw)
+    np.testing.assert_allclose(probabilities, expected, rtol=0, atol=1e-6)
+    assert version.sigmoid == objective_sigmoid(booster)
+    assert ((probabilities > version.threshold) == (expected > version.threshold)).all()
+
+
+def test_explained_scores_add_up_to_the_raw_margin(booster, pickled_version, payloads):
+    version = pickled_version
+    X = version.features(payloads, explain=True)
+    expected = booster.predict(X, raw_score=True)
+
+    raw, _, contributions = version.score(X, explain=True)
+
+    np.testing.assert_allclose(raw, expected, rtol=0, atol=1e-9)
+    assert contributions.shape == (len(payloads), len(version.feature_plan.feature_names) + 1)
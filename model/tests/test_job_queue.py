@@ -0,0 +1,153 @@
+import json
+import time
+
+import fakeredis
+import pytest
+import settings
+from job_queue import ReliableQueue
+
+
+@pytest.fixture
+def db():
+    return fakeredis.FakeStrictRedis()
+
+
+@pytest.fixture
+def queue(db):
+    return ReliableQueue(db, "jobs")
+
+
+def push(db, *ids):
+    jobs = [json.dumps({"id": job_id, "features": {}}).encode() for job_id in ids]
+    for job in jobs:
+        db.lpush("jobs", job)
+    return jobs
+
+
+def expire_leases(db, queue):
+    for job in db.hkeys(queue.leases):
+        db.hset(queue.leases, job, time.time() - 1)
+    # Reclaim checks at most every RECLAIM_INTERVAL seconds
+    queue._next_reclaim = 0
+
+
+def test_fetch_leases_the_jobs_in_queue_order(db, queue):
+    jobs = push(db, "a", "b", "c")
+
+    ready, exhausted = queue.fetch(2, 0, 1)
+
+    assert ready == jobs[:2]
+    assert exhausted == []
+    assert db.lrange("jobs", 0, -1) == [jobs[2]]
+    assert sorted(db.lrange(queue.processing, 0, -1)) == sorted(jobs[:2])
+    for job in ready:
+        assert float(db.hget(queue.leases, job)) > time.time()
+        assert db.hget(queue.attempts, job) == b"1"
+
+
+def test_fetch_returns_nothing_when_the_queue_is_empty(queue):
+    assert queue.fetch(2, 0, 0.01) == ([], [])
+
+
+def test_ack_removes_the_job(db, queue):
+    push(db, "a")
+    [job], _ = queue.fetch(1, 0, 1)
+
+    pipe = db.pipeline()
+    queue.ack(pipe, job)
+    pipe.execute()
+
+    assert db.llen(queue.processing) == 0
+    assert not db.hexists(queue.leases, job)
+    assert not db.hexists(queue.attempts, job)
+
+
+def test_expired_lease_is_queued_again(db, queue):
+    [job] = push(db, "a")
+    queue.fetch(1, 0, 1)
+    expire_leases(db, queue)
+
+    assert queue.reclaim() == 1
+
+    assert db.lrange("jobs", 0, -1) == [job]
+    assert db.llen(queue.processing) == 0
+    assert not db.hexists(queue.leases, job)
+
+    # Taken again, as a second attempt
+    assert queue.fetch(1, 0, 1) == ([job], [])
+    assert db.hget(queue.attempts, job) == b"2"
+
+
+def test_live_lease_is_kept(db, queue):
+    push(db, "a")
+    queue.fetch(1, 0, 1)
+    queue._next_reclaim = 0
+
+    assert queue.reclaim() == 0
+    assert db.llen(queue.processing) == 1
+
+
+def test_job_taken_without_a_lease_gets_one(db, queue):
+    # A worker died between taking the job and leasing it
+    [job] = push(db, "a")
+    db.lmove("jobs", queue.processing, "RIGHT", "LEFT")
+    queue._next_reclaim = 0
+
+    assert queue.reclaim() == 0
+    assert float(db.hget(queue.leases, job)) > time.time()
+
+    expire_leases(db, queue)
+    assert queue.reclaim() == 1
+
+
+def test_reclaim_runs_at_most_once_per_interval(db, queue):
+    push(db, "a")
+    queue.fetch(1, 0, 1)
+    queue.reclaim()
+    expire_leases(db, queue)
+    queue._next_reclaim = time.monotonic() + settings.RECLAIM_INTERVAL
+
+    assert queue.reclaim() == 0
+    assert db.llen(queue.processing) == 1
+
+
+def test_job_is_dead_lettered_after_the_maximum_attempts(db, queue):
+    [job] = push(db, "a")
+
+    for _ in range(settings.MAX_ATTEMPTS):
+        assert queue.fetch(1, 0, 1) == ([job], [])
+        expire_leases(db, queue)
+        assert queue.reclaim() == 1
+
+    assert queue.fetch(1, 0, 1) == ([], [job])
+
+    pipe = db.pipeline()
+    queue.fail(pipe, job, "The job failed too many times")
+    pipe.execute()
+
+    assert db.lrange(queue.dead_letter, 0, -1) == [job]
+    assert db.llen(queue.processing) == 0
+    assert not db.hexists(queue.attempts, job)
+    assert json.loads(db.lpop(settings.REDIS_REPLY_PREFIX + "a")) == {"error": "The job failed too many times"}
+
+
+def test_invalid_job_is_dead_lettered_without_a_reply(db, queue):
+    db.lpush("jobs", b"not json")
+    [job], _ = queue.fetch(1, 0, 1)
+
+    pipe = db.pipeline()
+    queue.fail(pipe, job, "Invalid job data")
+    pipe.execute()
+
+    assert db.lrange(queue.dead_letter, 0, -1) == [b"not json"]
+    assert db.keys(settings.REDIS_REPLY_PREFIX + "*") == []
+
+
+def test_reply_expires(db, queue):
+    pipe = db.pipeline()
+    queue.reply(pipe, "a", {"prediction": 1})
+    pipe.execute()
+
+    key = settings.REDIS_REPLY_PREFIX + "a"
+    assert json.loads(db.lindex(key, 0)) == {"prediction": 1}
+    assert 0 < db.ttl(key) <= settings.RESULT_TTL